@@ -0,0 +1,271 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, UTC
+import numpy as np
+from dotenv import load_dotenv
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import insert
+from models import Ride, RideStatus, DetourScoreLog
+from matching import claim_driver, claim_ride
+
+load_dotenv()
+MATCHING_MODE = os.getenv("MATCHING_MODE", "greedy")  # "greedy" or "batch"
+BATCH_WINDOW_S = float(os.getenv("BATCH_WINDOW_S", "2"))
+BATCH_MAX_RIDES = int(os.getenv("BATCH_MAX_RIDES", "500"))
+
+# Stand-in for "not allowed" so the solver always sees finite costs
+INFEASIBLE = 1e9
+
+logger = logging.getLogger(__name__)
+
+
+# -----------------------
+# Assignment Solvers
+# -----------------------
+def solve_assignment(cost):
+    """Minimum-cost assignment (Hungarian / shortest augmenting path) with
+    the inner column scan vectorized in NumPy. Accepts a rectangular matrix
+    and returns (row, col) pairs whose cost is below INFEASIBLE."""
+    cost = np.asarray(cost, dtype=float)
+    if cost.size == 0:
+        return []
+    cost = np.where(np.isfinite(cost), cost, INFEASIBLE)
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+
+    # 1-indexed potentials and column owners, column 0 is the virtual start
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    owner = np.zeros(m + 1, dtype=int)
+    way = np.zeros(m + 1, dtype=int)
+
+    for i in range(1, n + 1):
+        owner[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = owner[j0]
+            free = ~used[1:]
+            reduced = cost[i0 - 1] - u[i0] - v[1:]
+            better = free & (reduced < minv[1:])
+            minv[1:][better] = reduced[better]
+            way[1:][better] = j0
+
+            candidates = np.where(free, minv[1:], np.inf)
+            j1 = int(np.argmin(candidates)) + 1
+            delta = candidates[j1 - 1]
+
+            u[owner[used]] += delta
+            v[used] -= delta
+            minv[~used] -= delta
+            j0 = j1
+            if owner[j0] == 0:
+                break
+
+        while j0:
+            j1 = way[j0]
+            owner[j0] = owner[j1]
+            j0 = j1
+
+    pairs = []
+    for j in range(1, m + 1):
+        if owner[j]:
+            row, col = owner[j] - 1, j - 1
+            if cost[row, col] < INFEASIBLE:
+                pairs.append((col, row) if transposed else (row, col))
+    return sorted(pairs)
+
+
+def greedy_assignment(cost):
+    """What per-ride assign_driver does: each row in order takes its cheapest
+    still-free column."""
+    cost = np.asarray(cost, dtype=float)
+    taken = np.zeros(cost.shape[1], dtype=bool) if cost.ndim == 2 else np.zeros(0, dtype=bool)
+    pairs = []
+    for row in range(cost.shape[0] if cost.size else 0):
+        options = np.where(taken | ~np.isfinite(cost[row]), np.inf, cost[row])
+        col = int(np.argmin(options))
+        if np.isfinite(options[col]):
+            taken[col] = True
+            pairs.append((row, col))
+    return pairs
+
+
+def total_cost(cost, pairs):
+    return float(sum(cost[r][c] for r, c in pairs))
+
+
+async def cost_matrix(provider, rides, candidates):
+    """Rides x drivers matrix of time-to-pickup (s); pairs that were not
+    routed or exceed the driver's detour limit are inf.
+
+    candidates is {ride_id: [DriverProfile-like, ...]}. Returns (cost, driver_ids).
+    """
+    drivers = {}
+    for ride in rides:
+        for d in candidates.get(ride.id, []):
+            drivers.setdefault(d.user_id, d)
+    driver_ids = list(drivers)
+    column = {driver_id: j for j, driver_id in enumerate(driver_ids)}
+
+    # Each ride only routes its own nearby drivers; everything else stays infeasible
+    times = await asyncio.gather(*(
+        provider.travel_times(
+            [(d.lat, d.lng) for d in candidates.get(ride.id, [])],
+            (ride.pickup_lat, ride.pickup_lng)
+        ) for ride in rides
+    ))
+
+    cost = np.full((len(rides), len(driver_ids)), np.inf)
+    for i, (ride, durations) in enumerate(zip(rides, times)):
+        for driver, duration in zip(candidates.get(ride.id, []), durations):
+            if duration is not None and duration / 60.0 <= driver.max_detour_minutes:
+                cost[i, column[driver.user_id]] = duration
+    return cost, driver_ids
+
+
+# -----------------------
+# Batch Matcher
+# -----------------------
+class BatchMatcher:
+    """Matches every requested ride in a window at once.
+
+    candidate_loader(db, rides) returns {ride_id: [DriverProfile, ...]} of
+    idle drivers worth routing for each ride. on_assigned(ride, driver_id,
+    accepted_at) runs for each committed match.
+    """
+
+    def __init__(self, session_factory, provider, candidate_loader, on_assigned=None,
+                 window_s=BATCH_WINDOW_S, max_rides=BATCH_MAX_RIDES):
+        self.session_factory = session_factory
+        self.provider = provider
+        self.candidate_loader = candidate_loader
+        self.on_assigned = on_assigned
+        self.window_s = window_s
+        self.max_rides = max_rides
+        self.last_report = None
+        self._task = None
+
+    def _load(self, ride_ids):
+        db = self.session_factory()
+        try:
+            query = db.query(Ride).filter(Ride.status == RideStatus.requested)
+            if ride_ids:
+                query = query.filter(Ride.id.in_(ride_ids))
+            rides = query.order_by(Ride.created_at).limit(self.max_rides).all()
+            candidates = self.candidate_loader(db, rides) if rides else {}
+            db.expunge_all()
+            return rides, candidates
+        finally:
+            db.close()
+
+    def _commit(self, rides, driver_ids, cost, pairs):
+        now = datetime.now(UTC)
+        db = self.session_factory()
+        try:
+            committed, lost = [], set()
+            for i, j in pairs:
+                # A concurrent assign_driver may have taken the ride or the driver already;
+                # the ride stays requested for the next window. Each pair claims in its own
+                # savepoint so a lost ride doesn't keep the seat its driver claim took
+                savepoint = db.begin_nested()
+                if claim_driver(db, driver_ids[j]) and claim_ride(db, rides[i].id, driver_ids[j], now):
+                    savepoint.commit()
+                    committed.append((i, j))
+                else:
+                    savepoint.rollback()
+                    lost.add(i)
+
+            # Rides left unmatched this window keep their evaluations too
+            chosen = set(committed)
+            log_rows = [
+                {
+                    "ride_id": rides[i].id,
+                    "driver_id": driver_ids[j],
+                    "detour_duration_s": int(cost[i, j]),
+                    "assigned_at": now,
+                    "was_accepted": 1 if (i, j) in chosen else 0
+                }
+                for i in range(len(rides)) if i not in lost
+                for j in np.flatnonzero(np.isfinite(cost[i]))
+            ]
+            if log_rows:
+                db.execute(insert(DetourScoreLog), log_rows)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+        if self.on_assigned:
+            for i, j in committed:
+                self.on_assigned(rides[i], driver_ids[j], now)
+        return committed
+
+    async def run_batch(self, ride_ids=None):
+        started = time.perf_counter()
+        rides, candidates = await run_in_threadpool(self._load, ride_ids)
+        if not rides:
+            return {"rides": 0, "matched": 0}
+
+        cost, driver_ids = await cost_matrix(self.provider, rides, candidates)
+
+        solve_started = time.perf_counter()
+        pairs = solve_assignment(cost)
+        solve_ms = (time.perf_counter() - solve_started) * 1000
+        greedy = greedy_assignment(cost)
+
+        committed = await run_in_threadpool(self._commit, rides, driver_ids, cost, pairs)
+        elapsed = time.perf_counter() - started
+
+        report = {
+            "rides": len(rides),
+            "drivers": len(driver_ids),
+            "matched": len(committed),
+            "total_detour_s": total_cost(cost, committed),
+            "greedy_matched": len(greedy),
+            "greedy_total_detour_s": total_cost(cost, greedy),
+            "solve_ms": round(solve_ms, 3),
+            "batch_ms": round(elapsed * 1000, 3),
+            "rides_per_s": round(len(committed) / elapsed, 1) if elapsed else None,
+            "assignments": [
+                {"ride_id": rides[i].id, "driver_id": driver_ids[j], "detour_duration_s": int(cost[i, j])}
+                for i, j in committed
+            ]
+        }
+        # Like-for-like only when both matched the same number of rides
+        if report["matched"] == report["greedy_matched"]:
+            report["detour_saved_s"] = report["greedy_total_detour_s"] - report["total_detour_s"]
+        self.last_report = report
+        return report
+
+    # ---- windowed background mode ----
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.window_s)
+            try:
+                report = await self.run_batch()
+                if report["rides"]:
+                    logger.info("Batch matched %d/%d rides in %.1f ms",
+                                report["matched"], report["rides"], report["batch_ms"])
+            except Exception:
+                logger.exception("Batch matching window failed")
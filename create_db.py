@@ -1,5 +1,5 @@
 from sqlalchemy import create_engine
-from models import Base, LocationUpdate, DriverProfile
+from migrations import migrate
 import os
 from dotenv import load_dotenv
 
@@ -10,6 +10,6 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 # Create engine (MUST come before using it)
 engine = create_engine(DATABASE_URL)
 
-# Create all tables
-Base.metadata.create_all(bind=engine)
-print("Tables created")
+# Apply pending schema migrations
+applied = migrate(engine)
+print(f"Applied migrations: {', '.join(applied)}" if applied else "Schema up to date")
@@ -0,0 +1,135 @@
+import logging
+import os
+import threading
+from collections import Counter
+from datetime import datetime, UTC
+from dotenv import load_dotenv
+from sqlalchemy import func
+from models import ACTIVE_STATUSES, Ride, RideStatus, User
+
+load_dotenv()
+DASHBOARD_RECONCILE_S = float(os.getenv("DASHBOARD_RECONCILE_S", "60"))
+
+logger = logging.getLogger(__name__)
+
+
+# -----------------------
+# Maintained Counters
+# -----------------------
+class DashboardCounters:
+    """Ride and driver counts kept up to date by the state-transition
+    endpoints, so /admin_dashboard never scans the rides table.
+
+    Counts are per-process; the periodic reconcile() against the true counts
+    corrects drift from other workers or out-of-band writes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.rides = Counter()          # RideStatus -> count
+        self.roles = Counter()          # "driver" / "rider" -> count
+        self.active_drivers = Counter()  # driver_id -> active ride count
+        self.reconciled_at = None
+
+    # ---- transitions ----
+
+    def ride_created(self, status=RideStatus.requested):
+        with self._lock:
+            self.rides[status] += 1
+
+    def ride_moved(self, old, new, acquired_driver=None, released_driver=None):
+        with self._lock:
+            self.rides[old] -= 1
+            self.rides[new] += 1
+            if acquired_driver:
+                self.active_drivers[acquired_driver] += 1
+            if released_driver and self.active_drivers[released_driver] > 0:
+                self.active_drivers[released_driver] -= 1
+                if not self.active_drivers[released_driver]:
+                    del self.active_drivers[released_driver]
+
+    # ---- reads ----
+
+    def snapshot(self):
+        with self._lock:
+            return summarize(self.rides, self.roles, self.active_drivers)
+
+    # ---- reconciliation ----
+
+    def reconcile(self, db):
+        """Reload true counts with one GROUP BY per table."""
+        rides, roles, active = count_exact(db)
+        with self._lock:
+            self.rides = rides
+            self.roles = roles
+            self.active_drivers = active
+            self.reconciled_at = datetime.now(UTC)
+
+
+def summarize(rides, roles, active_drivers):
+    total_drivers = roles["driver"]
+    return {
+        "total_rides": sum(rides.values()),
+        "completed_rides": rides[RideStatus.completed],
+        "cancelled_rides": rides[RideStatus.cancelled],
+        "in_progress_rides": rides[RideStatus.in_progress],
+        "total_drivers": total_drivers,
+        "active_drivers": len(active_drivers),
+        "idle_drivers": max(total_drivers - len(active_drivers), 0),
+        "total_riders": roles["rider"]
+    }
+
+
+def count_exact(db):
+    rides = Counter({
+        status: count for status, count in
+        db.query(Ride.status, func.count(Ride.id)).group_by(Ride.status).all()
+    })
+    roles = Counter({
+        role: count for role, count in
+        db.query(User.role, func.count(User.id)).group_by(User.role).all()
+    })
+    active = Counter({
+        driver_id: count for driver_id, count in
+        db.query(Ride.driver_id, func.count(Ride.id)).filter(
+            Ride.status.in_(ACTIVE_STATUSES),
+            Ride.driver_id.isnot(None)
+        ).group_by(Ride.driver_id).all()
+    })
+    return rides, roles, active
+
+
+# -----------------------
+# Periodic Reconciler
+# -----------------------
+class Reconciler:
+    def __init__(self, counters, session_factory, interval_s=DASHBOARD_RECONCILE_S):
+        self.counters = counters
+        self.session_factory = session_factory
+        self.interval_s = interval_s
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self):
+        db = self.session_factory()
+        try:
+            self.counters.reconcile(db)
+        except Exception:
+            logger.exception("Dashboard counter reconciliation failed")
+        finally:
+            db.close()
+
+    def start(self):
+        self.run_once()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="dashboard-reconcile", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            self.run_once()
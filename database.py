@@ -1,12 +1,155 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import sessionmaker, declarative_base, Session
+from sqlalchemy.pool import QueuePool
 import os
+import threading
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Optional streaming replica for read-only endpoints; unset = read from the primary
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(bind=engine)
+# Per engine; size workers x (pool + overflow) against the server's max_connections
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT_S = float(os.getenv("DB_POOL_TIMEOUT_S", "30"))
+DB_POOL_RECYCLE_S = int(os.getenv("DB_POOL_RECYCLE_S", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+
+# Statement timeouts (Postgres only; 0 = none). The default covers every
+# connection; endpoints override it per transaction, e.g.
+# DB_ENDPOINT_TIMEOUTS_MS="rider_history=1500,admin_dashboard=20000"
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+ENDPOINT_TIMEOUTS_MS = {
+    "get_location": 500,
+    "rider_history": 2000,
+    "driver_dashboard": 2000,
+    "admin_dashboard": 30000,
+}
+for item in filter(None, os.getenv("DB_ENDPOINT_TIMEOUTS_MS", "").split(",")):
+    name, ms = item.split("=")
+    ENDPOINT_TIMEOUTS_MS[name.strip()] = int(ms)
+
+# How long a rider / driver reads from the primary after a write of theirs,
+# so a lagging replica can't hide it from them
+DB_REPLICA_LAG_S = float(os.getenv("DB_REPLICA_LAG_S", "5"))
+
+
+def make_engine(url):
+    parsed = make_url(url)
+    sqlite = parsed.get_backend_name() == "sqlite"
+    options = {}
+    # In-memory SQLite keeps one connection per thread; there is no pool to size
+    if not (sqlite and parsed.database in (None, "", ":memory:")):
+        options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT_S)
+    # A SQLite file can't drop idle connections, so don't pay a ping per checkout for it
+    if not sqlite:
+        options.update(pool_recycle=DB_POOL_RECYCLE_S, pool_pre_ping=DB_POOL_PRE_PING)
+    if parsed.get_backend_name() == "postgresql" and DB_STATEMENT_TIMEOUT_MS:
+        options["connect_args"] = {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}
+    db_engine = create_engine(url, **options)
+    db_engine.connects = 0
+
+    @event.listens_for(db_engine, "connect")
+    def count_connect(dbapi_connection, connection_record):
+        db_engine.connects += 1
+
+    return db_engine
+
+
+# -----------------------
+# Routed Sessions
+# -----------------------
+class RoutedSession(Session):
+    """Reads go to the replica when the session is marked read_only (and
+    not pinned to the primary); everything else uses the primary."""
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self.info.get("read_only") and not self.info.get("primary"):
+            return replica_engine
+        return engine
+
+
+engine = make_engine(DATABASE_URL)
+replica_engine = make_engine(DATABASE_REPLICA_URL) if DATABASE_REPLICA_URL else engine
+SessionLocal = sessionmaker(bind=engine, class_=RoutedSession)
 
 Base = declarative_base()
+
+
+@event.listens_for(RoutedSession, "after_begin")
+def scope_transaction(session, transaction, connection):
+    # Per transaction, so each commit's successor gets the same guard
+    if connection.dialect.name != "postgresql":
+        return
+    if session.info.get("read_only"):
+        connection.exec_driver_sql("SET TRANSACTION READ ONLY")
+    timeout_ms = session.info.get("statement_timeout_ms")
+    if timeout_ms:
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {int(timeout_ms)}")
+
+
+def session_dependency(endpoint=None, read_only=False):
+    """FastAPI dependency yielding a session with the endpoint's statement
+    timeout; read_only sessions go to the replica if there is one."""
+    timeout_ms = ENDPOINT_TIMEOUTS_MS.get(endpoint)
+
+    def dependency():
+        db = SessionLocal(info={"read_only": read_only, "statement_timeout_ms": timeout_ms})
+        try:
+            yield db
+        finally:
+            db.close()
+
+    return dependency
+
+
+def use_primary(db):
+    """Route a read_only session to the primary; call before its first query."""
+    db.info["primary"] = True
+
+
+class RecentWrites:
+    """Keys (("rider", id), ("driver", id)) written in the last lag_s
+    seconds by this process, whose reads should skip the replica."""
+
+    def __init__(self, lag_s=DB_REPLICA_LAG_S):
+        self.lag_s = lag_s
+        self._written = {}
+        self._lock = threading.Lock()
+
+    def mark(self, key):
+        now = time.monotonic()
+        with self._lock:
+            self._written[key] = now
+            if len(self._written) > 10000:
+                self._written = {k: t for k, t in self._written.items() if now - t < self.lag_s}
+
+    def __contains__(self, key):
+        written = self._written.get(key)
+        return written is not None and time.monotonic() - written < self.lag_s
+
+
+# -----------------------
+# Pool Stats
+# -----------------------
+def pool_stats(db_engine):
+    pool = db_engine.pool
+    if not isinstance(pool, QueuePool):
+        # In-memory SQLite
+        return {"size": 1, "capacity": 1, "checked_out": 0, "idle": 0, "overflow": 0,
+                "utilization": 0.0, "connects": db_engine.connects}
+    checked_out = pool.checkedout()
+    capacity = pool.size() + max(pool._max_overflow, 0)
+    return {
+        "size": pool.size(),
+        "capacity": capacity,
+        "checked_out": checked_out,
+        "idle": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "utilization": round(checked_out / capacity, 4) if capacity else 0.0,
+        "connects": db_engine.connects
+    }
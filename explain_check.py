@@ -0,0 +1,82 @@
+import sys
+from datetime import datetime
+from sqlalchemy import select, update, text, func, tuple_
+from database import engine
+from models import ACTIVE_STATUSES, Ride, RideStatus, User, LocationUpdate, DetourScoreLog
+
+
+# -------------------------------------
+# Hot Queries (as issued by main.py)
+# -------------------------------------
+HOT_QUERIES = {
+    "assign_driver: busy candidates": select(Ride.driver_id).where(
+        Ride.driver_id.in_(["driver-001", "driver-002"]), Ride.status.in_(ACTIVE_STATUSES)
+    ).distinct(),
+    "warm index: active drivers": select(Ride.driver_id).where(
+        Ride.status.in_(ACTIVE_STATUSES), Ride.driver_id.isnot(None)
+    ).distinct(),
+    "driver_dashboard: active ride": select(Ride.id).where(
+        Ride.driver_id == "driver-001", Ride.status.in_(ACTIVE_STATUSES)
+    ).limit(1),
+    "driver_dashboard: completed rides": select(Ride.id).where(
+        Ride.driver_id == "driver-001", Ride.status == RideStatus.completed
+    ).order_by(Ride.completed_at.desc(), Ride.id.desc()).limit(21),
+    "driver_dashboard: completed page 2": select(Ride.id).where(
+        Ride.driver_id == "driver-001", Ride.status == RideStatus.completed,
+        tuple_(Ride.completed_at, Ride.id) < tuple_(datetime(2025, 1, 1), "ride-001")
+    ).order_by(Ride.completed_at.desc(), Ride.id.desc()).limit(21),
+    "rider_history": select(Ride.id).where(
+        Ride.rider_id == "rider-001"
+    ).order_by(Ride.created_at.desc(), Ride.id.desc()).limit(21),
+    "rider_history: page 2": select(Ride.id).where(
+        Ride.rider_id == "rider-001",
+        tuple_(Ride.created_at, Ride.id) < tuple_(datetime(2025, 1, 1), "ride-001")
+    ).order_by(Ride.created_at.desc(), Ride.id.desc()).limit(21),
+    "get_location: latest ping": select(LocationUpdate.lat).where(
+        LocationUpdate.ride_id == "ride-001"
+    ).order_by(LocationUpdate.timestamp.desc()).limit(1),
+    "fallback_check: detour log": update(DetourScoreLog).where(
+        DetourScoreLog.ride_id == "ride-001", DetourScoreLog.driver_id == "driver-001"
+    ).values(was_accepted=-1),
+    "admin_dashboard: drivers": select(func.count(User.id)).where(User.role == "driver"),
+}
+
+
+def compile_sql(stmt):
+    return str(stmt.compile(engine, compile_kwargs={"literal_binds": True}))
+
+
+def postgres_plan_uses_index(conn, sql):
+    # Empty dev tables always look cheapest to seq-scan; disabling it shows
+    # whether an index can serve the predicate at all
+    conn.execute(text("SET LOCAL enable_seqscan = off"))
+    plan = conn.execute(text(f"EXPLAIN {sql}")).scalars().all()
+    return "\n".join(plan), any("Index" in line for line in plan)
+
+
+def sqlite_plan_uses_index(conn, sql):
+    rows = conn.execute(text(f"EXPLAIN QUERY PLAN {sql}")).all()
+    details = [row[-1] for row in rows]
+    return "\n".join(details), any("USING" in d and "INDEX" in d for d in details)
+
+
+def check():
+    plan_fn = postgres_plan_uses_index if engine.dialect.name == "postgresql" else sqlite_plan_uses_index
+    failures = []
+    for name, stmt in HOT_QUERIES.items():
+        with engine.connect() as conn:
+            plan, ok = plan_fn(conn, compile_sql(stmt))
+            conn.rollback()
+        print(f"{'OK  ' if ok else 'FAIL'} {name}")
+        if not ok:
+            print("     " + plan.replace("\n", "\n     "))
+            failures.append(name)
+    return failures
+
+
+if __name__ == "__main__":
+    failed = check()
+    if failed:
+        print(f"{len(failed)} hot queries are not using an index scan")
+        sys.exit(1)
+    print("All hot queries use index scans")
@@ -0,0 +1,169 @@
+import asyncio
+import heapq
+import logging
+import os
+import threading
+import time
+from dotenv import load_dotenv
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import update, tuple_
+from models import Ride, RideStatus, DetourScoreLog, as_utc
+from matching import release_seats
+
+load_dotenv()
+FALLBACK_TIMEOUT_S = float(os.getenv("FALLBACK_TIMEOUT_S", "30"))
+FALLBACK_REMATCH = os.getenv("FALLBACK_REMATCH", "1") == "1"
+
+logger = logging.getLogger(__name__)
+
+
+# -----------------------
+# Assignment Expiry Queue
+# -----------------------
+class FallbackSweeper:
+    """Expires accepted rides that were not started within timeout_s.
+
+    Deadlines sit in a min-heap keyed on accepted_at + timeout, so each wake-up
+    only touches rides that are actually due. Due rides are reset in one
+    transaction: their DetourScoreLog row is marked -1 and the ride goes back
+    to requested. on_reset(rows) runs after commit with
+    (ride_id, rider_id, driver_id) tuples; on_rematch(rows), if set, is
+    awaited afterwards to match them again right away.
+    """
+
+    def __init__(self, session_factory, timeout_s=FALLBACK_TIMEOUT_S, on_reset=None, on_rematch=None):
+        self.session_factory = session_factory
+        self.timeout_s = timeout_s
+        self.on_reset = on_reset
+        self.on_rematch = on_rematch
+        self._heap = []       # (deadline, ride_id)
+        self._deadlines = {}  # ride_id -> live deadline; stale heap entries are skipped
+        self._lock = threading.Lock()
+        self._loop = None
+        self._wake = None
+        self._task = None
+        self.expired = 0
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def schedule(self, ride_id, accepted_at):
+        deadline = as_utc(accepted_at).timestamp() + self.timeout_s
+        with self._lock:
+            self._deadlines[ride_id] = deadline
+            heapq.heappush(self._heap, (deadline, ride_id))
+            earliest = self._heap[0][1] == ride_id
+        if earliest:
+            self._notify()
+
+    def cancel(self, ride_id):
+        with self._lock:
+            self._deadlines.pop(ride_id, None)
+
+    def _notify(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def _pop_due(self, now):
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                deadline, ride_id = heapq.heappop(self._heap)
+                if self._deadlines.get(ride_id) == deadline:
+                    del self._deadlines[ride_id]
+                    due.append(ride_id)
+            next_deadline = self._heap[0][0] if self._heap else None
+        return due, next_deadline
+
+    # ---- bulk reset ----
+
+    def sweep(self, ride_ids):
+        db = self.session_factory()
+        try:
+            rows = db.query(Ride.id, Ride.rider_id, Ride.driver_id, Ride.accepted_at).filter(
+                Ride.id.in_(ride_ids),
+                Ride.status == RideStatus.accepted
+            ).all()
+            cutoff = time.time() - self.timeout_s
+            # Re-check in case the ride was re-assigned since it was scheduled
+            stale = [r for r in rows if r.accepted_at and as_utc(r.accepted_at).timestamp() <= cutoff]
+            for r in rows:
+                if r not in stale and r.accepted_at and r.id not in self._deadlines:
+                    self.schedule(r.id, r.accepted_at)
+            if not stale:
+                return []
+
+            reset_ids = db.execute(
+                update(Ride)
+                .where(Ride.id.in_([r.id for r in stale]), Ride.status == RideStatus.accepted)
+                .values(status=RideStatus.requested, driver_id=None)
+                .returning(Ride.id)
+                .execution_options(synchronize_session=False)
+            ).scalars().all()
+            reset = [(r.id, r.rider_id, r.driver_id) for r in stale if r.id in set(reset_ids)]
+
+            if reset:
+                release_seats(db, [driver_id for _, _, driver_id in reset])
+                db.execute(
+                    update(DetourScoreLog)
+                    .where(tuple_(DetourScoreLog.ride_id, DetourScoreLog.driver_id).in_(
+                        [(ride_id, driver_id) for ride_id, _, driver_id in reset]
+                    ))
+                    .values(was_accepted=-1)
+                    .execution_options(synchronize_session=False)
+                )
+            db.commit()
+        except Exception:
+            db.rollback()
+            logger.exception("Fallback sweep failed for %d rides", len(ride_ids))
+            return []
+        finally:
+            db.close()
+
+        self.expired += len(reset)
+        if self.on_reset:
+            self.on_reset(reset)
+        return reset
+
+    # ---- scheduler loop ----
+
+    def load(self, db):
+        """Schedule every ride currently waiting in accepted."""
+        for ride_id, accepted_at in db.query(Ride.id, Ride.accepted_at).filter(
+            Ride.status == RideStatus.accepted,
+            Ride.accepted_at.isnot(None)
+        ).all():
+            self.schedule(ride_id, accepted_at)
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        while True:
+            # Cleared before reading the heap so a schedule() racing this pass still wakes us
+            self._wake.clear()
+            due, next_deadline = self._pop_due(time.time())
+            if due:
+                reset = await run_in_threadpool(self.sweep, due)
+                if reset and self.on_rematch:
+                    try:
+                        await self.on_rematch(reset)
+                    except Exception:
+                        logger.exception("Re-matching expired rides failed")
+                continue
+
+            timeout = None if next_deadline is None else max(next_deadline - time.time(), 0)
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,288 @@
+import math
+import os
+import threading
+import time
+from dotenv import load_dotenv
+from spatial_index import METERS_PER_DEG_LAT
+
+load_dotenv()
+GPS_FILTER_ENABLED = os.getenv("GPS_FILTER_ENABLED", "1") == "1"
+# Outliers: a ping implying a jump faster than this from the track, or
+# reporting a worse accuracy than this, is dropped
+GPS_MAX_SPEED_MPS = float(os.getenv("GPS_MAX_SPEED_MPS", "60"))
+GPS_MAX_ACCURACY_M = float(os.getenv("GPS_MAX_ACCURACY_M", "100"))
+# ...unless this many in a row disagree with the track (too far, or older than
+# it), then the track restarts there
+GPS_MAX_REJECTS = int(os.getenv("GPS_MAX_REJECTS", "5"))
+# Kalman noise: ping error when the device reports no accuracy, and how hard
+# a car is assumed to accelerate between pings
+GPS_NOISE_M = float(os.getenv("GPS_NOISE_M", "10"))
+GPS_ACCEL_MPS2 = float(os.getenv("GPS_ACCEL_MPS2", "2.5"))
+# Suppression: a smoothed position is only stored once it moved or turned
+# this much since the last stored one, or after keepalive_s regardless
+GPS_MIN_MOVE_M = float(os.getenv("GPS_MIN_MOVE_M", "15"))
+GPS_MIN_TURN_DEG = float(os.getenv("GPS_MIN_TURN_DEG", "30"))
+GPS_KEEPALIVE_S = float(os.getenv("GPS_KEEPALIVE_S", "30"))
+GPS_TRACK_TTL_S = float(os.getenv("GPS_TRACK_TTL_S", "600"))
+# Snap stored positions onto the local road graph within this distance (0 = off)
+GPS_SNAP_M = float(os.getenv("GPS_SNAP_M", "0"))
+
+STORED = "stored"
+SUPPRESSED = "suppressed"
+REJECTED = "rejected"
+
+# Heading is meaningless below walking pace
+MIN_HEADING_SPEED_MPS = 1.5
+
+
+def _heading_deg(ve, vn):
+    return math.degrees(math.atan2(ve, vn)) % 360
+
+
+def _turn_deg(a, b):
+    d = abs(a - b) % 360
+    return min(d, 360 - d)
+
+
+# -----------------------
+# Kalman Track
+# -----------------------
+class _Axis:
+    """Constant-velocity Kalman filter along one axis (metres, m/s)."""
+
+    __slots__ = ("x", "v", "pxx", "pxv", "pvv")
+
+    def __init__(self, x, noise_m):
+        self.x, self.v = x, 0.0
+        # Unknown speed at start: anything a car could plausibly be doing
+        self.pxx, self.pxv, self.pvv = noise_m ** 2, 0.0, 15.0 ** 2
+
+    def predict(self, dt, q):
+        self.x += self.v * dt
+        self.pxx += dt * (2 * self.pxv + dt * self.pvv) + q * dt ** 4 / 4
+        self.pxv += dt * self.pvv + q * dt ** 3 / 2
+        self.pvv += q * dt ** 2
+
+    def update(self, z, r):
+        s = self.pxx + r
+        kx, kv = self.pxx / s, self.pxv / s
+        innovation = z - self.x
+        self.x += kx * innovation
+        self.v += kv * innovation
+        self.pvv -= kv * self.pxv
+        self.pxv *= 1 - kx
+        self.pxx *= 1 - kx
+
+
+class Track:
+    """One driver's smoothed position, in metres east / north of the first
+    ping (an equirectangular projection is plenty at city scale). Its times
+    all come from one clock: the device's or the server's."""
+
+    __slots__ = ("lat0", "lng0", "m_per_deg_lng", "device_clock", "east", "north", "t", "seen_at",
+                 "rejects", "stored_en", "stored_t", "stored_heading", "stored_ride")
+
+    def __init__(self, lat, lng, t, noise_m, device_clock=False):
+        self.lat0, self.lng0 = lat, lng
+        self.device_clock = device_clock
+        self.m_per_deg_lng = METERS_PER_DEG_LAT * max(math.cos(math.radians(lat)), 0.01)
+        self.east = _Axis(0.0, noise_m)
+        self.north = _Axis(0.0, noise_m)
+        self.t = t
+        self.seen_at = time.monotonic()
+        self.rejects = 0
+        self.stored_en = None
+        self.stored_t = None
+        self.stored_heading = None
+        self.stored_ride = None
+
+    def to_local(self, lat, lng):
+        return (lng - self.lng0) * self.m_per_deg_lng, (lat - self.lat0) * METERS_PER_DEG_LAT
+
+    def to_latlng(self, e, n):
+        return self.lat0 + n / METERS_PER_DEG_LAT, self.lng0 + e / self.m_per_deg_lng
+
+    @property
+    def position(self):
+        return self.east.x, self.north.x
+
+    @property
+    def speed(self):
+        return math.hypot(self.east.v, self.north.v)
+
+    @property
+    def heading(self):
+        return _heading_deg(self.east.v, self.north.v) if self.speed >= MIN_HEADING_SPEED_MPS else None
+
+
+# -----------------------
+# Road Snapping
+# -----------------------
+class RoadSnapper:
+    """Projects a point onto the closest edge of a local_routing.RoadGraph
+    touching one of the nearby nodes."""
+
+    def __init__(self, graph, max_m=GPS_SNAP_M, nodes=6, search_m=400):
+        self.graph = graph
+        self.max_m = max_m
+        self.nodes = nodes
+        self.search_m = search_m
+
+    def snap(self, lat, lng):
+        graph = self.graph
+        m_per_deg_lng = METERS_PER_DEG_LAT * max(math.cos(math.radians(lat)), 0.01)
+
+        def local(node):
+            nlat, nlng = graph.coords[node]
+            return (nlng - lng) * m_per_deg_lng, (nlat - lat) * METERS_PER_DEG_LAT
+
+        best, best_d = None, self.max_m
+        seen = set()
+        for node, _ in graph.node_index.nearest(lat, lng, k=self.nodes, radius_m=self.search_m):
+            a = local(node)
+            for other, _, _ in graph.adj[node] + graph.radj[node]:
+                edge = (min(node, other), max(node, other))
+                if edge in seen:
+                    continue
+                seen.add(edge)
+                b = local(other)
+                # The query point is the origin: project (0, 0) onto segment a-b
+                abx, aby = b[0] - a[0], b[1] - a[1]
+                length2 = abx * abx + aby * aby
+                f = 0.0 if length2 == 0 else min(max(-(a[0] * abx + a[1] * aby) / length2, 0.0), 1.0)
+                px, py = a[0] + f * abx, a[1] + f * aby
+                d = math.hypot(px, py)
+                if d <= best_d:
+                    best, best_d = (px, py), d
+        if best is None:
+            return lat, lng
+        return lat + best[1] / METERS_PER_DEG_LAT, lng + best[0] / m_per_deg_lng
+
+
+# -----------------------
+# Ping Filter
+# -----------------------
+class PingFilter:
+    """Per-driver outlier rejection, Kalman smoothing and change suppression
+    for incoming GPS pings.
+
+    process() returns (verdict, lat, lng): STORED pings carry the smoothed
+    (and, with a snapper, road-snapped) position to persist and publish;
+    SUPPRESSED and REJECTED ones should go no further. The first accepted
+    ping of each ride_id is always stored, so a new ride has a position
+    even if the driver hasn't moved since the last one. device_clock says
+    whether timestamp is the device's own or the server's receipt time; a
+    driver switching between the two starts a new track rather than
+    comparing times from different clocks.
+    """
+
+    def __init__(self, max_speed_mps=GPS_MAX_SPEED_MPS, max_accuracy_m=GPS_MAX_ACCURACY_M,
+                 max_rejects=GPS_MAX_REJECTS, noise_m=GPS_NOISE_M, accel_mps2=GPS_ACCEL_MPS2,
+                 min_move_m=GPS_MIN_MOVE_M, min_turn_deg=GPS_MIN_TURN_DEG, keepalive_s=GPS_KEEPALIVE_S,
+                 track_ttl_s=GPS_TRACK_TTL_S, snapper=None):
+        self.max_speed_mps = max_speed_mps
+        self.max_accuracy_m = max_accuracy_m
+        self.max_rejects = max_rejects
+        self.noise_m = noise_m
+        self.q = accel_mps2 ** 2
+        self.min_move_m = min_move_m
+        self.min_turn_deg = min_turn_deg
+        self.keepalive_s = keepalive_s
+        self.track_ttl_s = track_ttl_s
+        self.snapper = snapper
+        self._tracks = {}
+        self._lock = threading.Lock()
+        self._since_expire = 0
+        self.stored = 0
+        self.suppressed = 0
+        self.rejected = 0
+
+    def __len__(self):
+        return len(self._tracks)
+
+    def process(self, driver_id, lat, lng, timestamp, accuracy_m=None, device_clock=False, ride_id=None):
+        t = timestamp.timestamp()
+        with self._lock:
+            self._since_expire += 1
+            if self._since_expire >= 1000:
+                self._expire()
+
+            if accuracy_m is not None and accuracy_m > self.max_accuracy_m:
+                self.rejected += 1
+                return REJECTED, lat, lng
+
+            noise_m = max(accuracy_m or self.noise_m, 1.0)
+            track = self._tracks.get(driver_id)
+            if track is None or track.device_clock != device_clock or t - track.t > self.track_ttl_s:
+                return self._restart(driver_id, lat, lng, t, noise_m, device_clock, ride_id)
+
+            dt = t - track.t
+            e, n = track.to_local(lat, lng)
+            pe, pn = track.position
+            # Out of order (a late batched upload, or a clock that stepped back) counts
+            # against the track like an impossible jump does
+            if dt < 0 or math.hypot(e - pe, n - pn) - noise_m > self.max_speed_mps * max(dt, 1.0):
+                track.rejects += 1
+                if track.rejects < self.max_rejects:
+                    self.rejected += 1
+                    return REJECTED, lat, lng
+                # Consistently elsewhere, or earlier: believe the device, not the track
+                return self._restart(driver_id, lat, lng, t, noise_m, device_clock, ride_id)
+
+            track.rejects = 0
+            track.seen_at = time.monotonic()
+            if dt > 0:
+                track.east.predict(dt, self.q)
+                track.north.predict(dt, self.q)
+            track.east.update(e, noise_m ** 2)
+            track.north.update(n, noise_m ** 2)
+            track.t = t
+
+            if track.stored_ride != ride_id or self._changed(track, t):
+                return self._store(track, t, ride_id)
+            self.suppressed += 1
+            return (SUPPRESSED, *track.to_latlng(*track.position))
+
+    def _restart(self, driver_id, lat, lng, t, noise_m, device_clock, ride_id):
+        track = self._tracks[driver_id] = Track(lat, lng, t, noise_m, device_clock)
+        return self._store(track, t, ride_id)
+
+    def _changed(self, track, t):
+        e, n = track.position
+        moved = math.hypot(e - track.stored_en[0], n - track.stored_en[1])
+        if moved >= self.min_move_m or t - track.stored_t >= self.keepalive_s:
+            return True
+        heading = track.heading
+        if heading is None or track.stored_heading is None:
+            return False
+        # Corners matter even when short, but not heading jitter on the spot
+        return moved >= self.min_move_m / 3 and _turn_deg(heading, track.stored_heading) >= self.min_turn_deg
+
+    def _store(self, track, t, ride_id):
+        track.stored_ride = ride_id
+        track.stored_en = track.position
+        track.stored_t = t
+        track.stored_heading = track.heading
+        self.stored += 1
+        lat, lng = track.to_latlng(*track.position)
+        if self.snapper is not None:
+            lat, lng = self.snapper.snap(lat, lng)
+        return STORED, lat, lng
+
+    def forget(self, driver_id):
+        with self._lock:
+            self._tracks.pop(driver_id, None)
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.track_ttl_s
+        for driver_id in [d for d, track in self._tracks.items() if track.seen_at < cutoff]:
+            del self._tracks[driver_id]
+        self._since_expire = 0
+
+    def stats(self):
+        return {
+            "tracks": len(self._tracks),
+            "stored": self.stored,
+            "suppressed": self.suppressed,
+            "rejected": self.rejected
+        }
@@ -0,0 +1,237 @@
+import logging
+import math
+import os
+import threading
+import time
+from collections import namedtuple
+import numpy as np
+from dotenv import load_dotenv
+from models import Ride, RideStatus
+from spatial_index import METERS_PER_DEG_LAT
+
+load_dotenv()
+HEATMAP_CELL_M = float(os.getenv("HEATMAP_CELL_M", "1000"))
+HEATMAP_INTERVAL_S = float(os.getenv("HEATMAP_INTERVAL_S", "5"))
+# Time constant of the rolling demand / supply averages
+HEATMAP_WINDOW_S = float(os.getenv("HEATMAP_WINDOW_S", "300"))
+# Guards against one far-away outlier stretching the dense grid across a continent
+HEATMAP_MAX_CELLS = int(os.getenv("HEATMAP_MAX_CELLS", str(1 << 20)))
+# Latitude the east-west cell width is computed at; unset = the first snapshot's median
+HEATMAP_REF_LAT = os.getenv("HEATMAP_REF_LAT")
+
+SURGE_ENABLED = os.getenv("SURGE_ENABLED", "0") == "1"
+SURGE_MAX = float(os.getenv("SURGE_MAX", "3.0"))
+# Multiplier added per unit of demand/supply ratio above 1
+SURGE_SENSITIVITY = float(os.getenv("SURGE_SENSITIVITY", "0.5"))
+# A cell needs this much (averaged) demand before it can surge at all
+SURGE_MIN_DEMAND = float(os.getenv("SURGE_MIN_DEMAND", "3"))
+SURGE_STEP = 0.1
+
+logger = logging.getLogger(__name__)
+
+# origin is the global (i, j) cell of grid[0, 0]; arrays are all the same shape.
+# alpha is the weight the last snapshot got in the moving averages.
+Grid = namedtuple("Grid", "origin demand supply surge alpha updated_at")
+
+
+def box_sum(a):
+    """Sum over each cell's 3x3 neighbourhood: drivers next door can serve a pickup too."""
+    padded = np.pad(a, 1)
+    h, w = a.shape
+    return sum(padded[di:di + h, dj:dj + w] for di in range(3) for dj in range(3))
+
+
+# -----------------------
+# Surge Grid
+# -----------------------
+class SurgeMap:
+    """Rolling demand (open ride pickups) and supply (idle drivers) per grid
+    cell, and the surge multiplier derived from them.
+
+    update() bins a full snapshot with NumPy and folds it into exponential
+    moving averages; record_request() bumps one cell between snapshots.
+    Each update swaps in a new Grid, so lookups never see a half-built one.
+
+    Cells are cell_size_m square at ref_lat: the grid is one dense array, so
+    every row shares the longitude step cell_deg / cos(ref_lat).
+    """
+
+    def __init__(self, cell_size_m=HEATMAP_CELL_M, window_s=HEATMAP_WINDOW_S, max_cells=HEATMAP_MAX_CELLS,
+                 ref_lat=HEATMAP_REF_LAT):
+        self.cell_size_m = cell_size_m
+        self.cell_deg = cell_size_m / METERS_PER_DEG_LAT
+        self.lng_deg = None
+        if ref_lat is not None:
+            self._set_ref_lat(float(ref_lat))
+        self.window_s = window_s
+        self.max_cells = max_cells
+        self.grid = None
+        self.compute_ms = 0.0
+        self._lock = threading.Lock()
+
+    def _set_ref_lat(self, lat):
+        self.lng_deg = self.cell_deg / max(math.cos(math.radians(lat)), 0.01)
+
+    def _cells(self, points):
+        """Global (row, col) cell indices as two contiguous arrays."""
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        if self.lng_deg is None and len(points):
+            # Fixed once: changing it later would re-map every existing column
+            self._set_ref_lat(round(float(np.median(points[:, 0]))))
+        lng_deg = self.lng_deg or self.cell_deg
+        return (np.floor(points[:, 0] / self.cell_deg).astype(np.int64),
+                np.floor(points[:, 1] / lng_deg).astype(np.int64))
+
+    def _bounds(self, rows, cols):
+        lo = np.array([rows.min(), cols.min()])
+        hi = np.array([rows.max(), cols.max()])
+        if np.prod(hi - lo + 1) > self.max_cells:
+            # Centre a maximal square on the median cell and leave outliers out
+            half = math.isqrt(self.max_cells) // 2
+            mid = np.array([np.median(rows), np.median(cols)]).astype(np.int64)
+            lo, hi = np.maximum(lo, mid - half), np.minimum(hi, mid + half - 1)
+        return lo, hi
+
+    def _bin(self, cells, lo, shape):
+        rows, cols = cells[0] - lo[0], cells[1] - lo[1]
+        inside = (rows >= 0) & (rows < shape[0]) & (cols >= 0) & (cols < shape[1])
+        if not inside.all():
+            rows, cols = rows[inside], cols[inside]
+        return np.bincount(rows * shape[1] + cols, minlength=shape[0] * shape[1]) \
+            .reshape(shape).astype(float)
+
+    def _surge(self, demand, supply):
+        ratio = demand / np.maximum(box_sum(supply), 1.0)
+        surge = 1.0 + SURGE_SENSITIVITY * np.maximum(ratio - 1.0, 0.0)
+        surge[demand < SURGE_MIN_DEMAND] = 1.0
+        return np.clip(np.round(surge / SURGE_STEP) * SURGE_STEP, 1.0, SURGE_MAX)
+
+    def update(self, demand_points, supply_points, now=None):
+        """demand_points / supply_points are sequences of (lat, lng)."""
+        started = time.perf_counter()
+        now = time.time() if now is None else now
+        demand_cells, supply_cells = self._cells(demand_points), self._cells(supply_points)
+        previous = self.grid
+
+        rows, cols = [demand_cells[0], supply_cells[0]], [demand_cells[1], supply_cells[1]]
+        if previous is not None:
+            # Keep the previous extent so the averages of quiet cells decay instead of vanishing
+            corners = np.array([previous.origin, np.add(previous.origin, previous.demand.shape) - 1])
+            rows.append(corners[:, 0])
+            cols.append(corners[:, 1])
+        rows, cols = np.concatenate(rows), np.concatenate(cols)
+        if not len(rows):
+            return None
+        lo, hi = self._bounds(rows, cols)
+        shape = tuple(int(x) for x in hi - lo + 1)
+
+        demand = self._bin(demand_cells, lo, shape)
+        supply = self._bin(supply_cells, lo, shape)
+        alpha = 1.0
+        if previous is not None:
+            alpha = 1.0 - math.exp(-max(now - previous.updated_at, 0.0) / self.window_s)
+            demand *= alpha
+            supply *= alpha
+            # Carry (1 - alpha) of the old averages over, on the overlap of the two extents
+            old_lo = np.array(previous.origin)
+            a = np.maximum(lo, old_lo)
+            b = np.minimum(hi + 1, old_lo + previous.demand.shape)
+            if np.all(b > a):
+                new_slice = tuple(slice(x, y) for x, y in zip(a - lo, b - lo))
+                old_slice = tuple(slice(x, y) for x, y in zip(a - old_lo, b - old_lo))
+                demand[new_slice] += (1.0 - alpha) * previous.demand[old_slice]
+                supply[new_slice] += (1.0 - alpha) * previous.supply[old_slice]
+
+        grid = Grid((int(lo[0]), int(lo[1])), demand, supply, self._surge(demand, supply), alpha, now)
+        with self._lock:
+            self.grid = grid
+        self.compute_ms = (time.perf_counter() - started) * 1000
+        return grid
+
+    def _index(self, grid, lat, lng):
+        i = math.floor(lat / self.cell_deg) - grid.origin[0]
+        j = math.floor(lng / self.lng_deg) - grid.origin[1]
+        if 0 <= i < grid.demand.shape[0] and 0 <= j < grid.demand.shape[1]:
+            return i, j
+        return None
+
+    def multiplier(self, lat, lng):
+        grid = self.grid
+        cell = self._index(grid, lat, lng) if grid is not None else None
+        return float(grid.surge[cell]) if cell else 1.0
+
+    def record_request(self, lat, lng):
+        """Count a new ride into its cell right away, weighted as one more
+        pickup in a snapshot would be, and re-price just that cell."""
+        with self._lock:
+            grid = self.grid
+            cell = self._index(grid, lat, lng) if grid is not None else None
+            if not cell:
+                return
+            i, j = cell
+            grid.demand[i, j] += grid.alpha
+            block = grid.supply[max(i - 1, 0):i + 2, max(j - 1, 0):j + 2].sum()
+            grid.surge[i, j] = self._surge(grid.demand[i:i + 1, j:j + 1], np.array([[block]]))[0, 0]
+
+    def cells(self, min_surge=1.0):
+        """Non-empty cells as dicts with the cell centre, for the heatmap endpoint."""
+        grid = self.grid
+        if grid is None:
+            return []
+        busy = (grid.demand >= 0.01) | (grid.supply >= 0.01)
+        busy &= grid.surge >= min_surge
+        rows = []
+        for i, j in zip(*np.nonzero(busy)):
+            rows.append({
+                "lat": round(float(grid.origin[0] + i + 0.5) * self.cell_deg, 6),
+                "lng": round(float(grid.origin[1] + j + 0.5) * self.lng_deg, 6),
+                "demand": round(float(grid.demand[i, j]), 2),
+                "supply": round(float(grid.supply[i, j]), 2),
+                "surge": float(grid.surge[i, j])
+            })
+        return rows
+
+
+# -----------------------
+# Background Refresh
+# -----------------------
+class HeatmapService:
+    """Snapshots open ride pickups (DB) and idle drivers (driver index)
+    every interval_s into the SurgeMap."""
+
+    def __init__(self, surge_map, session_factory, driver_index, interval_s=HEATMAP_INTERVAL_S):
+        self.surge_map = surge_map
+        self.session_factory = session_factory
+        self.driver_index = driver_index
+        self.interval_s = interval_s
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self):
+        db = self.session_factory()
+        try:
+            pickups = db.query(Ride.pickup_lat, Ride.pickup_lng).filter(
+                Ride.status == RideStatus.requested,
+                Ride.pickup_lat.isnot(None),
+                Ride.pickup_lng.isnot(None)
+            ).all()
+            self.surge_map.update(pickups, self.driver_index.idle_positions())
+        except Exception:
+            logger.exception("Heatmap refresh failed")
+        finally:
+            db.close()
+
+    def start(self):
+        self.run_once()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="heatmap", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            self.run_once()
@@ -0,0 +1,77 @@
+import base64
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from dotenv import load_dotenv
+
+load_dotenv()
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "20"))
+HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE", "100"))
+HISTORY_CACHE_TTL_S = float(os.getenv("HISTORY_CACHE_TTL_S", "30"))
+HISTORY_CACHE_MAX_ENTRIES = int(os.getenv("HISTORY_CACHE_MAX_ENTRIES", "5000"))
+
+
+# -----------------------
+# Keyset Cursors
+# -----------------------
+def encode_cursor(sort_value, ride_id):
+    raw = f"{sort_value.isoformat()}|{ride_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Returns (datetime, ride_id); raises ValueError on a malformed cursor."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        sort_value, ride_id = raw.split("|", 1)
+        return datetime.fromisoformat(sort_value), ride_id
+    except (UnicodeDecodeError, base64.binascii.Error) as e:
+        raise ValueError(str(e))
+
+
+def page_size(requested):
+    try:
+        return max(1, min(int(requested), HISTORY_MAX_PAGE_SIZE))
+    except (TypeError, ValueError):
+        return HISTORY_PAGE_SIZE
+
+
+# -----------------------
+# Recent Page Cache
+# -----------------------
+class RecentPageCache:
+    """First page of rider_history / driver_dashboard per user. Ride state
+    transitions invalidate the affected users; the TTL bounds staleness
+    from transitions handled by other workers."""
+
+    def __init__(self, ttl_s=HISTORY_CACHE_TTL_S, max_entries=HISTORY_CACHE_MAX_ENTRIES):
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (kind, user_id) -> {limit: (expires_at, page)}
+        self._lock = threading.Lock()
+
+    def get(self, kind, user_id, limit):
+        with self._lock:
+            pages = self._entries.get((kind, user_id))
+            entry = pages.get(limit) if pages else None
+            if not entry:
+                return None
+            if entry[0] < time.monotonic():
+                del pages[limit]
+                return None
+            self._entries.move_to_end((kind, user_id))
+            return entry[1]
+
+    def put(self, kind, user_id, limit, page):
+        with self._lock:
+            pages = self._entries.setdefault((kind, user_id), {})
+            pages[limit] = (time.monotonic() + self.ttl_s, page)
+            self._entries.move_to_end((kind, user_id))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, kind, user_id):
+        with self._lock:
+            self._entries.pop((kind, user_id), None)
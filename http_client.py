@@ -0,0 +1,63 @@
+import asyncio
+import os
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+HTTP_TIMEOUT_S = float(os.getenv("HTTP_TIMEOUT_S", "5"))
+HTTP_CONNECT_TIMEOUT_S = float(os.getenv("HTTP_CONNECT_TIMEOUT_S", "2"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_MAX_CONCURRENCY = int(os.getenv("HTTP_MAX_CONCURRENCY", "50"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+HTTP_RETRY_BACKOFF_S = float(os.getenv("HTTP_RETRY_BACKOFF_S", "0.2"))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_client = None
+_semaphore = None
+
+
+# -----------------------
+# Shared Pooled Client
+# -----------------------
+def get_http_client():
+    """One keep-alive connection pool per process, so external calls skip the
+    TCP+TLS handshake after the first request."""
+    global _client, _semaphore
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(HTTP_TIMEOUT_S, connect=HTTP_CONNECT_TIMEOUT_S),
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE
+            )
+        )
+        _semaphore = asyncio.Semaphore(HTTP_MAX_CONCURRENCY)
+    return _client
+
+
+async def close_http_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def get_json(url, params=None):
+    """GET with bounded concurrency and retries on transport errors and
+    retryable status codes."""
+    client = get_http_client()
+    attempt = 0
+    while True:
+        try:
+            async with _semaphore:
+                response = await client.get(url, params=params)
+            if response.status_code not in RETRY_STATUSES or attempt >= HTTP_RETRIES:
+                response.raise_for_status()
+                return response.json()
+        except httpx.TransportError:
+            if attempt >= HTTP_RETRIES:
+                raise
+        await asyncio.sleep(HTTP_RETRY_BACKOFF_S * (2 ** attempt))
+        attempt += 1
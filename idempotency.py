@@ -0,0 +1,81 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+IDEMPOTENCY_TTL_S = float(os.getenv("IDEMPOTENCY_TTL_S", "600"))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "10000"))
+
+
+class IdempotencyConflict(Exception):
+    """The Idempotency-Key was already used for a different request."""
+
+
+# -----------------------
+# Idempotency Cache
+# -----------------------
+class IdempotencyCache:
+    """Remembers the result of a request by its Idempotency-Key.
+
+    A retry that arrives while the original is still running awaits the same
+    result instead of starting a second match. Only successes are kept, so a
+    retry after an error runs again. Each key is bound to the fingerprint of
+    the request that first used it; reusing the key for another request
+    raises IdempotencyConflict instead of replaying the wrong result.
+    """
+
+    def __init__(self, ttl_s=IDEMPOTENCY_TTL_S, max_entries=IDEMPOTENCY_MAX_ENTRIES):
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self._results = OrderedDict()  # key -> (expires_at, fingerprint, result)
+        self._pending = {}             # key -> (fingerprint, Future of the in-flight request)
+        self.replays = 0
+
+    def _cached(self, key):
+        entry = self._results.get(key)
+        if entry and entry[0] < time.monotonic():
+            del self._results[key]
+            return None
+        return entry
+
+    async def run(self, key, fn, fingerprint=None):
+        """Await fn() once per key; replays its result while the key is fresh.
+        fingerprint identifies the request (e.g. its ride_id)."""
+        if key is None:
+            return await fn()
+
+        entry = self._cached(key)
+        if entry:
+            if entry[1] != fingerprint:
+                raise IdempotencyConflict(key)
+            self.replays += 1
+            return entry[2]
+        if key in self._pending:
+            pending_fingerprint, pending = self._pending[key]
+            if pending_fingerprint != fingerprint:
+                raise IdempotencyConflict(key)
+            self.replays += 1
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = (fingerprint, future)
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Retrieved here so an unawaited failure isn't reported as never retrieved
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            self._results[key] = (time.monotonic() + self.ttl_s, fingerprint, result)
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+            return result
+        finally:
+            del self._pending[key]
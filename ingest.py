@@ -0,0 +1,191 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from dotenv import load_dotenv
+from sqlalchemy import insert, update, bindparam
+from models import LocationUpdate, DriverProfile
+
+load_dotenv()
+INGEST_FLUSH_SIZE = int(os.getenv("INGEST_FLUSH_SIZE", "500"))
+INGEST_FLUSH_INTERVAL_S = float(os.getenv("INGEST_FLUSH_INTERVAL_S", "1.0"))
+INGEST_MAX_BUFFER = int(os.getenv("INGEST_MAX_BUFFER", "20000"))
+# Client-stamped pings are only taken within this window around server time:
+# later ones would block newer positions, older ones would land in partitions
+# that may already be archived
+INGEST_MAX_PING_AGE_S = float(os.getenv("INGEST_MAX_PING_AGE_S", "900"))
+INGEST_MAX_PING_AHEAD_S = float(os.getenv("INGEST_MAX_PING_AHEAD_S", "60"))
+# How long a cached ride -> driver mapping is trusted before the rides table
+# is asked again; bounds how long another worker's reassignment goes unseen
+INGEST_RIDE_CACHE_TTL_S = float(os.getenv("INGEST_RIDE_CACHE_TTL_S", "30"))
+
+logger = logging.getLogger(__name__)
+
+
+class IngestBufferFull(Exception):
+    pass
+
+
+# -----------------------
+# Ride -> Driver Cache
+# -----------------------
+class RideDriverCache:
+    """ride_id -> driver_id of active rides, so a GPS ping normally costs no
+    DB round trip. This process's transitions update it directly; entries
+    expire after ttl_s so changes made by other workers are picked up."""
+
+    def __init__(self, ttl_s=INGEST_RIDE_CACHE_TTL_S, max_entries=100000):
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self._drivers = {}  # ride_id -> (expires_at, driver_id)
+        self._lock = threading.Lock()
+
+    def get(self, ride_id):
+        entry = self._drivers.get(ride_id)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    def __contains__(self, ride_id):
+        return self.get(ride_id) is not None
+
+    def __setitem__(self, ride_id, driver_id):
+        now = time.monotonic()
+        with self._lock:
+            self._drivers[ride_id] = (now + self.ttl_s, driver_id)
+            if len(self._drivers) > self.max_entries:
+                self._drivers = {k: e for k, e in self._drivers.items() if e[0] >= now}
+
+    def pop(self, ride_id, default=None):
+        with self._lock:
+            entry = self._drivers.pop(ride_id, None)
+        return default if entry is None else entry[1]
+
+
+# -----------------------
+# Buffered GPS Writer
+# -----------------------
+class LocationIngestor:
+    """Buffers GPS pings in memory and writes them in batches.
+
+    A flush happens when flush_size pings are waiting or flush_interval_s has
+    passed, whichever comes first. Each flush is one multi-row INSERT into
+    location_updates plus one executemany UPDATE of driver_profiles holding
+    only the latest position per driver, in a single transaction.
+    """
+
+    def __init__(self, session_factory, flush_size=INGEST_FLUSH_SIZE,
+                 flush_interval_s=INGEST_FLUSH_INTERVAL_S, max_buffer=INGEST_MAX_BUFFER):
+        self.session_factory = session_factory
+        self.flush_size = flush_size
+        self.flush_interval_s = flush_interval_s
+        self.max_buffer = max_buffer
+        self._buffer = deque()
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._running = False
+        self.flushed = 0
+        self.rejected = 0
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def submit(self, ride_id, driver_id, lat, lng, timestamp):
+        self.submit_many([(ride_id, driver_id, lat, lng, timestamp)])
+
+    def submit_many(self, pings):
+        """pings are (ride_id, driver_id, lat, lng, timestamp) tuples. Raises
+        IngestBufferFull (and accepts none of them) when they don't fit."""
+        with self._cond:
+            if len(self._buffer) + len(pings) > self.max_buffer:
+                self.rejected += len(pings)
+                raise IngestBufferFull()
+            self._buffer.extend(pings)
+            if len(self._buffer) >= self.flush_size:
+                self._cond.notify()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._cond:
+                batch = list(self._buffer)
+                self._buffer.clear()
+            if not batch:
+                return 0
+
+            rows = [
+                {
+                    "ride_id": ride_id,
+                    "driver_id": driver_id,
+                    "lat": lat,
+                    "lng": lng,
+                    "timestamp": timestamp
+                } for ride_id, driver_id, lat, lng, timestamp in batch
+            ]
+
+            # Pings are buffered in arrival order, so the last one per driver wins
+            latest = {}
+            for _, driver_id, lat, lng, _ in batch:
+                latest[driver_id] = {"uid": driver_id, "lat": lat, "lng": lng}
+
+            db = self.session_factory()
+            try:
+                db.execute(insert(LocationUpdate), rows)
+                db.execute(
+                    update(DriverProfile.__table__)
+                    .where(DriverProfile.__table__.c.user_id == bindparam("uid"))
+                    .values(lat=bindparam("lat"), lng=bindparam("lng")),
+                    list(latest.values())
+                )
+                db.commit()
+            except Exception:
+                db.rollback()
+                logger.exception("Location flush of %d pings failed, requeueing", len(batch))
+                with self._cond:
+                    room = self.max_buffer - len(self._buffer)
+                    self._buffer.extendleft(reversed(batch[-room:] if room > 0 else []))
+                return 0
+            finally:
+                db.close()
+
+            self.flushed += len(batch)
+            return len(batch)
+
+    # ---- background flusher ----
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="location-ingest", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread:
+            self._thread.join()
+        self.flush()
+
+    def _run(self):
+        deadline = time.monotonic() + self.flush_interval_s
+        while True:
+            with self._cond:
+                while self._running and len(self._buffer) < self.flush_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if not self._running:
+                    return
+            self.flush()
+            deadline = time.monotonic() + self.flush_interval_s
+
+    def stats(self):
+        return {
+            "buffered": len(self._buffer),
+            "flushed": self.flushed,
+            "rejected": self.rejected
+        }
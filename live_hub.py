@@ -0,0 +1,113 @@
+import asyncio
+import os
+import threading
+from collections import defaultdict
+from dotenv import load_dotenv
+
+load_dotenv()
+LIVE_QUEUE_SIZE = int(os.getenv("LIVE_QUEUE_SIZE", "16"))
+LIVE_HEARTBEAT_S = float(os.getenv("LIVE_HEARTBEAT_S", "15"))
+
+HEARTBEAT = object()
+CLOSED = object()
+
+
+# -----------------------
+# Subscriber
+# -----------------------
+class Subscription:
+    def __init__(self, ride_id, queue_size):
+        self.ride_id = ride_id
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+
+    def push(self, message):
+        # A slow client only ever needs the newest positions
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(message)
+
+
+# -----------------------
+# Fan-out Hub
+# -----------------------
+class LocationHub:
+    """Per-ride fan-out of ingested positions to WebSocket / SSE subscribers.
+
+    Subscriber queues live on the event loop; publish() and close_ride() may
+    be called from threadpool endpoints and hop onto the loop. Fan-out is
+    within this process only: pings ingested by another worker never reach
+    these subscribers.
+    """
+
+    def __init__(self, queue_size=LIVE_QUEUE_SIZE, heartbeat_s=LIVE_HEARTBEAT_S):
+        self.queue_size = queue_size
+        self.heartbeat_s = heartbeat_s
+        self._subs = defaultdict(set)
+        self._loop = None
+        self._lock = threading.Lock()
+
+    def bind(self, loop):
+        self._loop = loop
+
+    def subscriber_count(self, ride_id=None):
+        if ride_id is not None:
+            return len(self._subs.get(ride_id, ()))
+        return sum(len(s) for s in self._subs.values())
+
+    def subscribe(self, ride_id):
+        sub = Subscription(ride_id, self.queue_size)
+        with self._lock:
+            self._subs[ride_id].add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            subs = self._subs.get(sub.ride_id)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subs[sub.ride_id]
+
+    def publish(self, ride_id, payload):
+        if ride_id in self._subs:
+            self._dispatch(self._push_all, ride_id, payload)
+
+    def close_ride(self, ride_id):
+        if ride_id in self._subs:
+            self._dispatch(self._push_all, ride_id, CLOSED)
+
+    def _dispatch(self, fn, *args):
+        if self._loop is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            fn(*args)
+        else:
+            self._loop.call_soon_threadsafe(fn, *args)
+
+    def _push_all(self, ride_id, message):
+        with self._lock:
+            subs = list(self._subs.get(ride_id, ()))
+        for sub in subs:
+            sub.push(message)
+
+    async def events(self, sub):
+        """Yield payloads, HEARTBEAT after heartbeat_s of silence, and stop
+        after the ride is closed."""
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(sub.queue.get(), self.heartbeat_s)
+                except asyncio.TimeoutError:
+                    yield HEARTBEAT
+                    continue
+                if message is CLOSED:
+                    return
+                yield message
+        finally:
+            self.unsubscribe(sub)
@@ -0,0 +1,341 @@
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+
+# -------------------------------------
+# Ride Lifecycle Load Generator
+# -------------------------------------
+# Drives N riders and M drivers through onboard -> GPS -> request -> assign ->
+# start -> complete (plus cancel and fallback) against the app in-process,
+# and reports per-endpoint latency percentiles, throughput and DB queries.
+#
+#   python loadtest.py --riders 200 --drivers 40
+#   python loadtest.py --save-baseline sqlite-fake
+#   python loadtest.py --compare sqlite-fake   # exits 1 on a regression
+
+CAMPUS_CENTER = (30.6127, -96.3414)
+# Contended claims fail now and then, so allow a little more than the baseline
+ERROR_RATE_SLACK = 0.01
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "loadtest_baselines")
+
+# Per-request query counter; run_in_threadpool copies the context, so DB work
+# done off the event loop is still charged to the request that caused it
+current_queries = contextvars.ContextVar("current_queries", default=None)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Ride lifecycle load test")
+    parser.add_argument("--riders", type=int, default=200)
+    parser.add_argument("--drivers", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=20, help="riders in flight at once")
+    parser.add_argument("--pings", type=int, default=5, help="GPS pings per ride leg")
+    parser.add_argument("--cancel-rate", type=float, default=0.1)
+    parser.add_argument("--fallback-rate", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--routing", choices=["fake", "local"], default="fake")
+    parser.add_argument("--database-url", default="sqlite:///loadtest.db")
+    parser.add_argument("--reset", action="store_true",
+                        help="drop and recreate all tables first (always done for SQLite files)")
+    parser.add_argument("--save-baseline", metavar="NAME")
+    parser.add_argument("--compare", metavar="NAME")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="allowed p95 slowdown vs the baseline, as a fraction")
+    parser.add_argument("--min-samples", type=int, default=50,
+                        help="endpoints with fewer requests are not compared on latency")
+    return parser.parse_args()
+
+
+def configure(args):
+    # Must run before the app modules are imported; they read config at import time
+    os.environ["DATABASE_URL"] = args.database_url
+    os.environ["ROUTING_PROVIDER"] = args.routing
+    os.environ.setdefault("LOCATION_STORE_URL", "")
+    # The synthetic legs jump hundreds of metres between pings milliseconds
+    # apart, which the GPS filter rightly drops; store them raw so the read
+    # path is measured on real fixes rather than 404s
+    os.environ.setdefault("GPS_FILTER_ENABLED", "0")
+
+    if args.database_url.startswith("sqlite:///"):
+        path = args.database_url[len("sqlite:///"):]
+        if os.path.exists(path):
+            os.remove(path)
+    elif args.reset:
+        from database import engine
+        from models import Base
+        from sqlalchemy import text
+        Base.metadata.drop_all(bind=engine)
+        with engine.begin() as conn:
+            conn.execute(text("DROP TABLE IF EXISTS schema_migrations"))
+
+    from database import engine
+    from migrations import migrate
+    migrate(engine)
+
+
+# -----------------------
+# Measurement
+# -----------------------
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)  # endpoint -> [seconds]
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.queries = defaultdict(list)  # endpoint -> [queries per 2xx request]
+        self.background_queries = 0
+
+    def count_query(self, *_):
+        counter = current_queries.get()
+        if counter is None:
+            self.background_queries += 1
+        else:
+            counter[0] += 1
+
+    def record(self, endpoint, elapsed, status, queries):
+        self.latencies[endpoint].append(elapsed)
+        self.statuses[endpoint][status] += 1
+        # Error paths bail out early; only successes give a stable per-request count
+        if 200 <= status < 300:
+            self.queries[endpoint].append(queries)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def error_rate(statuses):
+    # Share of non-2xx responses; status keys are ints live and strings once saved
+    total = sum(statuses.values())
+    errors = sum(n for code, n in statuses.items() if not 200 <= int(code) < 300)
+    return round(errors / total, 4) if total else 0.0
+
+
+def summarize(recorder, wall_s):
+    report = {"wall_s": round(wall_s, 3), "endpoints": {}}
+    total = 0
+    for endpoint in sorted(recorder.latencies):
+        samples = recorder.latencies[endpoint]
+        queries = recorder.queries[endpoint]
+        total += len(samples)
+        report["endpoints"][endpoint] = {
+            "requests": len(samples),
+            "statuses": dict(recorder.statuses[endpoint]),
+            "error_rate": error_rate(recorder.statuses[endpoint]),
+            "p50_ms": round(percentile(samples, 50) * 1000, 2),
+            "p95_ms": round(percentile(samples, 95) * 1000, 2),
+            "p99_ms": round(percentile(samples, 99) * 1000, 2),
+            "req_per_s": round(len(samples) / wall_s, 1),
+            "queries_per_req": round(sum(queries) / len(queries), 2) if queries else None,
+        }
+    report["requests"] = total
+    report["req_per_s"] = round(total / wall_s, 1)
+    report["background_queries"] = recorder.background_queries
+    return report
+
+
+def print_report(report):
+    print(f"{'endpoint':<22}{'reqs':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'req/s':>8}{'q/req':>7}  statuses")
+    for endpoint, row in report["endpoints"].items():
+        statuses = " ".join(f"{code}:{n}" for code, n in sorted(row["statuses"].items()))
+        print(f"{endpoint:<22}{row['requests']:>7}{row['p50_ms']:>9}{row['p95_ms']:>9}{row['p99_ms']:>9}"
+              f"{row['req_per_s']:>8}{row['queries_per_req']:>7}  {statuses}")
+    print(f"{report['requests']} requests in {report['wall_s']} s ({report['req_per_s']} req/s), "
+          f"{report['background_queries']} background queries")
+
+
+def compare(report, baseline, tolerance, min_samples=50):
+    """Endpoints whose p95, query count or share of non-2xx responses
+    regressed against the baseline. p95 is only compared where both runs
+    have min_samples requests."""
+    regressions = []
+    for endpoint, base in baseline["endpoints"].items():
+        row = report["endpoints"].get(endpoint)
+        if not row:
+            continue
+        enough = min(row["requests"], base["requests"]) >= min_samples
+        if enough and row["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{endpoint}: p95 {row['p95_ms']} ms vs {base['p95_ms']} ms")
+        # Contended claims add a query now and then, so allow a little slack
+        if base["queries_per_req"] is not None and (row["queries_per_req"] or 0) > base["queries_per_req"] * 1.05 + 0.01:
+            regressions.append(f"{endpoint}: {row['queries_per_req']} queries/req vs {base['queries_per_req']}")
+        # A request that fails fast looks cheap, so more errors count on their own
+        errors, base_errors = error_rate(row["statuses"]), error_rate(base["statuses"])
+        if errors > base_errors + ERROR_RATE_SLACK:
+            regressions.append(f"{endpoint}: {errors:.1%} non-2xx vs {base_errors:.1%}")
+    return regressions
+
+
+# -----------------------
+# Scenario
+# -----------------------
+class LoadTest:
+    def __init__(self, client, recorder, args):
+        self.client = client
+        self.recorder = recorder
+        self.args = args
+        self.rng = random.Random(args.seed)
+
+    def point(self, spread=0.02):
+        return (CAMPUS_CENTER[0] + self.rng.uniform(-spread, spread),
+                CAMPUS_CENTER[1] + self.rng.uniform(-spread, spread))
+
+    async def call(self, method, path, **kwargs):
+        counter = [0]
+        token = current_queries.set(counter)
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, path, **kwargs)
+        finally:
+            current_queries.reset(token)
+        self.recorder.record(path.split("?")[0], time.perf_counter() - started, response.status_code, counter[0])
+        return response
+
+    async def setup_drivers(self):
+        for i in range(self.args.drivers):
+            driver_id = f"load-driver-{i}"
+            await self.call("POST", "/onboard_driver", json={
+                "user_id": driver_id,
+                "name": f"Load Driver {i}",
+                "license_number": f"LT{i:05d}",
+                "license_expiry": "2030-01-01",
+                "vehicle_type": "sedan",
+                "vehicle_plate": f"LT-{i}",
+                "max_detour_minutes": 15
+            })
+            lat, lng = self.point()
+            await self.call("POST", "/set_driver_location", json={"driver_id": driver_id, "lat": lat, "lng": lng})
+
+    async def pings(self, ride_id, driver_id, start, end):
+        n = self.args.pings
+        for k in range(1, n + 1):
+            lat = start[0] + (end[0] - start[0]) * k / n
+            lng = start[1] + (end[1] - start[1]) * k / n
+            await self.call("POST", "/update_location", json={
+                "ride_id": ride_id, "driver_id": driver_id, "location": {"lat": lat, "lng": lng}
+            })
+            await self.call("GET", f"/get_location?ride_id={ride_id}")
+
+    async def assign(self, ride_id, attempts=50):
+        for _ in range(attempts):
+            response = await self.call("POST", "/assign_driver", json={"ride_id": ride_id})
+            if response.status_code == 200:
+                return response.json()["driver_id"]
+            if response.status_code != 503:
+                return None
+            # Every driver is busy; wait for a ride to complete
+            await asyncio.sleep(0.01)
+        return None
+
+    async def rider(self, i, semaphore):
+        rider_id = f"load-rider-{i}"
+        # Drawn before the first await so every run replays the same scenario
+        pickup, dropoff, approach = self.point(), self.point(), self.point()
+        roll = self.rng.random()
+        async with semaphore:
+            response = await self.call("POST", "/request_ride", json={
+                "rider_id": rider_id,
+                "pickup": {"lat": pickup[0], "lng": pickup[1], "address": "Load pickup"},
+                "dropoff": {"lat": dropoff[0], "lng": dropoff[1], "address": "Load dropoff"}
+            })
+            if response.status_code != 200:
+                return
+            ride_id = response.json()["ride_id"]
+
+            driver_id = await self.assign(ride_id)
+            if not driver_id:
+                return
+
+            if roll < self.args.cancel_rate:
+                await self.call("POST", "/cancel_ride", json={"ride_id": ride_id, "rider_id": rider_id})
+                return
+            if roll < self.args.cancel_rate + self.args.fallback_rate:
+                # Driver never shows: expire the assignment and match again
+                await self.call("POST", "/fallback_check", json={"ride_id": ride_id, "timeout": 0})
+                driver_id = await self.assign(ride_id)
+                if not driver_id:
+                    return
+
+            await self.pings(ride_id, driver_id, approach, pickup)
+            await self.call("POST", "/start_ride", json={"ride_id": ride_id, "driver_id": driver_id})
+            await self.pings(ride_id, driver_id, pickup, dropoff)
+            await self.call("POST", "/complete_ride", json={"ride_id": ride_id, "driver_id": driver_id})
+            await self.call("POST", "/rider_history", json={"rider_id": rider_id})
+
+    async def run(self):
+        await self.setup_drivers()
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+        await asyncio.gather(*(self.rider(i, semaphore) for i in range(self.args.riders)))
+        await self.call("GET", "/admin_dashboard")
+
+
+def seed_users(args):
+    from datetime import datetime, UTC
+    from database import SessionLocal
+    from models import User
+
+    db = SessionLocal()
+    try:
+        now = datetime.now(UTC)
+        db.add_all(
+            [User(id=f"load-driver-{i}", name=f"Load Driver {i}", role="driver", created_at=now)
+             for i in range(args.drivers)] +
+            [User(id=f"load-rider-{i}", name=f"Load Rider {i}", role="rider", created_at=now)
+             for i in range(args.riders)]
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+async def main(args):
+    import httpx
+    from sqlalchemy import event
+    from database import engine
+    import main as app_module
+
+    recorder = Recorder()
+    event.listen(engine, "before_cursor_execute", recorder.count_query)
+
+    app = app_module.app
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=60) as client:
+            started = time.perf_counter()
+            await LoadTest(client, recorder, args).run()
+            wall_s = time.perf_counter() - started
+
+    event.remove(engine, "before_cursor_execute", recorder.count_query)
+    return summarize(recorder, wall_s)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    configure(args)
+    seed_users(args)
+    report = asyncio.run(main(args))
+    print_report(report)
+
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        path = os.path.join(BASELINE_DIR, f"{args.save_baseline}.json")
+        with open(path, "w") as f:
+            json.dump({"args": vars(args), **report}, f, indent=2, sort_keys=True)
+        print(f"Saved baseline to {path}")
+
+    if args.compare:
+        with open(os.path.join(BASELINE_DIR, f"{args.compare}.json")) as f:
+            regressions = compare(report, json.load(f), args.tolerance, args.min_samples)
+        if regressions:
+            print("Regressions against baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"No regressions against baseline {args.compare}")
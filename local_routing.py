@@ -0,0 +1,308 @@
+import csv
+import heapq
+import math
+import xml.etree.ElementTree as ET
+from routing import RoutingProvider, RouteNotFound
+from spatial_index import GridIndex, haversine_m, METERS_PER_DEG_LAT
+
+INF = float("inf")
+
+# Used when an OSM way has no usable maxspeed tag
+OSM_DEFAULT_SPEED_KPH = {
+    "motorway": 100, "motorway_link": 60,
+    "trunk": 80, "trunk_link": 50,
+    "primary": 65, "primary_link": 45,
+    "secondary": 55, "secondary_link": 40,
+    "tertiary": 45, "tertiary_link": 35,
+    "unclassified": 40, "residential": 40,
+    "living_street": 15, "service": 20
+}
+
+
+# -----------------------
+# Road Graph
+# -----------------------
+class RoadGraph:
+    """Directed road graph with travel-time weights and ALT landmark tables.
+
+    Nodes are dense ints; edge weights are seconds. Precomputed distances to
+    and from a handful of landmarks give an admissible A* heuristic, so
+    point-to-point queries settle a small fraction of the graph.
+    """
+
+    def __init__(self, snap_radius_m=1000, access_speed_mps=8.0):
+        self.coords = []        # node -> (lat, lng)
+        self.adj = []           # node -> [(to, seconds, meters)]
+        self.radj = []          # node -> [(from, seconds, meters)]
+        self._ids = {}          # external id -> node
+        self.snap_radius_m = snap_radius_m
+        self.access_speed_mps = access_speed_mps
+        self.node_index = GridIndex(cell_size_m=250)
+        self.landmarks = []
+        self.from_landmark = []  # [l][v] = d(landmark, v)
+        self.to_landmark = []    # [l][v] = d(v, landmark)
+
+    def __len__(self):
+        return len(self.coords)
+
+    def add_node(self, key, lat, lng):
+        node = self._ids.get(key)
+        if node is None:
+            node = len(self.coords)
+            self._ids[key] = node
+            self.coords.append((lat, lng))
+            self.adj.append([])
+            self.radj.append([])
+            self.node_index.upsert(node, lat, lng)
+        return node
+
+    def add_edge(self, u, v, meters, speed_kph, oneway=False):
+        seconds = meters / (speed_kph / 3.6)
+        self.adj[u].append((v, seconds, meters))
+        self.radj[v].append((u, seconds, meters))
+        if not oneway:
+            self.adj[v].append((u, seconds, meters))
+            self.radj[u].append((v, seconds, meters))
+
+    # ---- loaders ----
+
+    @classmethod
+    def load(cls, path, landmarks=8):
+        graph = cls.from_osm(path) if path.endswith(".osm") else cls.from_edge_list(path)
+        graph.prepare(landmarks)
+        return graph
+
+    @classmethod
+    def from_edge_list(cls, path):
+        """CSV with columns source, target, source_lat, source_lng, target_lat,
+        target_lng and optional length_m, speed_kph (default 40), oneway (0/1)."""
+        graph = cls()
+        with open(path, newline="") as f:
+            for row in csv.DictReader(f):
+                u = graph.add_node(row["source"], float(row["source_lat"]), float(row["source_lng"]))
+                v = graph.add_node(row["target"], float(row["target_lat"]), float(row["target_lng"]))
+                meters = float(row.get("length_m") or haversine_m(*graph.coords[u], *graph.coords[v]))
+                speed = float(row.get("speed_kph") or 40)
+                graph.add_edge(u, v, meters, speed, oneway=row.get("oneway", "0") in ("1", "true", "yes"))
+        return graph
+
+    @classmethod
+    def from_osm(cls, path):
+        """Drivable ways from an OSM XML extract."""
+        root = ET.parse(path).getroot()
+        positions = {
+            n.get("id"): (float(n.get("lat")), float(n.get("lon")))
+            for n in root.iter("node")
+        }
+
+        graph = cls()
+        for way in root.iter("way"):
+            tags = {t.get("k"): t.get("v") for t in way.iter("tag")}
+            highway = tags.get("highway")
+            if highway not in OSM_DEFAULT_SPEED_KPH:
+                continue
+
+            speed = _parse_maxspeed(tags.get("maxspeed")) or OSM_DEFAULT_SPEED_KPH[highway]
+            oneway = tags.get("oneway", "no")
+            refs = [nd.get("ref") for nd in way.iter("nd") if nd.get("ref") in positions]
+            if oneway == "-1":
+                refs.reverse()
+            is_oneway = oneway in ("yes", "1", "true", "-1") or highway == "motorway"
+
+            for a, b in zip(refs, refs[1:]):
+                u = graph.add_node(a, *positions[a])
+                v = graph.add_node(b, *positions[b])
+                graph.add_edge(u, v, haversine_m(*positions[a], *positions[b]), speed, oneway=is_oneway)
+        return graph
+
+    @classmethod
+    def synthetic_grid(cls, center_lat, center_lng, rows=30, cols=30, spacing_m=200, speed_kph=40, landmarks=8):
+        """Manhattan-style street grid around a point, for tests and load runs."""
+        graph = cls()
+        dlat = spacing_m / METERS_PER_DEG_LAT
+        dlng = dlat / math.cos(math.radians(center_lat))
+        lat0 = center_lat - dlat * (rows - 1) / 2
+        lng0 = center_lng - dlng * (cols - 1) / 2
+        for r in range(rows):
+            for c in range(cols):
+                graph.add_node((r, c), lat0 + r * dlat, lng0 + c * dlng)
+        for r in range(rows):
+            for c in range(cols):
+                u = graph._ids[(r, c)]
+                if c + 1 < cols:
+                    graph.add_edge(u, graph._ids[(r, c + 1)], spacing_m, speed_kph)
+                if r + 1 < rows:
+                    graph.add_edge(u, graph._ids[(r + 1, c)], spacing_m, speed_kph)
+        graph.prepare(landmarks)
+        return graph
+
+    # ---- preprocessing ----
+
+    def prepare(self, landmarks=8):
+        """Pick landmarks by farthest-point selection and store their
+        forward and reverse travel-time tables."""
+        self.landmarks, self.from_landmark, self.to_landmark = [], [], []
+        if not self.coords:
+            return
+
+        current = 0
+        reach = [INF] * len(self.coords)
+        for _ in range(min(landmarks, len(self.coords))):
+            forward = self._dijkstra_all(current, self.adj)
+            self.landmarks.append(current)
+            self.from_landmark.append(forward)
+            self.to_landmark.append(self._dijkstra_all(current, self.radj))
+
+            # Next landmark: the reachable node farthest from all chosen so far
+            reach = [min(a, b) for a, b in zip(reach, forward)]
+            current = max(
+                (v for v in range(len(reach)) if reach[v] < INF),
+                key=lambda v: reach[v]
+            )
+            if reach[current] == 0:
+                break
+
+    def _dijkstra_all(self, source, adjacency):
+        dist = [INF] * len(self.coords)
+        dist[source] = 0.0
+        heap = [(0.0, source)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            for v, seconds, _ in adjacency[u]:
+                nd = d + seconds
+                if nd < dist[v]:
+                    dist[v] = nd
+                    heapq.heappush(heap, (nd, v))
+        return dist
+
+    # ---- queries ----
+
+    def nearest_node(self, lat, lng):
+        found = self.node_index.nearest(lat, lng, k=1, radius_m=self.snap_radius_m)
+        if not found:
+            raise RouteNotFound("No road node near point")
+        return found[0]
+
+    def _active_landmarks(self, source, target, count=4):
+        """The landmarks giving the tightest bound for this pair, paired with
+        their distances to/from the target."""
+        scored = []
+        for from_l, to_l in zip(self.from_landmark, self.to_landmark):
+            if INF in (from_l[source], from_l[target], to_l[source], to_l[target]):
+                continue
+            bound = max(from_l[target] - from_l[source], to_l[source] - to_l[target])
+            scored.append((bound, from_l, to_l, from_l[target], to_l[target]))
+        scored.sort(key=lambda x: x[0], reverse=True)
+        return [s[1:] for s in scored[:count]]
+
+    def shortest_path(self, source, target):
+        """ALT A* search. Returns (seconds, meters)."""
+        active = self._active_landmarks(source, target)
+
+        def lower_bound(v):
+            # Triangle inequality in both directions around each landmark
+            best = 0.0
+            for from_l, to_l, from_t, to_t in active:
+                best = max(best, from_t - from_l[v], to_l[v] - to_t)
+            return best
+
+        dist = {source: 0.0}
+        meters = {source: 0.0}
+        # Ties on f go to the deeper node, which matters on grid-like streets
+        heap = [(lower_bound(source), 0.0, source)]
+        settled = set()
+        while heap:
+            _, _, u = heapq.heappop(heap)
+            if u == target:
+                return dist[u], meters[u]
+            if u in settled:
+                continue
+            settled.add(u)
+            for v, seconds, length in self.adj[u]:
+                nd = dist[u] + seconds
+                if nd < dist.get(v, INF):
+                    dist[v] = nd
+                    meters[v] = meters[u] + length
+                    heapq.heappush(heap, (nd + lower_bound(v), -nd, v))
+        raise RouteNotFound("Target not reachable")
+
+    def times_to(self, sources, target):
+        """One reverse Dijkstra from target, stopped once every source is
+        settled. Returns seconds per source (None if unreachable)."""
+        pending = set(sources)
+        dist = {target: 0.0}
+        heap = [(0.0, target)]
+        settled = set()
+        while heap and pending:
+            d, u = heapq.heappop(heap)
+            if u in settled:
+                continue
+            settled.add(u)
+            pending.discard(u)
+            for v, seconds, _ in self.radj[u]:
+                nd = d + seconds
+                if nd < dist.get(v, INF):
+                    dist[v] = nd
+                    heapq.heappush(heap, (nd, v))
+        return [dist.get(s) if s in settled else None for s in sources]
+
+
+def _parse_maxspeed(value):
+    if not value:
+        return None
+    try:
+        number = float(value.split()[0])
+    except ValueError:
+        return None
+    return number * 1.609 if "mph" in value else number
+
+
+# -----------------------
+# In-process Provider
+# -----------------------
+class LocalRoutingProvider(RoutingProvider):
+    """Answers route and ETA queries from a RoadGraph without any network
+    call. Off-graph access legs to the snapped nodes are added at
+    graph.access_speed_mps."""
+
+    name = "local"
+    max_origins_per_call = 10_000
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    def _snap(self, point):
+        return self.graph.nearest_node(point[0], point[1])
+
+    async def route(self, origin, destination):
+        source, source_off = self._snap(origin)
+        target, target_off = self._snap(destination)
+        seconds, meters = self.graph.shortest_path(source, target)
+        access_m = source_off + target_off
+        return {
+            "distance": int(meters + access_m),
+            "duration": int(seconds + access_m / self.graph.access_speed_mps),
+            "summary": "local"
+        }
+
+    async def travel_times(self, origins, destination):
+        target, target_off = self._snap(destination)
+        snapped = []
+        for origin in origins:
+            try:
+                snapped.append(self._snap(origin))
+            except RouteNotFound:
+                snapped.append(None)
+
+        times = self.graph.times_to([s[0] for s in snapped if s], target)
+        results = []
+        it = iter(times)
+        for s in snapped:
+            seconds = next(it) if s else None
+            if seconds is None:
+                results.append(None)
+            else:
+                results.append(int(seconds + (s[1] + target_off) / self.graph.access_speed_mps))
+        return results
@@ -0,0 +1,113 @@
+import json
+import os
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+LOCATION_STORE_URL = os.getenv("LOCATION_STORE_URL")  # e.g. redis://localhost:6379/0
+LOCATION_STORE_TTL_S = int(os.getenv("LOCATION_STORE_TTL_S", "21600"))
+
+
+# -----------------------
+# Backends
+# -----------------------
+class InMemoryLocationBackend:
+    """Process-local stand-in; each uvicorn worker sees only its own pings."""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self._data.get(key)
+
+    def set_if_newer(self, key, value):
+        with self._lock:
+            current = self._data.get(key)
+            if current is None or current["timestamp"] <= value["timestamp"]:
+                self._data[key] = value
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+class RedisLocationBackend:
+    """Shared across workers. Requires the optional `redis` package."""
+
+    # Only overwrite when the stored ping is older (ISO timestamps sort lexically)
+    SET_IF_NEWER = """
+        local current = redis.call('GET', KEYS[1])
+        if current and cjson.decode(current)['timestamp'] > ARGV[2] then
+            return 0
+        end
+        redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[3])
+        return 1
+    """
+
+    def __init__(self, url, ttl_s=LOCATION_STORE_TTL_S):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("LOCATION_STORE_URL points at Redis but the redis package is not installed")
+        self._redis = redis.Redis.from_url(url)
+        self._set_if_newer = self._redis.register_script(self.SET_IF_NEWER)
+        self.ttl_s = ttl_s
+
+    def get(self, key):
+        raw = self._redis.get(key)
+        return json.loads(raw) if raw else None
+
+    def set_if_newer(self, key, value):
+        self._set_if_newer(keys=[key], args=[json.dumps(value), value["timestamp"], self.ttl_s])
+
+    def delete(self, key):
+        self._redis.delete(key)
+
+
+# -----------------------
+# Latest Position Store
+# -----------------------
+class LatestLocationStore:
+    """Most recent position per ride and per driver, written on ingest so
+    /get_location can answer without touching location_updates."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, ride_id, driver_id, lat, lng, timestamp):
+        value = {
+            "ride_id": ride_id,
+            "driver_id": driver_id,
+            "lat": lat,
+            "lng": lng,
+            "timestamp": timestamp.isoformat()
+        }
+        if ride_id:
+            self.backend.set_if_newer(f"ride:{ride_id}", value)
+        self.backend.set_if_newer(f"driver:{driver_id}", value)
+
+    def for_ride(self, ride_id):
+        return self._get(f"ride:{ride_id}")
+
+    def for_driver(self, driver_id):
+        return self._get(f"driver:{driver_id}")
+
+    def forget_ride(self, ride_id):
+        self.backend.delete(f"ride:{ride_id}")
+
+    def _get(self, key):
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+
+def get_location_store(url=LOCATION_STORE_URL):
+    if url and url.startswith(("redis://", "rediss://", "unix://")):
+        return LatestLocationStore(RedisLocationBackend(url))
+    return LatestLocationStore(InMemoryLocationBackend())
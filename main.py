@@ -1,119 +1,329 @@
-from fastapi import FastAPI, Depends, HTTPException, Body
+from fastapi import FastAPI, Depends, HTTPException, Header, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse, PlainTextResponse, ORJSONResponse
+from sqlalchemy import insert, tuple_
 from sqlalchemy.orm import Session
-from pydantic import BaseModel
-from database import SessionLocal
-from models import Ride, RideStatus, User, LocationUpdate, DriverProfile, DetourScoreLog
+from database import SessionLocal, engine, replica_engine, session_dependency, use_primary, RecentWrites, pool_stats
+from models import ACTIVE_STATUSES, FINISHED_STATUSES, Ride, RideStatus, User, LocationUpdate, RideTrace, DriverProfile, DetourScoreLog, as_utc
+from spatial_index import DriverIndex
+from routing import get_routing_provider, RouteNotFound
+from route_cache import route_cache
+from matching import score_candidates, claim_driver, claim_seat, claim_ride, release_seats
+from http_client import close_http_client
+from ingest import LocationIngestor, IngestBufferFull, RideDriverCache, INGEST_MAX_PING_AGE_S, INGEST_MAX_PING_AHEAD_S
+from location_store import get_location_store
+from live_hub import LocationHub, HEARTBEAT
+from dashboard_counters import DashboardCounters, Reconciler, count_exact, summarize
+from history_pages import RecentPageCache, encode_cursor, decode_cursor, page_size
+from fallback_sweeper import FallbackSweeper, FALLBACK_REMATCH
+from batch_matching import BatchMatcher, MATCHING_MODE
+from idempotency import IdempotencyCache, IdempotencyConflict
+from pooling import PoolPlanner, POOLING_ENABLED, score_insertions
+from location_history import LocationHistoryMaintainer, TraceWriter
+from trajectory import decode_trace, simplify, encode_polyline
+from heatmap import SurgeMap, HeatmapService, SURGE_ENABLED
+from gps_filter import PingFilter, RoadSnapper, GPS_FILTER_ENABLED, GPS_SNAP_M, STORED
+from metrics import AppMetrics, MetricsMiddleware, SamplingProfiler, PROFILE_SLOW_MS
+from schemas import (
+    RideRequest, DriverOnboarding, SetDriverLocationRequest, RideRef, AssignBatchRequest, FallbackCheckRequest,
+    LocationPing, LocationBatch, DriverRideRequest, CancelRideRequest, DriverDashboardRequest, RiderHistoryRequest,
+    Message, DriverLocationSet, RouteCacheStats, Heatmap, RideQuote, Assignment, BatchReport, FallbackStatus,
+    PingAck, PingBatchAck, RideStatusChange, RideCompleted, DriverDashboardPage, RiderHistoryPage,
+    DriverLocation, RideTraceBody, DashboardSummary
+)
+import asyncio
+import logging
+import orjson
 import uuid
-import requests
 from datetime import datetime, UTC
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
-GOOGLE_KEY = os.getenv("GOOGLE_MAPS_API_KEY")
-
-app = FastAPI()
+logger = logging.getLogger(__name__)
+
+# Candidate pruning for matching
+MATCH_CANDIDATE_LIMIT = int(os.getenv("MATCH_CANDIDATE_LIMIT", "10"))
+MATCH_RADIUS_M = float(os.getenv("MATCH_RADIUS_M", "8000"))
+DRIVER_INDEX_CELL_M = float(os.getenv("DRIVER_INDEX_CELL_M", "500"))
+
+# Bodies are checked against their response_model by pydantic-core and
+# written with orjson, skipping jsonable_encoder and json.dumps
+app = FastAPI(default_response_class=ORJSONResponse)
+metrics = AppMetrics()
+metrics.instrument_engine(engine)
+if replica_engine is not engine:
+    metrics.instrument_engine(replica_engine)
+profiler = SamplingProfiler() if PROFILE_SLOW_MS else None
+app.add_middleware(MetricsMiddleware, metrics=metrics, profiler=profiler)
+
+driver_index = DriverIndex(cell_size_m=DRIVER_INDEX_CELL_M)
+routing = get_routing_provider(observe=metrics.observe_routing)
+# Snapping needs the in-process road graph, so only with ROUTING_PROVIDER=local
+road_graph = getattr(getattr(routing, "provider", routing), "graph", None)
+ping_filter = PingFilter(snapper=RoadSnapper(road_graph) if road_graph and GPS_SNAP_M > 0 else None)
+ingestor = LocationIngestor(SessionLocal)
+location_store = get_location_store()
+live_hub = LocationHub()
+dashboard = DashboardCounters()
+dashboard_reconciler = Reconciler(dashboard, SessionLocal)
+location_history = LocationHistoryMaintainer(engine, SessionLocal)
+trace_writer = TraceWriter(SessionLocal)
+surge_map = SurgeMap()
+heatmap_service = HeatmapService(surge_map, SessionLocal, driver_index)
+page_cache = RecentPageCache()
+ride_drivers = RideDriverCache()  # ride_id -> driver_id for accepted / in_progress rides
+idempotency_cache = IdempotencyCache()
+pool_planner = PoolPlanner()
+recent_writes = RecentWrites()
+
+def invalidate_pages(rider_id=None, driver_id=None):
+    # Every ride transition lands here, so it also pins the users' next reads to the primary
+    if rider_id:
+        page_cache.invalidate("rider", rider_id)
+        recent_writes.mark(("rider", rider_id))
+    if driver_id:
+        page_cache.invalidate("driver", driver_id)
+        recent_writes.mark(("driver", driver_id))
+
+def parse_cursor(cursor):
+    try:
+        return decode_cursor(cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
 # -----------------------
 # DB Session Dependency
 # -----------------------
-def get_db():
+get_db = session_dependency()
+
+# -----------------------
+# Driver Index Warm-up
+# -----------------------
+def warm_driver_index(db: Session):
+    positions = db.query(DriverProfile.user_id, DriverProfile.lat, DriverProfile.lng).filter(
+        DriverProfile.lat.isnot(None),
+        DriverProfile.lng.isnot(None)
+    ).all()
+    busy = db.query(Ride.driver_id).filter(
+        Ride.status.in_(ACTIVE_STATUSES),
+        Ride.driver_id.isnot(None)
+    ).distinct().all()
+    driver_index.load(positions, [b[0] for b in busy])
+
+@app.on_event("startup")
+def load_driver_index():
     db = SessionLocal()
     try:
-        yield db
+        warm_driver_index(db)
+        pool_planner.load(db)
     finally:
         db.close()
 
-# -----------------------
-# Request Schemas
-# -----------------------
-class Location(BaseModel):
-    lat: float
-    lng: float
-    address: str
+@app.on_event("startup")
+def start_ingestor():
+    ingestor.start()
 
-class RideRequest(BaseModel):
-    rider_id: str
-    pickup: Location
-    dropoff: Location
+@app.on_event("startup")
+def start_dashboard_reconciler():
+    dashboard_reconciler.start()
 
-class DriverOnboarding(BaseModel):
-    user_id: str
-    name: str
-    license_number: str
-    license_expiry: str  # format: "YYYY-MM-DD"
-    vehicle_type: str
-    vehicle_plate: str
-    capacity: int = 4
-    max_detour_minutes: int = 10
+@app.on_event("shutdown")
+def stop_dashboard_reconciler():
+    dashboard_reconciler.stop()
 
-# -----------------------
-# Ride Status Enum
-# -----------------------
-class SetDriverLocationRequest(BaseModel):
-    driver_id: str
-    lat: float
-    lng: float
+@app.on_event("startup")
+def start_heatmap_service():
+    # Registered after load_driver_index, so the first snapshot sees idle drivers
+    heatmap_service.start()
+
+@app.on_event("shutdown")
+def stop_heatmap_service():
+    heatmap_service.stop()
+
+@app.on_event("startup")
+def start_location_history():
+    location_history.start()
+
+@app.on_event("shutdown")
+def stop_location_history():
+    location_history.stop()
+
+@app.on_event("startup")
+async def bind_live_hub():
+    live_hub.bind(asyncio.get_running_loop())
+
+@app.on_event("shutdown")
+def stop_ingestor():
+    ingestor.stop()
+
+@app.on_event("startup")
+def start_trace_writer():
+    trace_writer.start()
 
-class Location(BaseModel):
-    lat: float
-    lng: float
-    address: str
+@app.on_event("shutdown")
+def stop_trace_writer():
+    # After the ingestor, so the last buffered pings make it into the traces
+    trace_writer.stop()
+
+@app.on_event("shutdown")
+async def close_routing_client():
+    await close_http_client()
 
 # -----------------------
 # Home Check
 # -----------------------
-@app.get("/")
+@app.get("/", response_model=Message)
 def home():
     return {"message": "Kamuit backend is running"}
 
 # -----------------------
 #  Set Driver Location
 # -----------------------
-@app.post("/set_driver_location")
+@app.post("/set_driver_location", response_model=DriverLocationSet)
 def set_driver_location(data: SetDriverLocationRequest, db: Session = Depends(get_db)):
     profile = db.query(DriverProfile).filter_by(user_id=data.driver_id).first()
     if not profile:
         raise HTTPException(status_code=404, detail="Driver not found")
 
-    profile.lat = data.lat
-    profile.lng = data.lng
+    now = datetime.now(UTC)
+    verdict, lat, lng = STORED, data.lat, data.lng
+    if GPS_FILTER_ENABLED:
+        verdict, lat, lng = ping_filter.process(data.driver_id, data.lat, data.lng, now, data.accuracy)
+    if verdict != STORED:
+        return {
+            "message": "Driver GPS unchanged",
+            "driver_id": data.driver_id,
+            "lat": profile.lat,
+            "lng": profile.lng,
+            "filtered": verdict
+        }
+
+    profile.lat = lat
+    profile.lng = lng
     db.commit()
 
+    driver_index.update_position(data.driver_id, lat, lng)
+    location_store.record(None, data.driver_id, lat, lng, now)
+
     return {
         "message": "Driver GPS updated",
         "driver_id": data.driver_id,
-        "lat": data.lat,
-        "lng": data.lng
+        "lat": lat,
+        "lng": lng,
+        "filtered": verdict
     }
 
 
 
 # -----------------------
-#  Request Ride
+# Route Cache Stats
 # -----------------------
-@app.post("/request_ride")
-def request_ride(data: RideRequest, db: Session = Depends(get_db)):
-    url = "https://maps.googleapis.com/maps/api/directions/json"
-    params = {
-        "origin": f"{data.pickup.lat},{data.pickup.lng}",
-        "destination": f"{data.dropoff.lat},{data.dropoff.lng}",
-        "mode": "driving",
-        "key": GOOGLE_KEY
+@app.get("/route_cache_stats", response_model=RouteCacheStats)
+def route_cache_stats():
+    return route_cache.stats()
+
+# -----------------------
+# Demand / Supply Heatmap
+# -----------------------
+@app.get("/heatmap", response_model=Heatmap)
+def get_heatmap(min_surge: float = 1.0):
+    grid = surge_map.grid
+    return {
+        "cell_size_m": surge_map.cell_size_m,
+        "updated_at": datetime.fromtimestamp(grid.updated_at, UTC).isoformat() if grid else None,
+        "compute_ms": round(surge_map.compute_ms, 3),
+        "surge_enabled": SURGE_ENABLED,
+        "cells": surge_map.cells(min_surge)
     }
 
-    response = requests.get(url, params=params).json()
-    if not response.get("routes"):
-        raise HTTPException(status_code=400, detail="Route not found")
+# -----------------------
+# Metrics
+# -----------------------
+@metrics.registry.collector
+def component_metrics():
+    cache = route_cache.stats()
+    ingest = ingestor.stats()
+    gps = ping_filter.stats()
+    pools = {"primary": pool_stats(engine)}
+    if replica_engine is not engine:
+        pools["replica"] = pool_stats(replica_engine)
+    history = location_history.stats()
+    return [
+        ("route_cache_lookups_total", "counter", "Route cache lookups by result", [
+            ({"result": "hit"}, cache["hits"]),
+            ({"result": "store_hit"}, cache["store_hits"]),
+            ({"result": "miss"}, cache["misses"])
+        ]),
+        ("route_cache_hit_ratio", "gauge", "Share of route lookups served from cache", [({}, cache["hit_rate"])]),
+        ("route_cache_entries", "gauge", "Routes held in memory", [({}, cache["entries"])]),
+        ("location_ingest_buffered", "gauge", "GPS pings waiting to be flushed", [({}, ingest["buffered"])]),
+        ("location_ingest_flushed_total", "counter", "GPS pings written", [({}, ingest["flushed"])]),
+        ("location_ingest_rejected_total", "counter", "GPS pings refused with 429", [({}, ingest["rejected"])]),
+        ("gps_filter_pings_total", "counter", "GPS pings by filter verdict", [
+            ({"result": STORED}, gps["stored"]),
+            ({"result": "suppressed"}, gps["suppressed"]),
+            ({"result": "rejected"}, gps["rejected"])
+        ]),
+        ("gps_filter_tracks", "gauge", "Drivers with a live smoothing track", [({}, gps["tracks"])]),
+        ("location_rides_compacted_total", "counter", "Finished rides written to ride_traces",
+         [({}, trace_writer.written + history["rides_compacted"])]),
+        ("location_traces_pending", "gauge", "Finished rides waiting for their trace", [({}, len(trace_writer))]),
+        ("location_rows_archived_total", "counter", "Location rows archived and dropped",
+         [({}, history["rows_archived"])]),
+        ("db_pool_connections", "gauge", "Pooled DB connections by state", [
+            ({"engine": name, "state": state}, stats[state])
+            for name, stats in pools.items() for state in ("checked_out", "idle")
+        ]),
+        ("db_pool_capacity", "gauge", "pool_size + max_overflow per engine",
+         [({"engine": name}, stats["capacity"]) for name, stats in pools.items()]),
+        ("db_pool_overflow", "gauge", "Connections open beyond pool_size",
+         [({"engine": name}, stats["overflow"]) for name, stats in pools.items()]),
+        ("db_pool_utilization", "gauge", "Checked-out share of pool capacity",
+         [({"engine": name}, stats["utilization"]) for name, stats in pools.items()]),
+        ("db_pool_connects_total", "counter", "DB connections opened",
+         [({"engine": name}, stats["connects"]) for name, stats in pools.items()]),
+        ("heatmap_compute_ms", "gauge", "Time to bin and price the last heatmap snapshot",
+         [({}, surge_map.compute_ms)]),
+        ("assignment_deadlines_pending", "gauge", "Accepted rides awaiting start", [({}, len(fallback_sweeper))]),
+        ("assignments_expired_total", "counter", "Assignments reset by the sweeper", [({}, fallback_sweeper.expired)]),
+    ]
+
+@app.on_event("startup")
+def start_profiler():
+    if profiler:
+        profiler.start()
+
+@app.on_event("shutdown")
+def stop_profiler():
+    if profiler:
+        profiler.stop()
+
+@app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
 
-    leg = response["routes"][0]["legs"][0]
-    route_summary = {
-        "distance": leg["distance"]["value"],
-        "duration": leg["duration"]["value"],
-        "summary": response["routes"][0]["summary"]
-    }
+# -----------------------
+#  Request Ride
+# -----------------------
+def save_ride(db: Session, ride: Ride):
+    db.add(ride)
+    db.commit()
+    dashboard.ride_created()
+    invalidate_pages(rider_id=ride.rider_id)
 
-    fare_estimate = int((route_summary["distance"] / 1000) * 1.5 * 100)  # cents -> requird logicical equation from Managemnt
+@app.post("/request_ride", response_model=RideQuote)
+async def request_ride(data: RideRequest, db: Session = Depends(get_db)):
+    try:
+        route_summary = await routing.route(
+            (data.pickup.lat, data.pickup.lng),
+            (data.dropoff.lat, data.dropoff.lng)
+        )
+    except RouteNotFound:
+        raise HTTPException(status_code=400, detail="Route not found")
+
+    surge = surge_map.multiplier(data.pickup.lat, data.pickup.lng) if SURGE_ENABLED else 1.0
+    fare_estimate = int((route_summary["distance"] / 1000) * 1.5 * 100 * surge)  # cents -> requird logicical equation from Managemnt
 
     ride = Ride(
         id=str(uuid.uuid4()),
@@ -133,12 +343,14 @@ def request_ride(data: RideRequest, db: Session = Depends(get_db)):
         created_at=datetime.now(UTC)
     )
 
-    db.add(ride)
-    db.commit()
+    # Keep blocking DB work off the event loop
+    await run_in_threadpool(save_ride, db, ride)
+    surge_map.record_request(data.pickup.lat, data.pickup.lng)
 
     return {
         "ride_id": ride.id,
         "fare_estimate": fare_estimate,
+        "surge_multiplier": surge,
         "summary": route_summary["summary"],
         "distance_m": route_summary["distance"],
         "duration_s": route_summary["duration"]
@@ -147,165 +359,389 @@ def request_ride(data: RideRequest, db: Session = Depends(get_db)):
 # -----------------------
 # Assign Driver
 # -----------------------
-@app.post("/assign_driver")
-def assign_driver(ride_data: dict = Body(...), db: Session = Depends(get_db)):
-    from models import DetourScoreLog
-
-    ride_id = ride_data.get("ride_id")
-    ride = db.query(Ride).filter_by(id=ride_id, status=RideStatus.requested).first()
-    if not ride:
-        raise HTTPException(status_code=404, detail="Ride not found or already matched")
-
-    # Get active driver IDs
+def nearby_idle_ids(lat, lng, exclude_driver_ids=()):
+    # Only the k nearest idle drivers are worth routing
+    return [d for d, _ in driver_index.nearest_idle(
+        lat, lng, k=MATCH_CANDIDATE_LIMIT + len(exclude_driver_ids), radius_m=MATCH_RADIUS_M
+    ) if d not in exclude_driver_ids][:MATCH_CANDIDATE_LIMIT]
+
+def confirm_idle_drivers(db: Session, driver_ids):
+    # The index is per-process, so confirm idleness against the DB
+    if not driver_ids:
+        return []
     active_driver_ids = db.query(Ride.driver_id).filter(
-        Ride.status.in_([RideStatus.accepted, RideStatus.in_progress])
+        Ride.driver_id.in_(driver_ids),
+        Ride.status.in_(ACTIVE_STATUSES)
     ).distinct().all()
     active_driver_ids = [d[0] for d in active_driver_ids if d[0]]
+    for driver_id in active_driver_ids:
+        driver_index.set_busy(driver_id)
 
-    # Get idle, GPS-ready drivers
-    candidates = db.query(DriverProfile).filter(
+    return db.query(DriverProfile).filter(
+        DriverProfile.user_id.in_(driver_ids),
         ~DriverProfile.user_id.in_(active_driver_ids),
         DriverProfile.lat.isnot(None),
         DriverProfile.lng.isnot(None)
     ).all()
 
-    if not candidates:
+def load_match_candidates(db: Session, ride_id, exclude_driver_ids=()):
+    ride = db.query(Ride).filter_by(id=ride_id, status=RideStatus.requested).first()
+    if not ride:
+        raise HTTPException(status_code=404, detail="Ride not found or already matched")
+
+    if not len(driver_index):
+        warm_driver_index(db)
+    candidates = confirm_idle_drivers(db, nearby_idle_ids(ride.pickup_lat, ride.pickup_lng, exclude_driver_ids))
+    pool_candidates = load_pool_candidates(db, ride, exclude_driver_ids) if POOLING_ENABLED else []
+
+    if not candidates and not pool_candidates:
         raise HTTPException(status_code=503, detail="No available drivers with GPS")
 
-    detour_candidates = []
-    for driver in candidates:
-        origin = f"{driver.lat},{driver.lng}"
-        destination = f"{ride.pickup_lat},{ride.pickup_lng}"
+    # Routing calls come next; hand the connection back to the pool for them.
+    # The claim re-checks availability, so nothing here needs to stay locked
+    db.expunge_all()
+    db.rollback()
+    return ride, candidates, pool_candidates
+
+def load_pool_candidates(db: Session, ride: Ride, exclude_driver_ids=()):
+    # En-route drivers near the pickup, confirmed to still have a free seat
+    nearby_ids = [d for d, _ in driver_index.nearest(
+        ride.pickup_lat, ride.pickup_lng,
+        k=MATCH_CANDIDATE_LIMIT, radius_m=MATCH_RADIUS_M, predicate=pool_planner.is_en_route
+    ) if d not in exclude_driver_ids]
+    if not nearby_ids:
+        return []
+    return db.query(DriverProfile).filter(
+        DriverProfile.user_id.in_(nearby_ids),
+        DriverProfile.current_load < DriverProfile.capacity,
+        DriverProfile.lat.isnot(None),
+        DriverProfile.lng.isnot(None)
+    ).all()
 
-        url = "https://maps.googleapis.com/maps/api/directions/json"
-        params = {
-            "origin": origin,
-            "destination": destination,
-            "key": GOOGLE_KEY
+def mark_assigned(ride: Ride, driver_id, accepted_at, insertion=None):
+    driver_index.set_busy(driver_id)
+    ride_drivers[ride.id] = driver_id
+    if insertion:
+        pool_planner.assign(driver_id, ride, insertion.pickup_at, insertion.dropoff_at)
+    else:
+        pool_planner.assign(driver_id, ride)
+    dashboard.ride_moved(RideStatus.requested, RideStatus.accepted, acquired_driver=driver_id)
+    invalidate_pages(rider_id=ride.rider_id, driver_id=driver_id)
+    fallback_sweeper.schedule(ride.id, accepted_at)
+
+def commit_assignment(db: Session, ride: Ride, detour_candidates, insertions=()):
+    # An idle driver costs its time to pickup, a pooled one the time its plan grows beyond
+    # the new rider's own trip. Cheapest first; drivers claimed in the meantime are skipped
+    options = sorted(
+        [(detour, driver_id, None) for driver_id, detour in detour_candidates] +
+        [(x.cost, x.driver_id, x) for x in insertions],
+        key=lambda o: o[0]
+    )
+    accepted_at = datetime.now(UTC)
+    for best_detour, chosen_driver_id, insertion in options:
+        if insertion:
+            if claim_seat(db, chosen_driver_id, insertion.version):
+                break
+        elif claim_driver(db, chosen_driver_id):
+            break
+        else:
+            driver_index.set_busy(chosen_driver_id)
+    else:
+        db.rollback()
+        raise HTTPException(status_code=503, detail="All suitable drivers were just assigned")
+
+    if not claim_ride(db, ride.id, chosen_driver_id, accepted_at):
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Ride already matched")
+
+    # Log detour scores: one multi-row INSERT in the same transaction as the claim
+    db.execute(insert(DetourScoreLog), [
+        {
+            "ride_id": ride.id,
+            "driver_id": driver_id,
+            "detour_duration_s": detour,
+            "assigned_at": accepted_at,
+            "was_accepted": 1 if driver_id == chosen_driver_id else 0
         }
+        for detour, driver_id, _ in options
+    ])
+    db.commit()
+    mark_assigned(ride, chosen_driver_id, accepted_at, insertion)
 
-        try:
-            response = requests.get(url, params=params).json()
-            if "routes" not in response or not response["routes"]:
-                continue
+    return {
+        "ride_id": ride.id,
+        "driver_id": chosen_driver_id,
+        "detour_duration_s": best_detour,
+        "pooled": insertion is not None,
+        "status": RideStatus.accepted.value
+    }
 
-            detour_duration_s = response["routes"][0]["legs"][0]["duration"]["value"]
-            detour_minutes = detour_duration_s / 60.0
+async def match_ride(db: Session, ride_id, exclude_driver_ids=()):
+    ride, candidates, pool_candidates = await run_in_threadpool(
+        load_match_candidates, db, ride_id, exclude_driver_ids
+    )
 
-            # ⛔ Skip if detour exceeds driver's threshold
-            if detour_minutes > driver.max_detour_minutes:
-                continue
+    # One batched many-origins -> pickup call, chunks fanned out concurrently
+    detour_candidates = await score_candidates(routing, candidates, (ride.pickup_lat, ride.pickup_lng))
 
-            detour_candidates.append((driver.user_id, detour_duration_s))
-        except Exception:
-            continue
+    insertions = []
+    if pool_candidates:
+        # Cheapest insertion of this ride into each nearby en-route driver's stop plan
+        insertions = await score_insertions(
+            routing, pool_candidates,
+            {d.user_id: driver_index.get(d.user_id) or (d.lat, d.lng) for d in pool_candidates},
+            {d.user_id: pool_planner.plan(d.user_id) for d in pool_candidates},
+            ride
+        )
 
-    if not detour_candidates:
+    if not detour_candidates and not insertions:
         raise HTTPException(status_code=503, detail="No suitable driver found (all detours too high?)")
 
-    # Pick driver with lowest detour
-    detour_candidates.sort(key=lambda x: x[1])
-    chosen_driver_id, best_detour = detour_candidates[0]
+    return await run_in_threadpool(commit_assignment, db, ride, detour_candidates, insertions)
 
-    # Assign ride
-    ride.driver_id = chosen_driver_id
-    ride.status = RideStatus.accepted
-    ride.accepted_at = datetime.now(UTC)
-    db.commit()
+async def run_idempotent(key, fn, fingerprint):
+    try:
+        return await idempotency_cache.run(key, fn, fingerprint)
+    except IdempotencyConflict:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+
+@app.post("/assign_driver", response_model=Assignment)
+async def assign_driver(
+    ride_data: RideRef,
+    idempotency_key: str | None = Header(default=None),
+    db: Session = Depends(get_db)
+):
+    # A retried request with the same key gets the original assignment back
+    return await run_idempotent(
+        idempotency_key and f"assign_driver:{idempotency_key}",
+        lambda: match_ride(db, ride_data.ride_id),
+        ride_data.ride_id
+    )
 
-    # Log detour scores
-    for driver_id, detour in detour_candidates:
-        db.add(DetourScoreLog(
-            ride_id=ride.id,
-            driver_id=driver_id,
-            detour_duration_s=detour,
-            was_accepted=1 if driver_id == chosen_driver_id else 0
-        ))
-    db.commit()
+# -----------------------
+# Batch Matching
+# -----------------------
+def load_batch_candidates(db: Session, rides):
+    if not len(driver_index):
+        warm_driver_index(db)
+    nearby = {ride.id: nearby_idle_ids(ride.pickup_lat, ride.pickup_lng) for ride in rides}
+    # One idleness check for the whole window
+    profiles = {p.user_id: p for p in confirm_idle_drivers(
+        db, list({d for ids in nearby.values() for d in ids})
+    )}
+    return {ride_id: [profiles[d] for d in ids if d in profiles] for ride_id, ids in nearby.items()}
+
+batch_matcher = BatchMatcher(SessionLocal, routing, load_batch_candidates, on_assigned=mark_assigned)
+
+@app.on_event("startup")
+async def start_batch_matcher():
+    if MATCHING_MODE == "batch":
+        batch_matcher.start()
+
+@app.on_event("shutdown")
+async def stop_batch_matcher():
+    await batch_matcher.stop()
+
+@app.post("/assign_batch", response_model=BatchReport, response_model_exclude_unset=True)
+async def assign_batch(data: AssignBatchRequest | None = None, idempotency_key: str | None = Header(default=None)):
+    # Matches the given rides (or every waiting ride) as one global assignment
+    ride_ids = data.ride_ids if data else None
+    return await run_idempotent(
+        idempotency_key and f"assign_batch:{idempotency_key}",
+        lambda: batch_matcher.run_batch(ride_ids),
+        tuple(sorted(ride_ids)) if ride_ids else None
+    )
 
-    return {
-        "ride_id": ride.id,
-        "driver_id": ride.driver_id,
-        "detour_duration_s": best_detour,
-        "status": ride.status.value
-    }
 
+# -----------------------
+# Fallback Sweeper
+# -----------------------
+def release_expired_assignment(ride_id, rider_id, driver_id):
+    driver_index.set_busy(driver_id, pool_planner.finish(driver_id, ride_id))
+    ride_drivers.pop(ride_id, None)
+    dashboard.ride_moved(RideStatus.accepted, RideStatus.requested, released_driver=driver_id)
+    invalidate_pages(rider_id=rider_id, driver_id=driver_id)
+
+def release_expired_assignments(rows):
+    for ride_id, rider_id, driver_id in rows:
+        release_expired_assignment(ride_id, rider_id, driver_id)
+
+async def rematch_expired_rides(rows):
+    for ride_id, _, driver_id in rows:
+        db = SessionLocal()
+        try:
+            # Don't hand the ride straight back to the driver who let it lapse
+            await match_ride(db, ride_id, exclude_driver_ids={driver_id})
+        except HTTPException as e:
+            logger.info("Re-match of ride %s failed: %s", ride_id, e.detail)
+        except Exception:
+            # A routing or DB error on one ride shouldn't stop the rest of the sweep
+            logger.exception("Re-match of ride %s failed", ride_id)
+        finally:
+            db.close()
+
+fallback_sweeper = FallbackSweeper(
+    SessionLocal,
+    on_reset=release_expired_assignments,
+    on_rematch=rematch_expired_rides if FALLBACK_REMATCH else None
+)
+
+@app.on_event("startup")
+def load_fallback_deadlines():
+    db = SessionLocal()
+    try:
+        fallback_sweeper.load(db)
+    finally:
+        db.close()
+
+@app.on_event("startup")
+async def start_fallback_sweeper():
+    fallback_sweeper.start()
+
+@app.on_event("shutdown")
+async def stop_fallback_sweeper():
+    await fallback_sweeper.stop()
 
 # -----------------------
 # Fallback Check
 # -----------------------
-@app.post("/fallback_check")
-def fallback_check(data: dict = Body(...), db: Session = Depends(get_db)):
-    ride_id = data.get("ride_id")
-    fallback_timeout = data.get("timeout", 30)
+@app.post("/fallback_check", response_model=FallbackStatus, response_model_exclude_unset=True)
+def fallback_check(data: FallbackCheckRequest, db: Session = Depends(get_db)):
+    ride_id = data.ride_id
+    fallback_timeout = data.timeout
 
     ride = db.query(Ride).filter_by(id=ride_id).first()
     if not ride or ride.status != RideStatus.accepted:
         raise HTTPException(status_code=404, detail="No active ride for fallback check")
 
-    elapsed = (datetime.now(UTC) - ride.accepted_at).total_seconds()
+    elapsed = (datetime.now(UTC) - as_utc(ride.accepted_at)).total_seconds()
     if elapsed < fallback_timeout:
         return {"status": "waiting", "seconds_since_assignment": elapsed}
 
-    db.query(DetourScoreLog).filter_by(ride_id=ride_id, driver_id=ride.driver_id).update(
-        {"was_accepted": -1}
+    # Log, ride reset and seat release commit together; the reset is conditional
+    # so a ride started in the meantime is left alone
+    released_driver_id = ride.driver_id
+    reset = db.query(Ride).filter_by(
+        id=ride_id, status=RideStatus.accepted, driver_id=released_driver_id
+    ).update({"status": RideStatus.requested, "driver_id": None}, synchronize_session=False)
+    if not reset:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Ride changed state during fallback check")
+
+    db.query(DetourScoreLog).filter_by(ride_id=ride_id, driver_id=released_driver_id).update(
+        {"was_accepted": -1}, synchronize_session=False
     )
+    release_seats(db, [released_driver_id])
     db.commit()
-
-    ride.driver_id = None
-    ride.status = RideStatus.requested
-    db.commit()
+    fallback_sweeper.cancel(ride_id)
+    release_expired_assignment(ride_id, ride.rider_id, released_driver_id)
 
     return {"status": "fallback_triggered", "elapsed_s": elapsed}
 
 # -----------------------
 # Update Driver Location
 # -----------------------
-@app.post("/update_location")
-def update_location(data: dict = Body(...), db: Session = Depends(get_db)):
-    ride_id = data.get("ride_id")
-    driver_id = data.get("driver_id")
-    location = data.get("location")
-
-    if not location or "lat" not in location or "lng" not in location:
-        raise HTTPException(status_code=400, detail="Invalid location data")
-
-    ride = db.query(Ride).filter_by(id=ride_id, driver_id=driver_id).first()
-    if not ride:
+def resolve_ride_driver(db: Session, ride_id, expected_driver_id=None):
+    # Active rides are cached so a GPS ping normally costs no DB round trip. A
+    # ping from another driver re-reads the ride: another worker may have reassigned it
+    driver_id = ride_drivers.get(ride_id)
+    if driver_id is None or driver_id != expected_driver_id:
+        ride = db.query(Ride.driver_id, Ride.status).filter_by(id=ride_id).first()
+        if not ride:
+            return None, False
+        driver_id = ride.driver_id
+        if ride.status not in ACTIVE_STATUSES:
+            return driver_id, False
+        ride_drivers[ride_id] = driver_id
+    return driver_id, True
+
+def parse_ping(db: Session, ping: LocationPing):
+    now = datetime.now(UTC)
+    timestamp = as_utc(ping.timestamp) if ping.timestamp else now
+    skew = (timestamp - now).total_seconds()
+    if skew > INGEST_MAX_PING_AHEAD_S or skew < -INGEST_MAX_PING_AGE_S:
+        raise HTTPException(status_code=400, detail="Ping timestamp too far from server time")
+
+    ride_driver_id, active = resolve_ride_driver(db, ping.ride_id, ping.driver_id)
+    if ride_driver_id != ping.driver_id:
         raise HTTPException(status_code=404, detail="Ride not found or driver mismatch")
 
-    update = LocationUpdate(
-        id=str(uuid.uuid4()),
-        ride_id=ride_id,
-        driver_id=driver_id,
-        lat=location["lat"],
-        lng=location["lng"],
-        timestamp=datetime.now(UTC)
-    )
+    location = ping.location
+    device_clock = ping.timestamp is not None
+    return ping.ride_id, ping.driver_id, location.lat, location.lng, timestamp, active, location.accuracy, device_clock
+
+def filter_pings(pings):
+    # Outliers and pings that barely moved stop here; the rest carry the smoothed position
+    if not GPS_FILTER_ENABLED:
+        return [ping[:6] for ping in pings]
+    kept = []
+    # Batched uploads are filtered in device time order
+    for ride_id, driver_id, lat, lng, timestamp, active, accuracy, device_clock in sorted(pings, key=lambda p: p[4]):
+        verdict, lat, lng = ping_filter.process(driver_id, lat, lng, timestamp, accuracy, device_clock, ride_id)
+        if verdict == STORED:
+            kept.append((ride_id, driver_id, lat, lng, timestamp, active))
+    return kept
+
+def enqueue_pings(pings):
+    pings = filter_pings(pings)
+    if not pings:
+        return 0
+    try:
+        ingestor.submit_many([ping[:5] for ping in pings])
+    except IngestBufferFull:
+        raise HTTPException(status_code=429, detail="Location ingest is backed up, retry shortly",
+                            headers={"Retry-After": "1"})
+
+    for ride_id, driver_id, lat, lng, timestamp, active in pings:
+        driver_index.update_position(driver_id, lat, lng, busy=active)
+        location_store.record(ride_id, driver_id, lat, lng, timestamp)
+        live_hub.publish(ride_id, {
+            "ride_id": ride_id,
+            "driver_id": driver_id,
+            "lat": lat,
+            "lng": lng,
+            "timestamp": timestamp.isoformat()
+        })
+    return len(pings)
+
+@app.post("/update_location", response_model=PingAck)
+def update_location(data: LocationPing, db: Session = Depends(get_db)):
+    ping = parse_ping(db, data)
+    stored = enqueue_pings([ping])
 
-    db.add(update)
+    return {
+        "message": "Location updated",
+        "ride_id": ping[0],
+        "driver_id": ping[1],
+        "timestamp": ping[4].isoformat(),
+        "stored": bool(stored)
+    }
 
-    profile = db.query(DriverProfile).filter_by(user_id=driver_id).first()
-    if profile:
-        profile.lat = location["lat"]
-        profile.lng = location["lng"]
+@app.post("/update_locations", response_model=PingBatchAck)
+def update_locations(data: LocationBatch, db: Session = Depends(get_db)):
+    accepted, rejected = [], []
+    for i, ping in enumerate(data.pings):
+        try:
+            accepted.append(parse_ping(db, ping))
+        except HTTPException as e:
+            rejected.append({"index": i, "detail": e.detail})
 
-    db.commit()
+    stored = enqueue_pings(accepted) if accepted else 0
 
     return {
-        "message": "Location updated",
-        "ride_id": ride_id,
-        "driver_id": driver_id,
-        "timestamp": update.timestamp.isoformat()
+        "message": "Locations queued",
+        "accepted": len(accepted),
+        "stored": stored,
+        "rejected": rejected
     }
 
 # -----------------------
 # Start Ride
 # -----------------------
-@app.post("/start_ride")
-def start_ride(data: dict = Body(...), db: Session = Depends(get_db)):
-    ride_id = data.get("ride_id")
-    driver_id = data.get("driver_id")
+@app.post("/start_ride", response_model=RideStatusChange)
+def start_ride(data: DriverRideRequest, db: Session = Depends(get_db)):
+    ride_id = data.ride_id
+    driver_id = data.driver_id
 
     ride = db.query(Ride).filter_by(id=ride_id, driver_id=driver_id).first()
 
@@ -318,6 +754,10 @@ def start_ride(data: dict = Body(...), db: Session = Depends(get_db)):
     ride.status = RideStatus.in_progress
     ride.started_at = datetime.now(UTC)  # optional field
     db.commit()
+    pool_planner.picked_up(driver_id, ride_id)
+    dashboard.ride_moved(RideStatus.accepted, RideStatus.in_progress)
+    fallback_sweeper.cancel(ride_id)
+    invalidate_pages(rider_id=ride.rider_id, driver_id=driver_id)
 
     return {
         "ride_id": ride.id,
@@ -328,10 +768,10 @@ def start_ride(data: dict = Body(...), db: Session = Depends(get_db)):
 # -----------------------
 # Complete Ride
 # -----------------------
-@app.post("/complete_ride")
-def complete_ride(data: dict = Body(...), db: Session = Depends(get_db)):
-    ride_id = data.get("ride_id")
-    driver_id = data.get("driver_id")
+@app.post("/complete_ride", response_model=RideCompleted)
+def complete_ride(data: DriverRideRequest, db: Session = Depends(get_db)):
+    ride_id = data.ride_id
+    driver_id = data.driver_id
 
     ride = db.query(Ride).filter_by(id=ride_id, driver_id=driver_id).first()
     if not ride:
@@ -342,7 +782,16 @@ def complete_ride(data: dict = Body(...), db: Session = Depends(get_db)):
 
     ride.status = RideStatus.completed
     ride.completed_at = datetime.now(UTC)
+    release_seats(db, [driver_id])
     db.commit()
+    # Still busy if other pooled riders are on the plan
+    driver_index.set_busy(driver_id, pool_planner.finish(driver_id, ride_id))
+    ride_drivers.pop(ride_id, None)
+    dashboard.ride_moved(RideStatus.in_progress, RideStatus.completed, released_driver=driver_id)
+    invalidate_pages(rider_id=ride.rider_id, driver_id=driver_id)
+    location_store.forget_ride(ride_id)
+    live_hub.close_ride(ride_id)
+    trace_writer.submit(ride_id, driver_id)
 
     return {
         "ride_id": ride.id,
@@ -353,10 +802,10 @@ def complete_ride(data: dict = Body(...), db: Session = Depends(get_db)):
 # -----------------------
 # Cancel Ride
 # -----------------------
-@app.post("/cancel_ride")
-def cancel_ride(data: dict = Body(...), db: Session = Depends(get_db)):
-    ride_id = data.get("ride_id")
-    rider_id = data.get("rider_id")
+@app.post("/cancel_ride", response_model=RideStatusChange)
+def cancel_ride(data: CancelRideRequest, db: Session = Depends(get_db)):
+    ride_id = data.ride_id
+    rider_id = data.rider_id
 
     ride = db.query(Ride).filter_by(id=ride_id, rider_id=rider_id).first()
     if not ride:
@@ -368,9 +817,20 @@ def cancel_ride(data: dict = Body(...), db: Session = Depends(get_db)):
     if ride.status == RideStatus.in_progress:
         raise HTTPException(status_code=403, detail="Cannot cancel a ride in progress")
 
+    previous_status = ride.status
     ride.status = RideStatus.cancelled
     ride.completed_at = datetime.now(UTC)  # optional reuse of this field
+    release_seats(db, [ride.driver_id])
     db.commit()
+    dashboard.ride_moved(previous_status, RideStatus.cancelled, released_driver=ride.driver_id)
+    fallback_sweeper.cancel(ride_id)
+    invalidate_pages(rider_id=rider_id, driver_id=ride.driver_id)
+    if ride.driver_id:
+        driver_index.set_busy(ride.driver_id, pool_planner.finish(ride.driver_id, ride_id))
+    ride_drivers.pop(ride_id, None)
+    location_store.forget_ride(ride_id)
+    live_hub.close_ride(ride_id)
+    trace_writer.submit(ride_id, ride.driver_id)
 
     return {
         "ride_id": ride.id,
@@ -381,23 +841,39 @@ def cancel_ride(data: dict = Body(...), db: Session = Depends(get_db)):
 # -----------------------
 # Driver Dashboard
 # -----------------------
-@app.post("/driver_dashboard")
-def driver_dashboard(data: dict = Body(...), db: Session = Depends(get_db)):
-    driver_id = data.get("driver_id")
+@app.post("/driver_dashboard", response_model=DriverDashboardPage)
+def driver_dashboard(data: DriverDashboardRequest,
+                     db: Session = Depends(session_dependency("driver_dashboard", read_only=True))):
+    driver_id = data.driver_id
+    cursor = data.cursor
+    limit = page_size(data.limit)
+
+    if not cursor:
+        cached = page_cache.get("driver", driver_id, limit)
+        if cached:
+            return cached
+
+    if ("driver", driver_id) in recent_writes:
+        use_primary(db)
 
     # Get active ride (if any)
-    active_ride = db.query(Ride).filter(
+    active_ride = db.query(Ride.id, Ride.status).filter(
         Ride.driver_id == driver_id,
-        Ride.status.in_([RideStatus.accepted, RideStatus.in_progress])
+        Ride.status.in_(ACTIVE_STATUSES)
     ).first()
 
-    # Get completed rides
-    completed_rides = db.query(Ride).filter(
+    # Get completed rides, newest first, one keyset page at a time
+    query = db.query(
+        Ride.id, Ride.pickup_address, Ride.dropoff_address, Ride.fare_estimate, Ride.completed_at
+    ).filter(
         Ride.driver_id == driver_id,
         Ride.status == RideStatus.completed
-    ).order_by(Ride.completed_at.desc()).all()
+    )
+    if cursor:
+        query = query.filter(tuple_(Ride.completed_at, Ride.id) < tuple_(*parse_cursor(cursor)))
+    rows = query.order_by(Ride.completed_at.desc(), Ride.id.desc()).limit(limit + 1).all()
 
-    return {
+    page = {
         "active_ride": {
             "ride_id": active_ride.id,
             "status": active_ride.status.value
@@ -409,22 +885,44 @@ def driver_dashboard(data: dict = Body(...), db: Session = Depends(get_db)):
                 "pickup": r.pickup_address,
                 "dropoff": r.dropoff_address,
                 "fare": r.fare_estimate
-            } for r in completed_rides
-        ]
+            } for r in rows[:limit]
+        ],
+        "next_cursor": encode_cursor(rows[limit - 1].completed_at, rows[limit - 1].id)
+        if len(rows) > limit else None
     }
 
+    if not cursor:
+        page_cache.put("driver", driver_id, limit, page)
+    return page
+
 # -----------------------
 # Rider History
 # -----------------------
-@app.post("/rider_history")
-def rider_history(data: dict = Body(...), db: Session = Depends(get_db)):
-    rider_id = data.get("rider_id")
-
-    rides = db.query(Ride).filter(
+@app.post("/rider_history", response_model=RiderHistoryPage)
+def rider_history(data: RiderHistoryRequest,
+                  db: Session = Depends(session_dependency("rider_history", read_only=True))):
+    rider_id = data.rider_id
+    cursor = data.cursor
+    limit = page_size(data.limit)
+
+    if not cursor:
+        cached = page_cache.get("rider", rider_id, limit)
+        if cached:
+            return cached
+
+    if ("rider", rider_id) in recent_writes:
+        use_primary(db)
+
+    query = db.query(
+        Ride.id, Ride.status, Ride.fare_estimate, Ride.pickup_address, Ride.dropoff_address, Ride.created_at
+    ).filter(
         Ride.rider_id == rider_id
-    ).order_by(Ride.created_at.desc()).all()
+    )
+    if cursor:
+        query = query.filter(tuple_(Ride.created_at, Ride.id) < tuple_(*parse_cursor(cursor)))
+    rows = query.order_by(Ride.created_at.desc(), Ride.id.desc()).limit(limit + 1).all()
 
-    return {
+    page = {
         "rides": [
             {
                 "ride_id": r.id,
@@ -433,108 +931,185 @@ def rider_history(data: dict = Body(...), db: Session = Depends(get_db)):
                 "pickup": r.pickup_address,
                 "dropoff": r.dropoff_address,
                 "created_at": r.created_at.isoformat()
-            } for r in rides
-        ]
+            } for r in rows[:limit]
+        ],
+        "next_cursor": encode_cursor(rows[limit - 1].created_at, rows[limit - 1].id)
+        if len(rows) > limit else None
     }
 
-# -----------------------
-# Driver GPS Initial Ping
-# -----------------------
-@app.post("/update_location")
-def update_location(data: dict = Body(...), db: Session = Depends(get_db)):
-    ride_id = data.get("ride_id")
-    driver_id = data.get("driver_id")
-    location = data.get("location")
-
-    if not location or "lat" not in location or "lng" not in location:
-        raise HTTPException(status_code=400, detail="Invalid location data")
-
-    # Optional: validate that driver is currently on this ride
-    ride = db.query(Ride).filter_by(id=ride_id, driver_id=driver_id).first()
-    if not ride:
-        raise HTTPException(status_code=404, detail="Ride not found or driver mismatch")
-
-    update = LocationUpdate(
-        id=str(uuid.uuid4()),
-        ride_id=ride_id,
-        driver_id=driver_id,
-        lat=location["lat"],
-        lng=location["lng"],
-        timestamp=datetime.now(UTC)
-    )
-
-    db.add(update)
-    db.commit()
-
-    return {
-        "message": "Location updated",
-        "ride_id": ride_id,
-        "driver_id": driver_id,
-        "timestamp": update.timestamp.isoformat()
-    }
+    if not cursor:
+        page_cache.put("rider", rider_id, limit, page)
+    return page
 
 # -----------------------
 # Get Driver Location Updates
 # -----------------------
-@app.get("/get_location")
-def get_location(ride_id: str, db: Session = Depends(get_db)):
+@app.get("/get_location", response_model=DriverLocation)
+def get_location(ride_id: str, db: Session = Depends(session_dependency("get_location", read_only=True))):
+    # Pings land in the hot store on ingest; the table is only read on a cold miss
+    hot = location_store.for_ride(ride_id)
+    if hot:
+        return hot
+
     latest = db.query(LocationUpdate).filter_by(ride_id=ride_id).order_by(
         LocationUpdate.timestamp.desc()).first()
 
     if not latest:
-        raise HTTPException(status_code=404, detail="No location found for this ride")
+        # Raw pings of old rides are gone; the last point of their trace remains
+        trace = db.query(RideTrace).filter_by(ride_id=ride_id).first()
+        points = decode_trace(trace) if trace else []
+        if not points:
+            raise HTTPException(status_code=404, detail="No location found for this ride")
+        timestamp, lat, lng = points[-1]
+        return {
+            "ride_id": ride_id,
+            "driver_id": trace.driver_id,
+            "lat": lat,
+            "lng": lng,
+            "timestamp": timestamp.isoformat()
+        }
+
+    timestamp = as_utc(latest.timestamp)
+    if ride_id in ride_drivers:
+        location_store.record(latest.ride_id, latest.driver_id, latest.lat, latest.lng, timestamp)
 
     return {
         "ride_id": latest.ride_id,
         "driver_id": latest.driver_id,
         "lat": latest.lat,
         "lng": latest.lng,
-        "timestamp": latest.timestamp.isoformat()
+        "timestamp": timestamp.isoformat()
     }
 
 # -----------------------
-# Admin Dashboard
+# Ride Trace (finished rides)
+# -----------------------
+@app.get("/ride_trace", response_model=RideTraceBody, response_model_exclude_unset=True)
+def ride_trace(ride_id: str, format: str = "points", tolerance_m: float = 0, db: Session = Depends(get_db)):
+    trace = db.query(RideTrace).filter_by(ride_id=ride_id).first()
+    if not trace:
+        raise HTTPException(status_code=404, detail="No trace for this ride yet")
+    if format not in ("points", "polyline"):
+        raise HTTPException(status_code=400, detail="format must be points or polyline")
+
+    points = simplify(decode_trace(trace), tolerance_m)
+    body = {
+        "ride_id": trace.ride_id,
+        "driver_id": trace.driver_id,
+        "started_at": as_utc(trace.started_at).isoformat() if trace.started_at else None,
+        "ended_at": as_utc(trace.ended_at).isoformat() if trace.ended_at else None,
+        "points": len(points)
+    }
+    if format == "polyline":
+        body["polyline"] = encode_polyline(points)
+    else:
+        body["path"] = [
+            {"lat": lat, "lng": lng, "timestamp": timestamp.isoformat()} for timestamp, lat, lng in points
+        ]
+    return body
+
 # -----------------------
-@app.get("/admin_dashboard")
-def admin_dashboard(db: Session = Depends(get_db)):
-    from sqlalchemy import func
+# Live Location Streaming
+# -----------------------
+def ride_stream_state(ride_id):
+    # "live", "finished" or None for an unknown ride. Checked after subscribing,
+    # so a ride that finishes in between still reaches the stream through close_ride
+    if ride_id in ride_drivers:
+        return "live"
+    db = SessionLocal()
+    try:
+        status = db.query(Ride.status).filter_by(id=ride_id).scalar()
+    finally:
+        db.close()
+    if status is None:
+        return None
+    return "finished" if status in FINISHED_STATUSES else "live"
+
+@app.websocket("/ws/location/{ride_id}")
+async def stream_location_ws(websocket: WebSocket, ride_id: str):
+    await websocket.accept()
+    sub = live_hub.subscribe(ride_id)
+    try:
+        state = await run_in_threadpool(ride_stream_state, ride_id)
+        if state is None:
+            await websocket.close(code=4404, reason="Ride not found")
+            return
+        if state == "finished":
+            await websocket.send_json({"type": "closed", "ride_id": ride_id})
+            await websocket.close()
+            return
+
+        latest = location_store.for_ride(ride_id)
+        if latest:
+            await websocket.send_text(orjson.dumps({"type": "location", **latest}).decode())
+
+        async for message in live_hub.events(sub):
+            if message is HEARTBEAT:
+                await websocket.send_json({"type": "heartbeat"})
+            else:
+                await websocket.send_text(orjson.dumps({"type": "location", **message}).decode())
+
+        await websocket.send_json({"type": "closed", "ride_id": ride_id})
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        live_hub.unsubscribe(sub)
 
-    total_rides = db.query(func.count(Ride.id)).scalar()
-    completed_rides = db.query(func.count(Ride.id)).filter(Ride.status == RideStatus.completed).scalar()
-    cancelled_rides = db.query(func.count(Ride.id)).filter(Ride.status == RideStatus.cancelled).scalar()
-    in_progress_rides = db.query(func.count(Ride.id)).filter(Ride.status == RideStatus.in_progress).scalar()
+@app.get("/stream/location/{ride_id}")
+async def stream_location_sse(ride_id: str):
+    sub = live_hub.subscribe(ride_id)
+    try:
+        state = await run_in_threadpool(ride_stream_state, ride_id)
+    except Exception:
+        live_hub.unsubscribe(sub)
+        raise
+    if state is None:
+        live_hub.unsubscribe(sub)
+        raise HTTPException(status_code=404, detail="Ride not found")
+
+    async def event_stream():
+        try:
+            if state == "finished":
+                yield f"event: closed\ndata: {orjson.dumps({'ride_id': ride_id}).decode()}\n\n"
+                return
 
-    total_drivers = db.query(func.count(User.id)).filter(User.role == "driver").scalar()
-    total_riders = db.query(func.count(User.id)).filter(User.role == "rider").scalar()
+            latest = location_store.for_ride(ride_id)
+            if latest:
+                yield f"event: location\ndata: {orjson.dumps(latest).decode()}\n\n"
 
-    # Drivers currently assigned to accepted/in_progress rides
-    active_driver_ids = db.query(Ride.driver_id).filter(
-        Ride.status.in_([RideStatus.accepted, RideStatus.in_progress])
-    ).distinct().all()
-    active_driver_ids = [d[0] for d in active_driver_ids if d[0]]
+            async for message in live_hub.events(sub):
+                if message is HEARTBEAT:
+                    yield ": heartbeat\n\n"
+                else:
+                    yield f"event: location\ndata: {orjson.dumps(message).decode()}\n\n"
 
-    idle_drivers = db.query(User).filter(
-        User.role == "driver",
-        ~User.id.in_(active_driver_ids)
-    ).count()
+            yield f"event: closed\ndata: {orjson.dumps({'ride_id': ride_id}).decode()}\n\n"
+        finally:
+            live_hub.unsubscribe(sub)
 
-    return {
-        "total_rides": total_rides,
-        "completed_rides": completed_rides,
-        "cancelled_rides": cancelled_rides,
-        "in_progress_rides": in_progress_rides,
-        "total_drivers": total_drivers,
-        "active_drivers": len(active_driver_ids),
-        "idle_drivers": idle_drivers,
-        "total_riders": total_riders
-    }
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+# -----------------------
+# Admin Dashboard
+# -----------------------
+@app.get("/admin_dashboard", response_model=DashboardSummary)
+def admin_dashboard(exact: bool = False,
+                    db: Session = Depends(session_dependency("admin_dashboard", read_only=True))):
+    # Maintained counters answer in O(1); exact=true recounts with GROUP BY
+    if not exact:
+        return dashboard.snapshot()
+
+    rides, roles, active = count_exact(db)
+    return summarize(rides, roles, active)
 
 # -----------------------
 # Onboard Driver
 # -----------------------
-@app.post("/onboard_driver")
-def onboard_driver(data: dict = Body(...), db: Session = Depends(get_db)):
-    user_id = data.get("user_id")
+@app.post("/onboard_driver", response_model=Message)
+def onboard_driver(data: DriverOnboarding, db: Session = Depends(get_db)):
+    user_id = data.user_id
     user = db.query(User).filter_by(id=user_id, role="driver").first()
 
     if not user:
@@ -547,14 +1122,14 @@ def onboard_driver(data: dict = Body(...), db: Session = Depends(get_db)):
 
     profile = DriverProfile(
         user_id=user_id,
-        name=data.get("name"),
-        license_number=data.get("license_number"),
-        license_expiry=datetime.strptime(data.get("license_expiry"), "%Y-%m-%d").date(),
-        vehicle_type=data.get("vehicle_type"),
-        vehicle_plate=data.get("vehicle_plate"),
-        capacity=data.get("capacity", 4),
+        name=data.name,
+        license_number=data.license_number,
+        license_expiry=data.license_expiry,
+        vehicle_type=data.vehicle_type,
+        vehicle_plate=data.vehicle_plate,
+        capacity=data.capacity,
         current_load=0,
-        max_detour_minutes=data.get("max_detour_minutes", 10)
+        max_detour_minutes=data.max_detour_minutes
     )
     db.add(profile)
     db.commit()
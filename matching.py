@@ -0,0 +1,100 @@
+from collections import Counter
+from sqlalchemy import update
+from models import ACTIVE_STATUSES, Ride, RideStatus, DriverProfile
+
+# -----------------------
+# Candidate Scoring
+# -----------------------
+async def score_candidates(provider, candidates, pickup):
+    """Route every candidate driver to the pickup in one batched provider call.
+
+    candidates are DriverProfile-like objects (user_id, lat, lng,
+    max_detour_minutes). Returns (driver_id, detour_duration_s) pairs within
+    each driver's detour limit, lowest detour first.
+    """
+    origins = [(d.lat, d.lng) for d in candidates]
+    durations = await provider.travel_times(origins, pickup)
+
+    detour_candidates = []
+    for driver, detour_duration_s in zip(candidates, durations):
+        if detour_duration_s is None:
+            continue
+
+        # ⛔ Skip if detour exceeds driver's threshold
+        if detour_duration_s / 60.0 > driver.max_detour_minutes:
+            continue
+
+        detour_candidates.append((driver.user_id, detour_duration_s))
+
+    detour_candidates.sort(key=lambda x: x[1])
+    return detour_candidates
+
+# -----------------------
+# Atomic Claims
+# -----------------------
+def claim_driver(db, driver_id):
+    """Claim an idle driver inside the caller's transaction and take a seat.
+
+    On Postgres the profile row is locked with SKIP LOCKED, so a driver being
+    claimed by another request is passed over instead of waited on. The
+    version compare-and-set makes the claim safe on backends without row
+    locks too. Returns False if the driver is taken or already busy.
+    """
+    profile = db.query(DriverProfile.id, DriverProfile.version).filter(
+        DriverProfile.user_id == driver_id
+    ).with_for_update(skip_locked=True).first()
+    if not profile:
+        return False
+
+    # Checked after reading the version: a claim committed in between either
+    # shows up here or fails the compare-and-set below
+    busy = db.query(Ride.id).filter(
+        Ride.driver_id == driver_id,
+        Ride.status.in_(ACTIVE_STATUSES)
+    ).first()
+    if busy:
+        return False
+
+    return db.execute(
+        update(DriverProfile)
+        .where(DriverProfile.id == profile.id, DriverProfile.version == profile.version)
+        .values(version=profile.version + 1, current_load=DriverProfile.current_load + 1)
+        .execution_options(synchronize_session=False)
+    ).rowcount == 1
+
+
+def claim_seat(db, driver_id, expected_version):
+    """Take a seat in an en-route driver's car. expected_version is the one the
+    insertion was planned against, so a plan changed since then is rejected."""
+    return db.execute(
+        update(DriverProfile)
+        .where(
+            DriverProfile.user_id == driver_id,
+            DriverProfile.version == expected_version,
+            DriverProfile.current_load < DriverProfile.capacity
+        )
+        .values(version=expected_version + 1, current_load=DriverProfile.current_load + 1)
+        .execution_options(synchronize_session=False)
+    ).rowcount == 1
+
+
+def release_seats(db, driver_ids):
+    """Give back one seat per occurrence of a driver id."""
+    for driver_id, seats in Counter(d for d in driver_ids if d).items():
+        db.execute(
+            update(DriverProfile)
+            .where(DriverProfile.user_id == driver_id, DriverProfile.current_load >= seats)
+            .values(current_load=DriverProfile.current_load - seats)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def claim_ride(db, ride_id, driver_id, accepted_at):
+    """Move a still-requested ride to accepted. Returns False if another
+    request matched it first."""
+    return db.execute(
+        update(Ride)
+        .where(Ride.id == ride_id, Ride.status == RideStatus.requested)
+        .values(driver_id=driver_id, status=RideStatus.accepted, accepted_at=accepted_at)
+        .execution_options(synchronize_session=False)
+    ).rowcount == 1
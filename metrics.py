@@ -0,0 +1,284 @@
+import contextvars
+import os
+import re
+import sys
+import threading
+import time
+from collections import defaultdict, deque, Counter as Tally
+from dotenv import load_dotenv
+from sqlalchemy import event
+
+load_dotenv()
+# Opt-in: requests slower than this dump a collapsed-stack profile (0 = off)
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+# -----------------------
+# Prometheus Registry
+# -----------------------
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (extra or [])
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] += amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield f"{self.name}{_labels(self.labelnames, labels)} {value}"
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+        for labels, series in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, [('le', bound)])} {cumulative}"
+            yield f"{self.name}_bucket{_labels(self.labelnames, labels, [('le', '+Inf')])} {series[-1]}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {series[-2]}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {series[-1]}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, fn):
+        """fn() returns (name, type, help, [(labels dict, value), ...]) tuples,
+        read at scrape time for state that other components already keep."""
+        self._collectors.append(fn)
+        return fn
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        for fn in self._collectors:
+            for name, kind, help, samples in fn():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(list(labels), list(labels.values()))} {value}")
+        return "\n".join(lines) + "\n"
+
+
+# -----------------------
+# App Metrics
+# -----------------------
+class RequestStats:
+    __slots__ = ("queries", "db_s")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_s = 0.0
+
+
+# Set per HTTP request; run_in_threadpool copies the context, so queries run
+# off the event loop are still charged to the request that issued them
+_request_stats = contextvars.ContextVar("request_stats", default=None)
+
+
+class AppMetrics:
+    def __init__(self, registry=None):
+        self.registry = registry or Registry()
+        r = self.registry
+        self.request_seconds = r.histogram(
+            "http_request_duration_seconds", "Request latency by route", ("method", "route"))
+        self.requests = r.counter(
+            "http_requests_total", "Requests by route and status", ("method", "route", "status"))
+        self.request_queries = r.histogram(
+            "http_request_db_queries", "SQL statements per request", ("route",), QUERY_COUNT_BUCKETS)
+        self.request_db_seconds = r.histogram(
+            "http_request_db_seconds", "Time spent in SQL per request", ("route",))
+        self.query_seconds = r.histogram(
+            "db_query_duration_seconds", "Latency of individual SQL statements")
+        self.routing_seconds = r.histogram(
+            "routing_call_duration_seconds", "Outbound routing provider calls", ("provider", "call"))
+        self.routing_errors = r.counter(
+            "routing_call_errors_total", "Routing provider calls that raised", ("provider", "call"))
+
+    def observe_routing(self, provider, call, seconds, ok=True):
+        self.routing_seconds.observe(seconds, provider, call)
+        if not ok:
+            self.routing_errors.inc(provider, call)
+
+    def instrument_engine(self, engine):
+        # Start times are stacked per connection, as in the SQLAlchemy profiling recipe
+        @event.listens_for(engine, "before_cursor_execute")
+        def before(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def after(conn, cursor, statement, parameters, context, executemany):
+            elapsed = time.perf_counter() - conn.info["query_start"].pop()
+            self.query_seconds.observe(elapsed)
+            stats = _request_stats.get()
+            if stats is not None:
+                stats.queries += 1
+                stats.db_s += elapsed
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency, status and SQL load per route
+    template (so /stream/location/{ride_id} is one series, not one per ride)."""
+
+    def __init__(self, app, metrics, profiler=None, slow_ms=PROFILE_SLOW_MS):
+        self.app = app
+        self.metrics = metrics
+        self.profiler = profiler
+        self.slow_ms = slow_ms
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        status = 500
+        wall_started = time.time()
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _request_stats.reset(token)
+            elapsed = time.perf_counter() - started
+            route = getattr(scope.get("route"), "path", "unmatched")
+            m = self.metrics
+            m.request_seconds.observe(elapsed, scope["method"], route)
+            m.requests.inc(scope["method"], route, status)
+            m.request_queries.observe(stats.queries, route)
+            m.request_db_seconds.observe(stats.db_s, route)
+            if self.profiler and elapsed * 1000 >= self.slow_ms:
+                self.profiler.dump(wall_started, time.time(), f"{scope['method']} {route}")
+
+
+# -----------------------
+# Sampling Profiler
+# -----------------------
+# Threads parked here are idle, not slow; their samples would swamp the profile
+IDLE_FRAMES = {("threading.py", "wait"), ("selectors.py", "select")}
+
+
+def _collapse(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+class SamplingProfiler:
+    """Samples every thread's stack on a fixed interval into a bounded ring.
+
+    dump() writes the samples taken during one slow request as collapsed
+    stacks ("frame;frame;frame count"), which flamegraph.pl and speedscope
+    read directly. Concurrent requests share the window, so their frames can
+    appear in each other's profiles.
+    """
+
+    def __init__(self, interval_s=PROFILE_INTERVAL_MS / 1000, out_dir=PROFILE_DIR, max_samples=100000):
+        self.interval_s = interval_s
+        self.out_dir = out_dir
+        self._samples = deque(maxlen=max_samples)  # (time, thread name, collapsed stack)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        os.makedirs(self.out_dir, exist_ok=True)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval_s):
+            now = time.time()
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own or (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in IDLE_FRAMES:
+                    continue
+                self._samples.append((now, names.get(ident, str(ident)), _collapse(frame)))
+
+    def dump(self, started, ended, label):
+        folded = Tally(f"{thread};{stack}" for t, thread, stack in list(self._samples) if started <= t <= ended)
+        if not folded:
+            return None
+        name = re.sub(r"[^A-Za-z0-9_.-]+", "_", label).strip("_")
+        path = os.path.join(self.out_dir, f"{int(started * 1000)}-{name}.folded")
+        with open(path, "w") as f:
+            for stack, count in folded.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
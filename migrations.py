@@ -0,0 +1,130 @@
+from datetime import datetime, UTC
+from sqlalchemy import text, inspect, Integer
+from models import Base, LocationUpdate, RideTrace
+from location_history import utc_naive, is_partitioned, create_partitioned_table, ensure_partitions
+
+# -----------------------
+# Helpers
+# -----------------------
+def has_table(conn, table):
+    return inspect(conn).has_table(table)
+
+def has_column(conn, table, column):
+    return any(c["name"] == column for c in inspect(conn).get_columns(table))
+
+# -----------------------
+# Migrations
+# -----------------------
+# Each migration runs in its own transaction and must be safe on a database
+# that create_all() already built from the current models.
+
+def m0001_baseline(conn):
+    Base.metadata.create_all(bind=conn)
+
+def m0002_hot_path_indexes(conn):
+    statements = [
+        # Matching / admin: only requested + active rides are ever filtered by status
+        "CREATE INDEX IF NOT EXISTS ix_rides_active ON rides (status, driver_id) "
+        "WHERE status IN ('requested', 'accepted', 'in_progress')",
+        "CREATE INDEX IF NOT EXISTS ix_rides_driver_status ON rides (driver_id, status)",
+        "CREATE INDEX IF NOT EXISTS ix_rides_rider_created ON rides (rider_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_location_updates_ride_ts ON location_updates (ride_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS ix_detour_scores_ride_driver ON detour_scores (ride_id, driver_id)",
+        "CREATE INDEX IF NOT EXISTS ix_users_role ON users (role)",
+    ]
+    for statement in statements:
+        conn.execute(text(statement))
+
+def m0003_keyset_history_indexes(conn):
+    # Wider indexes serve the keyset ORDER BY ... id tiebreak; the old ones are prefixes
+    statements = [
+        "CREATE INDEX IF NOT EXISTS ix_rides_driver_status_completed "
+        "ON rides (driver_id, status, completed_at, id)",
+        "CREATE INDEX IF NOT EXISTS ix_rides_rider_created_id ON rides (rider_id, created_at, id)",
+        "DROP INDEX IF EXISTS ix_rides_driver_status",
+        "DROP INDEX IF EXISTS ix_rides_rider_created",
+    ]
+    for statement in statements:
+        conn.execute(text(statement))
+
+def m0004_driver_claim_version(conn):
+    if not has_column(conn, "driver_profiles", "version"):
+        conn.execute(text("ALTER TABLE driver_profiles ADD COLUMN version INTEGER NOT NULL DEFAULT 0"))
+
+def m0005_backfill_current_load(conn):
+    # current_load is now maintained per assignment; start it from the live rides
+    conn.execute(text(
+        "UPDATE driver_profiles SET current_load = ("
+        "SELECT COUNT(*) FROM rides WHERE rides.driver_id = driver_profiles.user_id "
+        "AND rides.status IN ('accepted', 'in_progress'))"
+    ))
+
+def m0006_partition_location_updates(conn):
+    # Integer ids instead of UUID strings and, on Postgres, range partitions on
+    # timestamp so retention is a partition drop (location_history.py)
+    postgres = conn.dialect.name == "postgresql"
+    if postgres and is_partitioned(conn):
+        return
+    id_type = next(c["type"] for c in inspect(conn).get_columns("location_updates") if c["name"] == "id")
+    if not postgres and isinstance(id_type, Integer):
+        return
+
+    conn.execute(text("DROP INDEX IF EXISTS ix_location_updates_ride_ts"))
+    if postgres:
+        conn.execute(text("ALTER INDEX IF EXISTS location_updates_pkey RENAME TO location_updates_legacy_pkey"))
+    conn.execute(text("ALTER TABLE location_updates RENAME TO location_updates_legacy"))
+
+    if postgres:
+        first, last = conn.execute(text("SELECT MIN(timestamp), MAX(timestamp) FROM location_updates_legacy")).one()
+        now = utc_naive(datetime.now(UTC))
+        create_partitioned_table(conn)
+        ensure_partitions(conn, first or now, max(last or now, now))
+    else:
+        LocationUpdate.__table__.create(bind=conn)
+
+    conn.execute(text(
+        "INSERT INTO location_updates (ride_id, driver_id, lat, lng, timestamp) "
+        "SELECT ride_id, driver_id, lat, lng, timestamp FROM location_updates_legacy "
+        "WHERE timestamp IS NOT NULL ORDER BY timestamp"
+    ))
+    conn.execute(text("DROP TABLE location_updates_legacy"))
+
+def m0007_ride_traces(conn):
+    RideTrace.__table__.create(bind=conn, checkfirst=True)
+
+MIGRATIONS = [
+    ("0001", "baseline schema", m0001_baseline),
+    ("0002", "hot path indexes", m0002_hot_path_indexes),
+    ("0003", "keyset history indexes", m0003_keyset_history_indexes),
+    ("0004", "driver claim version", m0004_driver_claim_version),
+    ("0005", "backfill current_load", m0005_backfill_current_load),
+    ("0006", "partition location_updates", m0006_partition_location_updates),
+    ("0007", "ride traces", m0007_ride_traces),
+]
+
+# -----------------------
+# Runner
+# -----------------------
+def applied_versions(engine):
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version VARCHAR(16) PRIMARY KEY, name VARCHAR(255), applied_at TIMESTAMP)"
+        ))
+        return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+def migrate(engine):
+    """Apply pending migrations in order. Returns the versions applied."""
+    done = applied_versions(engine)
+    applied = []
+    for version, name, fn in MIGRATIONS:
+        if version in done:
+            continue
+        with engine.begin() as conn:
+            fn(conn)
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:v, :n, :t)"),
+                {"v": version, "n": name, "t": datetime.now(UTC)}
+            )
+        applied.append(version)
+    return applied
@@ -1,12 +1,16 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Enum, ForeignKey, Date
+from sqlalchemy import Column, Integer, BigInteger, String, Float, DateTime, Enum, ForeignKey, Date, Index, LargeBinary, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from uuid import uuid4
 import enum
-from datetime import datetime
+from datetime import datetime, UTC
 
 Base = declarative_base()
 
+def as_utc(dt):
+    # Timestamp columns come back naive; they are always written in UTC
+    return dt.replace(tzinfo=UTC) if dt.tzinfo is None else dt.astimezone(UTC)
+
 # -----------------------
 # ENUMS
 # -----------------------
@@ -17,11 +21,18 @@ class RideStatus(enum.Enum):
     completed = "completed"
     cancelled = "cancelled"
 
+# A driver holding a ride in ACTIVE_STATUSES is busy
+ACTIVE_STATUSES = [RideStatus.accepted, RideStatus.in_progress]
+FINISHED_STATUSES = [RideStatus.completed, RideStatus.cancelled]
+
 # -----------------------
 # USER TABLE
 # -----------------------
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        Index("ix_users_role", "role"),
+    )
 
     id = Column(String, primary_key=True)
     name = Column(String)
@@ -32,8 +43,17 @@ class User(Base):
 # -----------------------
 # RIDE TABLE
 # -----------------------
+ACTIVE_RIDE_PREDICATE = text("status IN ('requested', 'accepted', 'in_progress')")
+
 class Ride(Base):
     __tablename__ = "rides"
+    __table_args__ = (
+        Index("ix_rides_active", "status", "driver_id",
+              postgresql_where=ACTIVE_RIDE_PREDICATE, sqlite_where=ACTIVE_RIDE_PREDICATE),
+        # Keyset pages: driver_dashboard on (completed_at, id), rider_history on (created_at, id)
+        Index("ix_rides_driver_status_completed", "driver_id", "status", "completed_at", "id"),
+        Index("ix_rides_rider_created_id", "rider_id", "created_at", "id"),
+    )
 
     id = Column(String, primary_key=True)
     rider_id = Column(String, ForeignKey("users.id"))
@@ -62,14 +82,35 @@ class Ride(Base):
 # LOCATION UPDATES
 # -----------------------
 class LocationUpdate(Base):
+    # On Postgres this is range-partitioned by timestamp (migration 0006,
+    # location_history.py) with PRIMARY KEY (id, timestamp)
     __tablename__ = "location_updates"
+    __table_args__ = (
+        Index("ix_location_updates_ride_ts", "ride_id", "timestamp"),
+    )
 
-    id = Column(String, primary_key=True, default=lambda: str(uuid4()))
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
     ride_id = Column(String, ForeignKey("rides.id"))
     driver_id = Column(String, ForeignKey("users.id"))
     lat = Column(Float)
     lng = Column(Float)
-    timestamp = Column(DateTime)
+    timestamp = Column(DateTime, nullable=False)
+
+# -----------------------
+# RIDE TRACE
+# -----------------------
+class RideTrace(Base):
+    # Compact GPS trace of a finished ride; outlives the raw location_updates rows
+    __tablename__ = "ride_traces"
+
+    ride_id = Column(String, ForeignKey("rides.id"), primary_key=True)
+    driver_id = Column(String, ForeignKey("users.id"))
+    started_at = Column(DateTime)
+    ended_at = Column(DateTime)
+    points = Column(Integer)
+    encoding = Column(String)
+    data = Column(LargeBinary)
+    created_at = Column(DateTime)
 
 # -----------------------
 # DRIVER PROFILE
@@ -89,6 +130,8 @@ class DriverProfile(Base):
     capacity = Column(Integer, default=4)
     current_load = Column(Integer, default=0)
     max_detour_minutes = Column(Integer, default=10)
+    # Bumped by every assignment claim; a stale version means another request won the driver
+    version = Column(Integer, nullable=False, default=0, server_default="0")
 
     # NEW GPS FIELDS FOR SMART MATCHING
     lat = Column(Float, nullable=True)
@@ -101,6 +144,9 @@ class DriverProfile(Base):
 # -----------------------
 class DetourScoreLog(Base):
     __tablename__ = "detour_scores"
+    __table_args__ = (
+        Index("ix_detour_scores_ride_driver", "ride_id", "driver_id"),
+    )
 
     id = Column(String, primary_key=True, default=lambda: str(uuid4()))
     ride_id = Column(String, ForeignKey("rides.id"))
@@ -0,0 +1,163 @@
+import asyncio
+import os
+import threading
+from collections import namedtuple
+from dotenv import load_dotenv
+from models import ACTIVE_STATUSES, Ride, RideStatus
+
+load_dotenv()
+POOLING_ENABLED = os.getenv("POOLING_ENABLED", "0") == "1"
+# Extra in-vehicle time any pooled rider may be given over their current plan
+POOL_RIDER_DETOUR_MINUTES = float(os.getenv("POOL_RIDER_DETOUR_MINUTES", "10"))
+
+
+Stop = namedtuple("Stop", "ride_id kind lat lng")
+# cost is the vehicle time added beyond the new rider's own trip, comparable
+# with an idle driver's time-to-pickup; pickup_at / dropoff_at index the plan
+Insertion = namedtuple("Insertion", "driver_id cost added_s pickup_eta_s pickup_at dropoff_at version")
+
+
+# -----------------------
+# Stop Sequence Planner
+# -----------------------
+class PoolPlanner:
+    """Pending stops per en-route driver, in the order they will be served.
+
+    Per-process like the driver index; load() rebuilds it from active rides.
+    """
+
+    def __init__(self):
+        self._plans = {}  # driver_id -> [Stop, ...]
+        self._lock = threading.Lock()
+
+    def is_en_route(self, driver_id):
+        return bool(self._plans.get(driver_id))
+
+    def plan(self, driver_id):
+        with self._lock:
+            return list(self._plans.get(driver_id, ()))
+
+    def assign(self, driver_id, ride, pickup_at=None, dropoff_at=None):
+        """Append the ride's stops, or splice them in at an Insertion's positions."""
+        pickup = Stop(ride.id, "pickup", ride.pickup_lat, ride.pickup_lng)
+        dropoff = Stop(ride.id, "dropoff", ride.dropoff_lat, ride.dropoff_lng)
+        with self._lock:
+            plan = self._plans.setdefault(driver_id, [])
+            if pickup_at is None:
+                plan.extend([pickup, dropoff])
+            else:
+                plan.insert(dropoff_at, dropoff)
+                plan.insert(pickup_at, pickup)
+
+    def picked_up(self, driver_id, ride_id):
+        with self._lock:
+            plan = self._plans.get(driver_id, [])
+            plan[:] = [s for s in plan if not (s.ride_id == ride_id and s.kind == "pickup")]
+
+    def finish(self, driver_id, ride_id):
+        """Drop the ride's remaining stops; returns True if the driver still has others."""
+        with self._lock:
+            plan = [s for s in self._plans.get(driver_id, []) if s.ride_id != ride_id]
+            if plan:
+                self._plans[driver_id] = plan
+            else:
+                self._plans.pop(driver_id, None)
+            return bool(plan)
+
+    def load(self, db):
+        rides = db.query(Ride).filter(
+            Ride.status.in_(ACTIVE_STATUSES),
+            Ride.driver_id.isnot(None)
+        ).order_by(Ride.accepted_at).all()
+        plans = {}
+        for ride in rides:
+            plan = plans.setdefault(ride.driver_id, [])
+            if ride.status == RideStatus.accepted:
+                plan.append(Stop(ride.id, "pickup", ride.pickup_lat, ride.pickup_lng))
+            plan.append(Stop(ride.id, "dropoff", ride.dropoff_lat, ride.dropoff_lng))
+        with self._lock:
+            self._plans = plans
+
+
+# -----------------------
+# Insertion Search
+# -----------------------
+async def best_insertion(provider, driver, start, plan, ride, rider_limit_s=POOL_RIDER_DETOUR_MINUTES * 60):
+    """Cheapest feasible (pickup, dropoff) insertion of ride into driver's plan.
+
+    driver is a DriverProfile-like object (user_id, capacity,
+    max_detour_minutes, version); start is its current (lat, lng). Only the
+    legs an insertion can create are routed, O(n) provider calls in total,
+    so repeated searches are served from the route cache. Returns an
+    Insertion or None.
+    """
+    pickup = (ride.pickup_lat, ride.pickup_lng)
+    dropoff = (ride.dropoff_lat, ride.dropoff_lng)
+    nodes = [start] + [(s.lat, s.lng) for s in plan]  # 0 is the driver, k is plan[k - 1]
+    n = len(plan)
+
+    to_pickup, to_dropoff, *into_stop = await asyncio.gather(
+        provider.travel_times(nodes, pickup),
+        provider.travel_times(nodes + [pickup], dropoff),
+        *(provider.travel_times([nodes[k - 1], pickup, dropoff], nodes[k]) for k in range(1, n + 1))
+    )
+    direct_s = to_dropoff[n + 1]
+    if direct_s is None or any(t is None for t in to_pickup + to_dropoff[:n + 1]) \
+            or any(t is None for legs in into_stop for t in legs):
+        return None
+
+    # Arrival time at each stop under the current plan
+    old_arrival = [0.0] * (n + 1)
+    for k in range(1, n + 1):
+        old_arrival[k] = old_arrival[k - 1] + into_stop[k - 1][0]
+    onboard = sum(1 for s in plan if s.kind == "dropoff") - sum(1 for s in plan if s.kind == "pickup")
+    driver_limit_s = driver.max_detour_minutes * 60
+
+    def leg(a, b):
+        if b == "P":
+            return to_pickup[a]
+        if b == "D":
+            return direct_s if a == "P" else to_dropoff[a]
+        if a == "P":
+            return into_stop[b - 1][1]
+        if a == "D":
+            return into_stop[b - 1][2]
+        return into_stop[b - 1][0]
+
+    best = None
+    for i in range(n + 1):
+        for j in range(i, n + 1):
+            sequence = list(range(1, i + 1)) + ["P"] + list(range(i + 1, j + 1)) + ["D"] + list(range(j + 1, n + 1))
+            arrival, prev, clock, load, feasible = {}, 0, 0.0, onboard, True
+            for node in sequence:
+                clock += leg(prev, node)
+                arrival[node] = clock
+                prev = node
+                kind = "pickup" if node == "P" else "dropoff" if node == "D" else plan[node - 1].kind
+                load += 1 if kind == "pickup" else -1
+                if load > driver.capacity:
+                    feasible = False
+                    break
+                # Riders already on the plan keep their dropoff within the limit
+                if kind == "dropoff" and node != "D" and clock - old_arrival[node] > rider_limit_s:
+                    feasible = False
+                    break
+            if not feasible or arrival["D"] - arrival["P"] - direct_s > rider_limit_s:
+                continue
+
+            added_s = clock - old_arrival[n]
+            if added_s > driver_limit_s:
+                continue
+            # An insertion that rides along the existing route costs nothing extra
+            cost = max(added_s - direct_s, 0)
+            if best is None or (cost, added_s) < (best.cost, best.added_s):
+                best = Insertion(driver.user_id, round(cost), round(added_s), round(arrival["P"]), i, j, driver.version)
+    return best
+
+
+async def score_insertions(provider, candidates, starts, plans, ride):
+    """best_insertion for every candidate concurrently, cheapest first."""
+    insertions = await asyncio.gather(*(
+        best_insertion(provider, d, starts[d.user_id], plans[d.user_id], ride) for d in candidates
+    ))
+    return sorted((x for x in insertions if x), key=lambda x: x.cost)
@@ -0,0 +1,141 @@
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+from spatial_index import METERS_PER_DEG_LAT
+
+load_dotenv()
+ROUTE_CACHE_GRID_M = float(os.getenv("ROUTE_CACHE_GRID_M", "50"))
+ROUTE_CACHE_TTL_S = float(os.getenv("ROUTE_CACHE_TTL_S", "900"))
+ROUTE_CACHE_MAX_ENTRIES = int(os.getenv("ROUTE_CACHE_MAX_ENTRIES", "10000"))
+ROUTE_CACHE_DB = os.getenv("ROUTE_CACHE_DB")  # optional SQLite file for the second tier
+
+
+# -----------------------
+# Persistent Tier (SQLite)
+# -----------------------
+class SQLiteRouteStore:
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS route_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+
+    def get(self, key, now):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM route_cache WHERE key = ?", (key,)
+            ).fetchone()
+        if not row or row[1] < now:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def put(self, key, value, expires_at):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO route_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), expires_at)
+            )
+            self._conn.commit()
+
+    def purge_expired(self, now):
+        with self._lock:
+            self._conn.execute("DELETE FROM route_cache WHERE expires_at < ?", (now,))
+            self._conn.commit()
+
+
+# -----------------------
+# Route / ETA Cache
+# -----------------------
+class RouteCache:
+    """Two-tier cache keyed on origin/destination snapped to a grid_m grid.
+    The memory tier is LRU-bounded; both tiers expire entries after ttl_s."""
+
+    def __init__(self, grid_m=ROUTE_CACHE_GRID_M, ttl_s=ROUTE_CACHE_TTL_S,
+                 max_entries=ROUTE_CACHE_MAX_ENTRIES, store=None, clock=time.time):
+        self.step_deg = grid_m / METERS_PER_DEG_LAT
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.store = store
+        self.clock = clock
+        self._entries = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _snap(self, point):
+        # Longitude degrees shrink with latitude, so the east-west step is
+        # widened by 1/cos(lat) of the snapped row to keep cells grid_m wide
+        i = round(point[0] / self.step_deg)
+        lng_step = self.step_deg / max(math.cos(math.radians(i * self.step_deg)), 0.01)
+        return f"{i}:{round(point[1] / lng_step)}"
+
+    def key(self, kind, origin, destination):
+        return f"{kind}|{self._snap(origin)}|{self._snap(destination)}"
+
+    def get(self, kind, origin, destination):
+        key = self.key(kind, origin, destination)
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] >= now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry:
+                del self._entries[key]
+
+        if self.store is not None:
+            stored = self.store.get(key, now)
+            if stored is not None:
+                with self._lock:
+                    self.store_hits += 1
+                    self._remember(key, stored[0], stored[1])
+                return stored[0]
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, kind, origin, destination, value):
+        key = self.key(kind, origin, destination)
+        expires_at = self.clock() + self.ttl_s
+        with self._lock:
+            self._remember(key, value, expires_at)
+        if self.store is not None:
+            self.store.put(key, value, expires_at)
+
+    def _remember(self, key, value, expires_at):
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.store_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "store_hits": self.store_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round((self.hits + self.store_hits) / lookups, 4) if lookups else 0.0
+        }
+
+
+route_cache = RouteCache(store=SQLiteRouteStore(ROUTE_CACHE_DB) if ROUTE_CACHE_DB else None)
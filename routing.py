@@ -0,0 +1,231 @@
+import asyncio
+import os
+import time
+from dotenv import load_dotenv
+from http_client import get_json
+from spatial_index import haversine_m
+from route_cache import route_cache
+
+load_dotenv()
+GOOGLE_KEY = os.getenv("GOOGLE_MAPS_API_KEY")
+ROUTE_CACHE_ENABLED = os.getenv("ROUTE_CACHE_ENABLED", "1") == "1"
+
+# Local engine: CSV edge list or .osm extract; unset = synthetic campus grid
+ROAD_GRAPH_PATH = os.getenv("ROAD_GRAPH_PATH")
+ROAD_GRAPH_LANDMARKS = int(os.getenv("ROAD_GRAPH_LANDMARKS", "8"))
+CAMPUS_CENTER = (30.6127, -96.3414)  # Memorial Student Center
+
+DIRECTIONS_URL = "https://maps.googleapis.com/maps/api/directions/json"
+DISTANCE_MATRIX_URL = "https://maps.googleapis.com/maps/api/distancematrix/json"
+
+
+class RouteNotFound(Exception):
+    pass
+
+
+# -----------------------
+# Provider Interface
+# -----------------------
+class RoutingProvider:
+    """Points are (lat, lng) tuples. route() returns distance (m), duration (s)
+    and a summary; travel_times() returns one duration per origin, or None
+    where the provider had no route."""
+
+    name = "base"
+    max_origins_per_call = 25
+
+    async def route(self, origin, destination):
+        raise NotImplementedError
+
+    async def travel_times(self, origins, destination):
+        # Chunks go out concurrently; a failed chunk just yields no routes
+        chunks = [origins[start:start + self.max_origins_per_call]
+                  for start in range(0, len(origins), self.max_origins_per_call)]
+        responses = await asyncio.gather(
+            *(self._travel_times_chunk(chunk, destination) for chunk in chunks),
+            return_exceptions=True
+        )
+
+        results = []
+        for chunk, durations in zip(chunks, responses):
+            results.extend([None] * len(chunk) if isinstance(durations, BaseException) else durations)
+        return results
+
+    async def _travel_times_chunk(self, origins, destination):
+        raise NotImplementedError
+
+
+def _latlng(point):
+    return f"{point[0]},{point[1]}"
+
+
+# -----------------------
+# Google Maps
+# -----------------------
+class GoogleRoutingProvider(RoutingProvider):
+    name = "google"
+    # Distance Matrix allows 25 origins and 100 elements per request
+    max_origins_per_call = 25
+
+    def __init__(self, api_key=GOOGLE_KEY):
+        self.api_key = api_key
+
+    async def route(self, origin, destination):
+        params = {
+            "origin": _latlng(origin),
+            "destination": _latlng(destination),
+            "mode": "driving",
+            "key": self.api_key
+        }
+        response = await get_json(DIRECTIONS_URL, params=params)
+        if not response.get("routes"):
+            raise RouteNotFound(response.get("status", "no routes"))
+
+        leg = response["routes"][0]["legs"][0]
+        return {
+            "distance": leg["distance"]["value"],
+            "duration": leg["duration"]["value"],
+            "summary": response["routes"][0]["summary"]
+        }
+
+    async def _travel_times_chunk(self, origins, destination):
+        params = {
+            "origins": "|".join(_latlng(o) for o in origins),
+            "destinations": _latlng(destination),
+            "mode": "driving",
+            "key": self.api_key
+        }
+        response = await get_json(DISTANCE_MATRIX_URL, params=params)
+        rows = response.get("rows") or []
+        if len(rows) != len(origins):
+            return [None] * len(origins)
+
+        durations = []
+        for row in rows:
+            element = row["elements"][0]
+            durations.append(element["duration"]["value"] if element.get("status") == "OK" else None)
+        return durations
+
+
+# -----------------------
+# Local Fake (tests / load runs)
+# -----------------------
+class FakeRoutingProvider(RoutingProvider):
+    """Straight-line distance stretched by a road factor at a fixed speed.
+    Counts calls so tests can assert on batching."""
+
+    name = "fake"
+
+    def __init__(self, speed_mps=10.0, road_factor=1.3, max_origins_per_call=25):
+        self.speed_mps = speed_mps
+        self.road_factor = road_factor
+        self.max_origins_per_call = max_origins_per_call
+        self.route_calls = 0
+        self.matrix_calls = 0
+
+    def _distance(self, a, b):
+        return haversine_m(a[0], a[1], b[0], b[1]) * self.road_factor
+
+    async def route(self, origin, destination):
+        self.route_calls += 1
+        distance = self._distance(origin, destination)
+        return {
+            "distance": int(distance),
+            "duration": int(distance / self.speed_mps),
+            "summary": "fake"
+        }
+
+    async def _travel_times_chunk(self, origins, destination):
+        self.matrix_calls += 1
+        return [int(self._distance(o, destination) / self.speed_mps) for o in origins]
+
+
+# -----------------------
+# Caching Wrapper
+# -----------------------
+class CachedRoutingProvider(RoutingProvider):
+    """Serve routes and per-pair travel times from a RouteCache, sending only
+    the misses to the wrapped provider."""
+
+    def __init__(self, provider, cache):
+        self.provider = provider
+        self.cache = cache
+        self.name = provider.name
+        self.max_origins_per_call = provider.max_origins_per_call
+
+    async def route(self, origin, destination):
+        cached = self.cache.get("route", origin, destination)
+        if cached is not None:
+            return cached
+
+        result = await self.provider.route(origin, destination)
+        self.cache.put("route", origin, destination, result)
+        return result
+
+    async def travel_times(self, origins, destination):
+        results = [self.cache.get("eta", o, destination) for o in origins]
+        missing = [i for i, r in enumerate(results) if r is None]
+        if missing:
+            fetched = await self.provider.travel_times([origins[i] for i in missing], destination)
+            for i, duration in zip(missing, fetched):
+                results[i] = duration
+                if duration is not None:
+                    self.cache.put("eta", origins[i], destination, duration)
+        return results
+
+
+# -----------------------
+# Timing Wrapper
+# -----------------------
+class TimedRoutingProvider(RoutingProvider):
+    """Reports every call to observe(provider_name, call, seconds, ok).
+    Sits inside the cache, so only calls that reach the provider are timed."""
+
+    def __init__(self, provider, observe):
+        self.provider = provider
+        self.observe = observe
+        self.name = provider.name
+        self.max_origins_per_call = provider.max_origins_per_call
+
+    async def _timed(self, call, coro):
+        started = time.perf_counter()
+        ok = False
+        try:
+            result = await coro
+            ok = True
+            return result
+        finally:
+            self.observe(self.name, call, time.perf_counter() - started, ok)
+
+    async def route(self, origin, destination):
+        return await self._timed("route", self.provider.route(origin, destination))
+
+    async def travel_times(self, origins, destination):
+        return await self._timed("travel_times", self.provider.travel_times(origins, destination))
+
+
+def get_routing_provider(name=None, cached=ROUTE_CACHE_ENABLED, observe=None):
+    name = name or os.getenv("ROUTING_PROVIDER", "google")
+    if name == "google":
+        provider = GoogleRoutingProvider()
+    elif name == "fake":
+        provider = FakeRoutingProvider()
+    elif name == "local":
+        provider = get_local_routing_provider()
+        # Already in-process and sub-millisecond, so not worth caching
+        cached = False
+    else:
+        raise ValueError(f"Unknown routing provider: {name}")
+    if observe:
+        provider = TimedRoutingProvider(provider, observe)
+    return CachedRoutingProvider(provider, route_cache) if cached else provider
+
+
+def get_local_routing_provider(path=ROAD_GRAPH_PATH):
+    from local_routing import RoadGraph, LocalRoutingProvider
+
+    if path:
+        graph = RoadGraph.load(path, landmarks=ROAD_GRAPH_LANDMARKS)
+    else:
+        graph = RoadGraph.synthetic_grid(*CAMPUS_CENTER, landmarks=ROAD_GRAPH_LANDMARKS)
+    return LocalRoutingProvider(graph)
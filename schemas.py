@@ -0,0 +1,237 @@
+from datetime import date, datetime
+from pydantic import BaseModel
+
+# Timestamps in responses stay ISO strings exactly as the handlers format
+# them, so typing the bodies doesn't change what clients receive.
+
+# -----------------------
+# Requests
+# -----------------------
+class Location(BaseModel):
+    lat: float
+    lng: float
+    address: str
+
+class RideRequest(BaseModel):
+    rider_id: str
+    pickup: Location
+    dropoff: Location
+
+class DriverOnboarding(BaseModel):
+    user_id: str
+    name: str
+    license_number: str
+    license_expiry: date  # format: "YYYY-MM-DD"
+    # Optional: onboarding never required a vehicle (the columns are nullable)
+    vehicle_type: str | None = None
+    vehicle_plate: str | None = None
+    capacity: int = 4
+    max_detour_minutes: int = 10
+
+class SetDriverLocationRequest(BaseModel):
+    driver_id: str
+    lat: float
+    lng: float
+    accuracy: float | None = None
+
+class RideRef(BaseModel):
+    ride_id: str
+
+class AssignBatchRequest(BaseModel):
+    ride_ids: list[str] | None = None
+
+class FallbackCheckRequest(BaseModel):
+    ride_id: str
+    timeout: float = 30
+
+class PingLocation(BaseModel):
+    lat: float
+    lng: float
+    accuracy: float | None = None
+
+class LocationPing(BaseModel):
+    ride_id: str
+    driver_id: str
+    location: PingLocation
+    # Batched uploads may carry the device time of each ping; it must fall
+    # within INGEST_MAX_PING_AGE_S / INGEST_MAX_PING_AHEAD_S of server time
+    timestamp: datetime | None = None
+
+class LocationBatch(BaseModel):
+    pings: list[LocationPing] = []
+
+class DriverRideRequest(BaseModel):
+    ride_id: str
+    driver_id: str
+
+class CancelRideRequest(BaseModel):
+    ride_id: str
+    rider_id: str
+
+class DriverDashboardRequest(BaseModel):
+    driver_id: str
+    cursor: str | None = None
+    limit: int | None = None
+
+class RiderHistoryRequest(BaseModel):
+    rider_id: str
+    cursor: str | None = None
+    limit: int | None = None
+
+# -----------------------
+# Responses
+# -----------------------
+class Message(BaseModel):
+    message: str
+
+class DriverLocationSet(BaseModel):
+    message: str
+    driver_id: str
+    lat: float | None
+    lng: float | None
+    filtered: str
+
+class RouteCacheStats(BaseModel):
+    entries: int
+    hits: int
+    store_hits: int
+    misses: int
+    evictions: int
+    hit_rate: float
+
+class HeatmapCell(BaseModel):
+    lat: float
+    lng: float
+    demand: float
+    supply: float
+    surge: float
+
+class Heatmap(BaseModel):
+    cell_size_m: float
+    updated_at: str | None
+    compute_ms: float
+    surge_enabled: bool
+    cells: list[HeatmapCell]
+
+class RideQuote(BaseModel):
+    ride_id: str
+    fare_estimate: int
+    surge_multiplier: float
+    summary: str | None
+    distance_m: int
+    duration_s: int
+
+class Assignment(BaseModel):
+    ride_id: str
+    driver_id: str
+    detour_duration_s: int
+    pooled: bool
+    status: str
+
+class BatchAssignment(BaseModel):
+    ride_id: str
+    driver_id: str
+    detour_duration_s: int
+
+class BatchReport(BaseModel):
+    rides: int
+    matched: int
+    drivers: int | None = None
+    total_detour_s: float | None = None
+    greedy_matched: int | None = None
+    greedy_total_detour_s: float | None = None
+    detour_saved_s: float | None = None
+    solve_ms: float | None = None
+    batch_ms: float | None = None
+    rides_per_s: float | None = None
+    assignments: list[BatchAssignment] = []
+
+class FallbackStatus(BaseModel):
+    status: str
+    seconds_since_assignment: float | None = None
+    elapsed_s: float | None = None
+
+class PingAck(BaseModel):
+    message: str
+    ride_id: str
+    driver_id: str
+    timestamp: str
+    stored: bool
+
+class RejectedPing(BaseModel):
+    index: int
+    detail: str
+
+class PingBatchAck(BaseModel):
+    message: str
+    accepted: int
+    stored: int
+    rejected: list[RejectedPing]
+
+class RideStatusChange(BaseModel):
+    ride_id: str
+    status: str
+    message: str
+
+class RideCompleted(BaseModel):
+    ride_id: str
+    status: str
+    completed_at: str
+
+class ActiveRide(BaseModel):
+    ride_id: str
+    status: str
+
+class CompletedRide(BaseModel):
+    ride_id: str
+    pickup: str | None
+    dropoff: str | None
+    fare: int | None
+
+class DriverDashboardPage(BaseModel):
+    active_ride: ActiveRide | None
+    completed_rides: list[CompletedRide]
+    next_cursor: str | None
+
+class RiderRide(BaseModel):
+    ride_id: str
+    status: str
+    fare: int | None
+    pickup: str | None
+    dropoff: str | None
+    created_at: str
+
+class RiderHistoryPage(BaseModel):
+    rides: list[RiderRide]
+    next_cursor: str | None
+
+class DriverLocation(BaseModel):
+    ride_id: str | None
+    driver_id: str | None
+    lat: float
+    lng: float
+    timestamp: str
+
+class TracePoint(BaseModel):
+    lat: float
+    lng: float
+    timestamp: str
+
+class RideTraceBody(BaseModel):
+    ride_id: str
+    driver_id: str | None
+    started_at: str | None
+    ended_at: str | None
+    points: int
+    polyline: str | None = None
+    path: list[TracePoint] | None = None
+
+class DashboardSummary(BaseModel):
+    total_rides: int
+    completed_rides: int
+    cancelled_rides: int
+    in_progress_rides: int
+    total_drivers: int
+    active_drivers: int
+    idle_drivers: int
+    total_riders: int
@@ -0,0 +1,83 @@
+import argparse
+import asyncio
+import time
+import uuid
+from datetime import datetime, timedelta
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import APIRoute, serialize_response
+from schemas import RiderHistoryPage
+
+# -------------------------------------
+# Response Serialization Microbenchmark
+# -------------------------------------
+# Times what FastAPI does with a rider_history page after the handler
+# returns it, per request:
+#
+#   before: untyped dict -> jsonable_encoder -> JSONResponse (json.dumps)
+#   after:  dict -> RiderHistoryPage (pydantic-core) -> ORJSONResponse
+#
+#   python serialization_bench.py --rows 20 100 1000
+
+
+def make_page(rows):
+    created = datetime(2025, 6, 1, 8, 0)
+    return {
+        "rides": [
+            {
+                "ride_id": str(uuid.uuid4()),
+                "status": "completed",
+                "fare": 1250 + i,
+                "pickup": f"{100 + i} University Dr, College Station, TX",
+                "dropoff": f"{200 + i} Texas Ave, Bryan, TX",
+                "created_at": (created - timedelta(minutes=37 * i)).isoformat()
+            } for i in range(rows)
+        ],
+        "next_cursor": "MjAyNS0wNi0wMVQwODowMDowMHxyaWRlLTAwMQ=="
+    }
+
+
+async def before(page):
+    content = await serialize_response(response_content=page)
+    return JSONResponse(content).body
+
+
+def make_after():
+    field = APIRoute("/rider_history", lambda: None, response_model=RiderHistoryPage).response_field
+
+    async def after(page):
+        content = await serialize_response(field=field, response_content=page)
+        return ORJSONResponse(content).body
+
+    return after
+
+
+async def timed(render, page, iterations):
+    body = await render(page)
+    started = time.perf_counter()
+    for _ in range(iterations):
+        await render(page)
+    return (time.perf_counter() - started) / iterations * 1e6, len(body)
+
+
+async def run(rows_list, iterations):
+    after = make_after()
+    results = []
+    for rows in rows_list:
+        page = make_page(rows)
+        # Fewer repetitions for big pages keeps the run short
+        n = max(20, iterations * 20 // max(rows, 20))
+        before_us, before_bytes = await timed(before, page, n)
+        after_us, after_bytes = await timed(after, page, n)
+        results.append((rows, before_us, after_us, before_bytes, after_bytes))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-request serialization cost of rider_history pages")
+    parser.add_argument("--rows", type=int, nargs="+", default=[20, 100, 1000])
+    parser.add_argument("--iterations", type=int, default=2000, help="repetitions for a 20-row page")
+    args = parser.parse_args()
+
+    print(f"{'rows':>6}{'before_us':>12}{'after_us':>12}{'speedup':>9}{'bytes':>9}")
+    for rows, before_us, after_us, before_bytes, after_bytes in asyncio.run(run(args.rows, args.iterations)):
+        print(f"{rows:>6}{before_us:>12.1f}{after_us:>12.1f}{before_us / after_us:>8.1f}x{after_bytes:>9}")
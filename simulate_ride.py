@@ -1,4 +1,4 @@
-import requests
+import asyncio
 import uuid
 import os
 from dotenv import load_dotenv
@@ -6,11 +6,12 @@ from datetime import datetime, UTC
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from models import Ride, RideStatus, User
+from routing import get_routing_provider, RouteNotFound
+from http_client import close_http_client
 from sqlalchemy.exc import IntegrityError
 
 # Load environment variables
 load_dotenv()
-GOOGLE_KEY = os.getenv("GOOGLE_MAPS_API_KEY")
 DATABASE_URL = os.getenv("DATABASE_URL")
 
 # -------------------------
@@ -29,29 +30,26 @@ dropoff = {
 }
 
 # -------------------------------
-# Get Route from Google Maps
+# Get Route
 # -------------------------------
 def get_route(pickup, dropoff):
-    url = "https://maps.googleapis.com/maps/api/directions/json"
-    params = {
-        "origin": f"{pickup['lat']},{pickup['lng']}",
-        "destination": f"{dropoff['lat']},{dropoff['lng']}",
-        "mode": "driving",
-        "key": GOOGLE_KEY
-    }
-    response = requests.get(url, params=params)
-    data = response.json()
+    # One lookup through ROUTING_PROVIDER and the snapped route cache; only with
+    # ROUTE_CACHE_DB set is the cache shared with the API across processes.
+    # The script inserts a requested ride and sends no GPS pings.
+    async def fetch():
+        try:
+            return await get_routing_provider().route(
+                (pickup["lat"], pickup["lng"]),
+                (dropoff["lat"], dropoff["lng"])
+            )
+        finally:
+            await close_http_client()
 
-    if not data["routes"]:
+    try:
+        return asyncio.run(fetch())
+    except RouteNotFound:
         raise Exception("No route found.")
 
-    leg = data["routes"][0]["legs"][0]
-    return {
-        "distance": leg["distance"]["value"],   # in meters
-        "duration": leg["duration"]["value"],   # in seconds
-        "summary": data["routes"][0]["summary"]
-    }
-
 # -----------------------------------
 # Insert Simulated Rider If Needed
 # -----------------------------------
@@ -0,0 +1,436 @@
+import argparse
+import asyncio
+import heapq
+import json
+import math
+import os
+import random
+import time
+from collections import namedtuple
+
+# -------------------------------------
+# Discrete-Event Matching Simulator
+# -------------------------------------
+# Replays a ride request stream (recorded from the DB, or synthetic) against
+# the matching logic on a fake clock, with drivers that drive to the pickup
+# and on to the dropoff in routed time. Nothing sleeps unless --speedup asks
+# for it, so an hour of traffic takes seconds. Reports matching latency
+# (wall clock), time-to-pickup (simulated) and throughput per variant.
+#
+#   python simulator.py --riders 2000 --drivers 150 --hours 1
+#   python simulator.py --variants greedy,batch --batch-window 5 --json sim.json
+#   python simulator.py --from-db --start 2025-03-01T08:00 --end 2025-03-01T10:00
+
+CAMPUS_CENTER = (30.6127, -96.3414)
+VARIANTS = ("nearest", "greedy", "batch")
+
+SimRide = namedtuple("SimRide", "id requested_at pickup_lat pickup_lng dropoff_lat dropoff_lng")
+
+
+class SimDriver:
+    # Quacks like a DriverProfile as far as score_candidates / cost_matrix care
+    __slots__ = ("user_id", "lat", "lng", "max_detour_minutes", "online_at", "offline_at")
+
+    def __init__(self, user_id, lat, lng, max_detour_minutes=10, online_at=0.0, offline_at=math.inf):
+        self.user_id = user_id
+        self.lat = lat
+        self.lng = lng
+        self.max_detour_minutes = max_detour_minutes
+        self.online_at = online_at
+        self.offline_at = offline_at
+
+    def copy(self):
+        return SimDriver(self.user_id, self.lat, self.lng, self.max_detour_minutes, self.online_at, self.offline_at)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replay ride requests against the matching logic")
+    parser.add_argument("--variants", default=",".join(VARIANTS),
+                        help=f"comma-separated, from {', '.join(VARIANTS)}")
+    parser.add_argument("--riders", type=int, default=1000, help="synthetic ride requests")
+    parser.add_argument("--drivers", type=int, default=100, help="synthetic drivers")
+    parser.add_argument("--hours", type=float, default=1.0, help="synthetic request window")
+    parser.add_argument("--spread", type=float, default=0.012, help="synthetic point spread (degrees)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--from-db", action="store_true", help="replay recorded rides and driver sightings")
+    parser.add_argument("--start", help="ISO start of the recorded window (UTC)")
+    parser.add_argument("--end", help="ISO end of the recorded window (UTC)")
+    parser.add_argument("--routing", choices=["local", "fake"], default="local")
+    parser.add_argument("--candidates", type=int, default=int(os.getenv("MATCH_CANDIDATE_LIMIT", "10")))
+    parser.add_argument("--radius-m", type=float, default=float(os.getenv("MATCH_RADIUS_M", "8000")))
+    parser.add_argument("--max-detour-minutes", type=float, default=10)
+    parser.add_argument("--batch-window", type=float, default=float(os.getenv("BATCH_WINDOW_S", "2")))
+    parser.add_argument("--max-wait", type=float, default=600, help="riders give up after this many seconds")
+    parser.add_argument("--speedup", type=float, default=0,
+                        help="pace the replay at N x real time (0 = as fast as possible)")
+    parser.add_argument("--json", metavar="PATH", help="also write the report as JSON")
+    return parser.parse_args()
+
+
+# -----------------------
+# Workloads
+# -----------------------
+def synthetic_workload(riders, drivers, hours, spread, max_detour_minutes, seed, center=CAMPUS_CENTER):
+    """Poisson arrivals over the window, points normally spread around center."""
+    rng = random.Random(seed)
+
+    def point():
+        return (center[0] + max(-2 * spread, min(2 * spread, rng.gauss(0, spread))),
+                center[1] + max(-2 * spread, min(2 * spread, rng.gauss(0, spread))))
+
+    rides, t = [], 0.0
+    rate = riders / (hours * 3600)
+    for i in range(riders):
+        t += rng.expovariate(rate)
+        (plat, plng), (dlat, dlng) = point(), point()
+        rides.append(SimRide(f"sim-ride-{i}", t, plat, plng, dlat, dlng))
+    fleet = [SimDriver(f"sim-driver-{i}", *point(), max_detour_minutes) for i in range(drivers)]
+    return rides, fleet
+
+
+def recorded_workload(db, start, end, max_detour_minutes):
+    """Rides requested in [start, end) and the drivers seen during it.
+
+    A driver is online from their first sighting (a location ping or the
+    start of a ride trace) to their last, starting where first seen. Drivers
+    never seen are online throughout at their profile position.
+    """
+    from models import Ride, LocationUpdate, RideTrace, DriverProfile, as_utc
+    from trajectory import decode_trace
+
+    t0 = as_utc(start)
+
+    def offset(ts):
+        return (as_utc(ts) - t0).total_seconds()
+
+    rides = [
+        SimRide(r.id, offset(r.created_at), r.pickup_lat, r.pickup_lng, r.dropoff_lat, r.dropoff_lng)
+        for r in db.query(Ride).filter(Ride.created_at >= start, Ride.created_at < end,
+                                       Ride.pickup_lat.isnot(None), Ride.dropoff_lat.isnot(None))
+        .order_by(Ride.created_at)
+    ]
+
+    seen = {}  # driver_id -> [first t, lat, lng, last t]
+
+    def sighting(driver_id, t, lat, lng):
+        entry = seen.get(driver_id)
+        if entry is None:
+            seen[driver_id] = [t, lat, lng, t]
+        elif t < entry[0]:
+            entry[:3] = [t, lat, lng]
+        else:
+            entry[3] = max(entry[3], t)
+
+    pings = db.query(LocationUpdate.driver_id, LocationUpdate.timestamp, LocationUpdate.lat, LocationUpdate.lng) \
+        .filter(LocationUpdate.timestamp >= start, LocationUpdate.timestamp < end) \
+        .order_by(LocationUpdate.timestamp).yield_per(5000)
+    for driver_id, ts, lat, lng in pings:
+        sighting(driver_id, offset(ts), lat, lng)
+
+    # Finished rides only have their compacted trace left
+    traces = db.query(RideTrace).filter(RideTrace.started_at < end, RideTrace.ended_at >= start)
+    for trace in traces:
+        points = [p for p in decode_trace(trace) if 0 <= offset(p[0]) < offset(end)]
+        if points:
+            sighting(trace.driver_id, offset(points[0][0]), points[0][1], points[0][2])
+            sighting(trace.driver_id, offset(points[-1][0]), points[-1][1], points[-1][2])
+
+    profiles = db.query(DriverProfile).filter(DriverProfile.lat.isnot(None), DriverProfile.lng.isnot(None)).all()
+    limits = {p.user_id: p.max_detour_minutes or max_detour_minutes for p in profiles}
+    fleet = [
+        SimDriver(driver_id, lat, lng, limits.get(driver_id, max_detour_minutes), first, last)
+        for driver_id, (first, lat, lng, last) in seen.items()
+    ] + [
+        SimDriver(p.user_id, p.lat, p.lng, limits[p.user_id])
+        for p in profiles if p.user_id not in seen
+    ]
+    return rides, fleet
+
+
+# -----------------------
+# Simulation
+# -----------------------
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def advance(self, t):
+        self.now = max(self.now, t)
+
+
+class Simulation:
+    """One matching variant over one workload.
+
+    nearest: straight-line nearest idle driver, no routing.
+    greedy:  what assign_driver does - route the k nearest idle drivers and
+             take the quickest, one ride at a time as they arrive.
+    batch:   what MATCHING_MODE=batch does - every batch_window_s, solve
+             all waiting rides against idle drivers at once.
+
+    Drivers teleport between pickup and dropoff: positions only change when
+    a leg ends, which is all matching ever reads.
+    """
+
+    def __init__(self, variant, provider, rides, drivers, candidates=10, radius_m=8000,
+                 batch_window_s=2.0, max_wait_s=600, speedup=0):
+        from spatial_index import DriverIndex
+
+        self.variant = variant
+        self.provider = provider
+        self.rides = rides
+        self.drivers = {d.user_id: d.copy() for d in drivers}
+        self.candidates = candidates
+        self.radius_m = radius_m
+        self.batch_window_s = batch_window_s
+        self.max_wait_s = max_wait_s
+        self.speedup = speedup
+
+        self.clock = FakeClock()
+        self.index = DriverIndex()
+        self._events = []
+        self._seq = 0
+        self.waiting = {}   # ride_id -> SimRide, in request order
+        self.on_trip = set()
+
+        self.match_ms = []      # wall time per matching decision (per window for batch)
+        self.wait_s = []        # request -> matched
+        self.pickup_s = []      # request -> driver at pickup
+        self.busy_s = 0.0
+        self.abandoned = 0
+        self.unroutable = 0
+        self._batch_due = False
+
+    def schedule(self, t, kind, payload=None):
+        self._seq += 1
+        heapq.heappush(self._events, (t, self._seq, kind, payload))
+
+    # ---- matching variants ----
+
+    def _nearby(self, ride):
+        ids = [d for d, _ in self.index.nearest_idle(ride.pickup_lat, ride.pickup_lng,
+                                                     k=self.candidates, radius_m=self.radius_m)]
+        return [self.drivers[d] for d in ids]
+
+    async def _match_one(self, ride):
+        from matching import score_candidates
+
+        started = time.perf_counter()
+        nearby = self._nearby(ride)
+        if self.variant == "nearest":
+            choice = nearby[0].user_id if nearby else None
+            self.match_ms.append((time.perf_counter() - started) * 1000)
+            if choice is None:
+                return False
+            eta = (await self.provider.travel_times([(nearby[0].lat, nearby[0].lng)],
+                                                    (ride.pickup_lat, ride.pickup_lng)))[0]
+            if eta is None:
+                return False
+            return await self._assign(ride, choice, eta)
+
+        scored = await score_candidates(self.provider, nearby, (ride.pickup_lat, ride.pickup_lng)) if nearby else []
+        self.match_ms.append((time.perf_counter() - started) * 1000)
+        if not scored:
+            return False
+        return await self._assign(ride, *scored[0])
+
+    async def _match_waiting(self, driver):
+        # One driver just freed up: offer it to the longest-waiting rides in reach
+        from spatial_index import haversine_m
+
+        attempts = 0
+        for ride in list(self.waiting.values()):
+            if haversine_m(driver.lat, driver.lng, ride.pickup_lat, ride.pickup_lng) > self.radius_m:
+                continue
+            if await self._match_one(ride):
+                return
+            attempts += 1
+            if attempts >= self.candidates:
+                return
+
+    async def _match_batch(self):
+        from batch_matching import cost_matrix, solve_assignment
+
+        rides = list(self.waiting.values())
+        if not rides:
+            return
+        started = time.perf_counter()
+        candidates = {ride.id: self._nearby(ride) for ride in rides}
+        cost, driver_ids = await cost_matrix(self.provider, rides, candidates)
+        pairs = solve_assignment(cost)
+        self.match_ms.append((time.perf_counter() - started) * 1000)
+        for i, j in pairs:
+            await self._assign(rides[i], driver_ids[j], cost[i, j])
+
+    # ---- driver lifecycle ----
+
+    async def _assign(self, ride, driver_id, eta_s):
+        from routing import RouteNotFound
+
+        now = self.clock.now
+        try:
+            trip = await self.provider.route((ride.pickup_lat, ride.pickup_lng), (ride.dropoff_lat, ride.dropoff_lng))
+        except RouteNotFound:
+            # request_ride would have refused it
+            del self.waiting[ride.id]
+            self.unroutable += 1
+            return False
+        del self.waiting[ride.id]
+        self.index.set_busy(driver_id)
+        self.on_trip.add(driver_id)
+        self.wait_s.append(now - ride.requested_at)
+        self.pickup_s.append(now + eta_s - ride.requested_at)
+        self.busy_s += eta_s + trip["duration"]
+        self.schedule(now + eta_s + trip["duration"], "dropoff", (driver_id, ride))
+        return True
+
+    def _go_idle(self, driver):
+        self.index.update_position(driver.user_id, driver.lat, driver.lng, busy=False)
+
+    # ---- event loop ----
+
+    async def run(self):
+        for ride in self.rides:
+            self.schedule(ride.requested_at, "request", ride)
+        for driver in self.drivers.values():
+            self.schedule(driver.online_at, "online", driver)
+            if math.isfinite(driver.offline_at):
+                self.schedule(driver.offline_at, "offline", driver)
+
+        wall_started = time.perf_counter()
+        while self._events:
+            t, _, kind, payload = heapq.heappop(self._events)
+            if self.speedup:
+                ahead = t / self.speedup - (time.perf_counter() - wall_started)
+                if ahead > 0:
+                    await asyncio.sleep(ahead)
+            self.clock.advance(t)
+
+            if kind == "request":
+                self.waiting[payload.id] = payload
+                self.schedule(t + self.max_wait_s, "abandon", payload)
+                if self.variant != "batch":
+                    await self._match_one(payload)
+                elif not self._batch_due:
+                    # Windows only tick while someone waits, so idle stretches cost nothing
+                    self._batch_due = True
+                    self.schedule(t + self.batch_window_s, "batch")
+            elif kind == "abandon":
+                if self.waiting.pop(payload.id, None):
+                    self.abandoned += 1
+            elif kind == "online":
+                self._go_idle(payload)
+                if self.variant != "batch":
+                    await self._match_waiting(payload)
+            elif kind == "offline":
+                # A driver mid-trip finishes it first
+                if payload.user_id not in self.on_trip:
+                    self.index.remove(payload.user_id)
+            elif kind == "dropoff":
+                driver_id, ride = payload
+                driver = self.drivers[driver_id]
+                driver.lat, driver.lng = ride.dropoff_lat, ride.dropoff_lng
+                self.on_trip.discard(driver_id)
+                if self.clock.now >= driver.offline_at:
+                    # Online (for utilization) until the trip they were on ends
+                    driver.offline_at = self.clock.now
+                    self.index.remove(driver_id)
+                else:
+                    self._go_idle(driver)
+                    if self.variant != "batch":
+                        await self._match_waiting(driver)
+            elif kind == "batch":
+                await self._match_batch()
+                self._batch_due = bool(self.waiting)
+                if self._batch_due:
+                    self.schedule(t + self.batch_window_s, "batch")
+
+        return self.report(time.perf_counter() - wall_started)
+
+    def report(self, wall_s):
+        sim_s = self.clock.now
+        online_s = sum(min(d.offline_at, sim_s) - min(d.online_at, sim_s) for d in self.drivers.values())
+        matched = len(self.pickup_s)
+
+        def pct(values, p, scale=1.0, digits=1):
+            value = percentile(values, p)
+            return round(value / scale, digits) if value is not None else None
+
+        return {
+            "variant": self.variant,
+            "rides": len(self.rides),
+            "matched": matched,
+            "abandoned": self.abandoned,
+            "unroutable": self.unroutable,
+            "match_decisions": len(self.match_ms),
+            "match_p50_ms": pct(self.match_ms, 50, digits=3),
+            "match_p95_ms": pct(self.match_ms, 95, digits=3),
+            "match_p99_ms": pct(self.match_ms, 99, digits=3),
+            "matches_per_s": round(matched / (sum(self.match_ms) / 1000), 1) if sum(self.match_ms) else None,
+            "wait_p50_s": pct(self.wait_s, 50),
+            "wait_p95_s": pct(self.wait_s, 95),
+            "pickup_p50_min": pct(self.pickup_s, 50, 60),
+            "pickup_p95_min": pct(self.pickup_s, 95, 60),
+            "pickup_p99_min": pct(self.pickup_s, 99, 60),
+            "utilization": round(self.busy_s / online_s, 3) if online_s > 0 else None,
+            "sim_s": round(sim_s, 1),
+            "wall_s": round(wall_s, 3),
+            "speedup": round(sim_s / wall_s) if wall_s else None
+        }
+
+
+def print_report(reports):
+    columns = [
+        ("variant", 9), ("matched", 8), ("abandoned", 10), ("match_p50_ms", 13), ("match_p95_ms", 13),
+        ("matches_per_s", 14), ("wait_p95_s", 11), ("pickup_p50_min", 15), ("pickup_p95_min", 15),
+        ("utilization", 12), ("speedup", 12)
+    ]
+    print("".join(f"{name:>{width}}" for name, width in columns))
+    for report in reports:
+        print("".join(f"{str(report[name]):>{width}}" for name, width in columns))
+
+
+async def main(args):
+    from routing import get_routing_provider
+
+    if args.from_db:
+        from datetime import datetime
+        from database import SessionLocal
+
+        db = SessionLocal()
+        try:
+            rides, drivers = recorded_workload(db, datetime.fromisoformat(args.start),
+                                               datetime.fromisoformat(args.end), args.max_detour_minutes)
+        finally:
+            db.close()
+    else:
+        rides, drivers = synthetic_workload(args.riders, args.drivers, args.hours, args.spread,
+                                            args.max_detour_minutes, args.seed)
+
+    provider = get_routing_provider(args.routing, cached=False)
+    reports = []
+    for variant in args.variants.split(","):
+        if variant not in VARIANTS:
+            raise SystemExit(f"Unknown variant {variant!r}")
+        sim = Simulation(variant, provider, rides, drivers, args.candidates, args.radius_m,
+                         args.batch_window, args.max_wait, args.speedup)
+        reports.append(await sim.run())
+    return reports
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.from_db and not (args.start and args.end):
+        raise SystemExit("--from-db needs --start and --end")
+    reports = asyncio.run(main(args))
+    print_report(reports)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "reports": reports}, f, indent=2, sort_keys=True)
@@ -0,0 +1,157 @@
+import math
+import threading
+from collections import defaultdict
+
+METERS_PER_DEG_LAT = 111_320.0
+EARTH_RADIUS_M = 6_371_000.0
+
+
+def haversine_m(lat1, lng1, lat2, lng2):
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dlat = p2 - p1
+    dlng = math.radians(lng2 - lng1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def _ring_cells(ci, cj, ring, max_ring_i, max_ring_j):
+    """Cells exactly `ring` steps (Chebyshev) from (ci, cj), clipped to the
+    search box; only the ring's edges, not the square inside it."""
+    if ring == 0:
+        yield (ci, cj)
+        return
+    ri, rj = min(ring, max_ring_i), min(ring, max_ring_j)
+    if ring <= max_ring_i:
+        for j in range(cj - rj, cj + rj + 1):
+            yield (ci - ring, j)
+            yield (ci + ring, j)
+        ri = ring - 1
+    if ring <= max_ring_j:
+        for i in range(ci - ri, ci + ri + 1):
+            yield (i, cj - ring)
+            yield (i, cj + ring)
+
+
+# -----------------------
+# Uniform Lat/Lng Grid
+# -----------------------
+class GridIndex:
+    """Bucket points into fixed-size grid cells so nearest-neighbour lookups only
+    touch the cells around the query point instead of every point."""
+
+    def __init__(self, cell_size_m=500):
+        self.cell_size_m = cell_size_m
+        self.cell_deg = cell_size_m / METERS_PER_DEG_LAT
+        self._cells = defaultdict(dict)   # (i, j) -> {key: (lat, lng)}
+        self._points = {}                 # key -> (lat, lng, (i, j))
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._points)
+
+    def __contains__(self, key):
+        return key in self._points
+
+    def _cell(self, lat, lng):
+        return (math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg))
+
+    def upsert(self, key, lat, lng):
+        cell = self._cell(lat, lng)
+        with self._lock:
+            old = self._points.get(key)
+            if old and old[2] != cell:
+                bucket = self._cells[old[2]]
+                bucket.pop(key, None)
+                if not bucket:
+                    del self._cells[old[2]]
+            self._cells[cell][key] = (lat, lng)
+            self._points[key] = (lat, lng, cell)
+
+    def remove(self, key):
+        with self._lock:
+            old = self._points.pop(key, None)
+            if old:
+                bucket = self._cells[old[2]]
+                bucket.pop(key, None)
+                if not bucket:
+                    del self._cells[old[2]]
+
+    def get(self, key):
+        point = self._points.get(key)
+        return (point[0], point[1]) if point else None
+
+    def nearest(self, lat, lng, k=10, radius_m=5000, predicate=None):
+        """Return up to k (key, distance_m) pairs within radius_m, closest first."""
+        ci, cj = self._cell(lat, lng)
+        cos_lat = max(math.cos(math.radians(lat)), 0.01)
+        # A cell is narrower east-west than north-south away from the equator
+        max_ring_i = math.ceil(radius_m / self.cell_size_m)
+        max_ring_j = math.ceil(radius_m / (self.cell_size_m * cos_lat))
+        found = []
+
+        with self._lock:
+            for ring in range(max(max_ring_i, max_ring_j) + 1):
+                for cell in _ring_cells(ci, cj, ring, max_ring_i, max_ring_j):
+                    bucket = self._cells.get(cell)
+                    if not bucket:
+                        continue
+                    for key, (plat, plng) in bucket.items():
+                        if predicate is not None and not predicate(key):
+                            continue
+                        dist = haversine_m(lat, lng, plat, plng)
+                        if dist <= radius_m:
+                            found.append((key, dist))
+
+                # Anything in an unvisited ring is at least this far away
+                if len(found) >= k:
+                    found.sort(key=lambda x: x[1])
+                    if found[k - 1][1] <= ring * self.cell_size_m * cos_lat:
+                        break
+
+        found.sort(key=lambda x: x[1])
+        return found[:k]
+
+
+# -----------------------
+# Driver Position Index
+# -----------------------
+class DriverIndex(GridIndex):
+    """Grid of driver GPS positions plus idle/busy membership, kept current by
+    the location and ride-state endpoints."""
+
+    def __init__(self, cell_size_m=500):
+        super().__init__(cell_size_m)
+        self._busy = set()
+
+    def update_position(self, driver_id, lat, lng, busy=None):
+        with self._lock:
+            self.upsert(driver_id, lat, lng)
+            if busy is not None:
+                self.set_busy(driver_id, busy)
+
+    def set_busy(self, driver_id, busy=True):
+        with self._lock:
+            if busy:
+                self._busy.add(driver_id)
+            else:
+                self._busy.discard(driver_id)
+
+    def is_busy(self, driver_id):
+        return driver_id in self._busy
+
+    def idle_positions(self):
+        with self._lock:
+            return [(lat, lng) for key, (lat, lng, _) in self._points.items() if key not in self._busy]
+
+    def nearest_idle(self, lat, lng, k=10, radius_m=5000):
+        return self.nearest(lat, lng, k=k, radius_m=radius_m,
+                            predicate=lambda d: d not in self._busy)
+
+    def load(self, positions, busy_ids):
+        """Replace the index contents from (driver_id, lat, lng) rows."""
+        with self._lock:
+            self._cells.clear()
+            self._points.clear()
+            self._busy = set(busy_ids)
+            for driver_id, lat, lng in positions:
+                self.upsert(driver_id, lat, lng)
@@ -1,26 +1,37 @@
+import json
 import requests
 import time
 
 RIDE_ID = "8323469e-4761-46e2-bfad-3d8850c62d18"  # replace this with your real ride ID
-POLL_INTERVAL = 5  # seconds
-API_URL = "http://localhost:8000/get_location"
+RETRY_INTERVAL = 5  # seconds
+STREAM_URL = f"http://localhost:8000/stream/location/{RIDE_ID}"
 
-def poll_location():
-    try:
-        response = requests.get(API_URL, params={"ride_id": RIDE_ID})
-        if response.status_code == 200:
-            data = response.json()
-            lat = data['lat']
-            lng = data['lng']
-            timestamp = data['timestamp']
-            print(f" Driver location: ({lat}, {lng}) at {timestamp}")
-        else:
-            print(f" No location data. Status: {response.status_code} - {response.text}")
-    except Exception as e:
-        print(" Error polling:", e)
+def stream_location():
+    # Server-Sent Events: the backend pushes each new ping, no polling needed
+    with requests.get(STREAM_URL, stream=True, timeout=(5, 60)) as response:
+        if response.status_code != 200:
+            print(f" Stream unavailable. Status: {response.status_code} - {response.text}")
+            return False
+
+        event = None
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                data = json.loads(line[len("data: "):])
+                if event == "location":
+                    print(f" Driver location: ({data['lat']}, {data['lng']}) at {data['timestamp']}")
+                elif event == "closed":
+                    print(" Ride finished, stream closed.")
+                    return True
+    return False
 
 if __name__ == "__main__":
-    print("📡 Starting location polling...")
+    print("📡 Subscribing to live location...")
     while True:
-        poll_location()
-        time.sleep(POLL_INTERVAL)
+        try:
+            if stream_location():
+                break
+        except Exception as e:
+            print(" Error streaming:", e)
+        time.sleep(RETRY_INTERVAL)